@@ -0,0 +1,77 @@
+"""
+    Measures the time to import parts of rescape_graphene in a fresh interpreter, after Django is set up, so that
+    importing a helper can be compared with importing the schema it no longer builds. rescape_graphene leaves
+    django.setup() to the host project, so its cost is reported separately.
+    Each statement is timed in --repeat fresh processes and the median is reported.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/import_time.py [--repeat 5] [--json path]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import rescape_graphene',
+    'from rescape_graphene import increment_prop_until_unique',
+    'from rescape_graphene import process_filter_kwargs',
+    'from rescape_graphene import UserType',
+    'from rescape_graphene import create_query_mutation_schema',
+    'from django.conf import settings; from django.utils.module_loading import import_string; '
+    "import_string(settings.GRAPHENE['SCHEMA'])"
+]
+
+# Django is set up, as the host project would, before timing the statement, and the setup is timed on its own
+_TIME_STATEMENT_SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import django
+django.setup()
+setup = time.perf_counter() - start
+start = time.perf_counter()
+exec(sys.argv[1])
+print(setup, time.perf_counter() - start)
+'''
+
+SETUP_STATEMENT = 'django.setup()'
+
+
+def time_statement(statement):
+    """
+        Runs statement in a fresh interpreter
+    :param statement: Python source to time
+    :return: [the seconds django.setup() took, the seconds the statement took]
+    """
+    output = subprocess.run(
+        [sys.executable, '-c', _TIME_STATEMENT_SCRIPT, statement],
+        check=True, stdout=subprocess.PIPE, universal_newlines=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    ).stdout
+    return [float(seconds) for seconds in output.strip().splitlines()[-1].split()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    timings = {statement: [time_statement(statement) for _ in range(args.repeat)] for statement in STATEMENTS}
+    report = dict(
+        **{SETUP_STATEMENT: statistics.median([setup for times in timings.values() for setup, _ in times])},
+        **{statement: statistics.median([seconds for _, seconds in times]) for statement, times in timings.items()}
+    )
+
+    print(f"{'ms':>10}  statement")
+    for statement, seconds in report.items():
+        print(f'{seconds * 1000:>10.1f}  {statement}')
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
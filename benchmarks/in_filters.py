@@ -0,0 +1,94 @@
+"""
+    Compares filtering by a list of related objects like user(foo_in: [{id: 1}, {id: 2}, ...]) as an OR of one Q
+    per object in a subquery, which is what process_filter_kwargs did for every list, with the single __in lookup
+    it now uses for lists of ids, which compares with an unnested array above in_unnest_threshold() ids.
+    Times building and compiling the SQL for 10, 1k and 50k ids, and with --execute also running the queries,
+    which needs the database of the settings.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/in_filters.py [--sizes 10 1000 50000] [--execute] [--json path]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+SIZES = [10, 1000, 50000]
+
+
+def or_subquery(related_model, key, objs):
+    from django.db.models import Q
+    from rescape_python_helpers import ramda as R
+    qs = R.map(lambda obj: Q(**obj), objs)
+    return [Q(**{key: related_model.objects.filter(R.reduce(lambda q1, q2: q1 | q2, R.head(qs), R.tail(qs)))})]
+
+
+def single_lookup(model, kwargs):
+    from rescape_graphene.graphql_helpers.schema_helpers import process_filter_kwargs
+    return process_filter_kwargs(model, **kwargs)
+
+
+def time_filter(model, q_expressions, execute):
+    """
+        Compiles, and optionally executes, model.objects.filter(*q_expressions)
+    :return: dict(compile=seconds, execute=seconds or None)
+    """
+    from django.db import connection
+    query = model.objects.filter(*q_expressions).values_list('id')
+    start = time.perf_counter()
+    query.query.get_compiler(connection=connection).as_sql()
+    compiled = time.perf_counter() - start
+    executed = None
+    if execute:
+        start = time.perf_counter()
+        list(query)
+        executed = time.perf_counter() - start
+    return dict(compile=compiled, execute=executed)
+
+
+def run(sizes, execute):
+    from django.contrib.auth.models import User
+    from sample_webapp.models import Foo
+
+    report = {}
+    for size in sizes:
+        objs = [dict(id=i) for i in range(size)]
+        start = time.perf_counter()
+        or_q_expressions = or_subquery(Foo, 'foo__in', objs)
+        or_build = time.perf_counter() - start
+        start = time.perf_counter()
+        single_q_expressions = single_lookup(User, dict(foo_in=objs))
+        single_build = time.perf_counter() - start
+        report[size] = dict(
+            or_subquery=dict(time_filter(User, or_q_expressions, execute), build=or_build),
+            single_lookup=dict(time_filter(User, single_q_expressions, execute), build=single_build)
+        )
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='Numbers of ids. The OR of 50k objects takes minutes to build')
+    parser.add_argument('--execute', action='store_true', help='Also run the queries against the database')
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    report = run(args.sizes, args.execute)
+
+    print(f"{'ids':>8}  {'filter':<16}{'build s':>10}{'compile s':>11}{'execute s':>11}")
+    for size, results in report.items():
+        for name, result in results.items():
+            executed = '-' if result['execute'] is None else f"{result['execute']:.4f}"
+            print(f"{size:>8}  {name:<16}{result['build']:>10.4f}{result['compile']:>11.4f}{executed:>11}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,106 @@
+"""
+    Compares filtering the features of a Foo's geojson like foos { geojson { features(type: "Feature") { id } } }
+    in Python with R.dict_matches_params_deep, which is what resolver_for_dict_list did for every query, with the
+    jsonb containment annotation of json_list_filter_annotations. Creates a Foo with --features features, one in
+    --match-every of which matches, in a transaction that is rolled back.
+    Needs the database of the settings, which must be migrated.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/json_list_filters.py [--features 50000] [--json path]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class Rollback(Exception):
+    pass
+
+
+def time_query(query, repeat):
+    """
+        Evaluates the query repeat times
+    :param query: Function returning the matching features
+    :return: dict(seconds=the best time, count=the number of matching features)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(query())
+        seconds.append(time.perf_counter() - start)
+    return dict(seconds=min(seconds), count=count)
+
+
+def run(features, match_every, repeat):
+    from django.contrib.auth.models import User
+    from django.contrib.gis.geos import GeometryCollection
+    from django.db import transaction
+    from rescape_python_helpers import ramda as R
+    from sample_webapp.models import Foo
+    from rescape_graphene.graphql_helpers.json_field_helpers import json_list_annotation_name, \
+        json_list_filter_expression
+
+    kwargs = dict(type='Feature')
+    name = json_list_annotation_name(('geojson', 'features'), kwargs)
+    report = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(username='json_list_filters_benchmark')
+            foo = Foo.objects.create(
+                key='json_list_filters', name='Json list filters', user=user, data={},
+                geojson=dict(type='FeatureCollection', features=[
+                    dict(type='Feature' if i % match_every == 0 else 'Other', id=str(i),
+                         properties=dict(name=f'Feature {i}'))
+                    for i in range(features)
+                ]),
+                geo_collection=GeometryCollection()
+            )
+            report = dict(
+                python=time_query(
+                    lambda: R.filter(
+                        lambda feature: R.dict_matches_params_deep(kwargs, feature),
+                        Foo.objects.get(id=foo.id).geojson['features']
+                    ),
+                    repeat
+                ),
+                containment=time_query(
+                    lambda: getattr(
+                        Foo.objects.only('id').annotate(**{
+                            name: json_list_filter_expression(Foo, ('geojson', 'features'), kwargs)
+                        }).get(id=foo.id),
+                        name
+                    ),
+                    repeat
+                )
+            )
+            raise Rollback()
+    except Rollback:
+        pass
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--features', type=int, default=50000)
+    parser.add_argument('--match-every', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    report = run(args.features, args.match_every, args.repeat)
+
+    print(f"{'filter':<14}{'seconds':>10}{'results':>10}")
+    for name, result in report.items():
+        print(f"{name:<14}{result['seconds']:>10.3f}{result['count']:>10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,122 @@
+"""
+    Compares the page query of resolve_paginated_for_type for objects with several filter sets, e.g.
+    foosPaginated(objects: [{name: "Foo 1", bars: [{key: "bar 1"}]}, {user: {username: "..."}}]), when each set
+    is resolved to a queryset and the querysets are or'd with |, which is what resolve_paginated_for_type did
+    and still does for filters that need Django's joins, with the single expression of filter_sets_expression
+    that it uses by default.
+    Prints the SQL of each page query, the number of queries and the best time of
+    --repeat pages. Creates --foos Foos with --bars bars each in a transaction that is rolled back.
+    Needs the database of the settings, which must be migrated.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/paginated_filters.py [--foos 20000] [--json path]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+
+class Rollback(Exception):
+    pass
+
+
+def time_query(query, repeat):
+    """
+        Evaluates the query repeat times
+    :param query: Function returning the page's objects
+    :return: dict(seconds=the best time, count=the number of objects, queries=the number of queries of one page)
+    """
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    seconds = []
+    for _ in range(repeat):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            count = len(query())
+            seconds.append(time.perf_counter() - start)
+    return dict(seconds=min(seconds), count=count, queries=len(context.captured_queries))
+
+
+def run(foos, bars, page_size, repeat):
+    from django.contrib.auth.models import User
+    from django.contrib.gis.geos import GeometryCollection
+    from django.db import transaction
+    from rescape_python_helpers import ramda as R
+    from sample_webapp.models import Foo, Bar
+    from rescape_graphene.graphql_helpers.schema_helpers import filter_sets_expression, \
+        process_filter_kwargs_with_to_manys, query_with_to_many_exists
+
+    objects = [
+        dict(name_startswith='Foo 1', bars=[dict(key='bar 1')]),
+        dict(bars=[dict(key='bar 2'), dict(key='bar 3')]),
+        dict(user=dict(username='paginated_filters_benchmark'), key_in=['foo 5', 'foo 7'])
+    ]
+
+    def or_querysets():
+        # As resolve_paginated_for_type does for filters that need Django's joins or without process_filter_kwargs
+        return R.reduce(
+            lambda qs, q: q if qs is None else qs | q,
+            None,
+            R.map(
+                lambda obj: query_with_to_many_exists(
+                    Foo.objects, 'filter', process_filter_kwargs_with_to_manys(Foo, **obj)
+                ),
+                objects
+            )
+        ).order_by('id')[:page_size]
+
+    def filter_sets():
+        return Foo.objects.filter(filter_sets_expression(Foo, objects)).order_by('id')[:page_size]
+
+    report = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(username='paginated_filters_benchmark')
+            bar_instances = Bar.objects.bulk_create([Bar(key=f'bar {i}') for i in range(bars * 4)])
+            foo_instances = Foo.objects.bulk_create([
+                Foo(key=f'foo {i}', name=f'Foo {i}', user=user, data={}, geojson={},
+                    geo_collection=GeometryCollection())
+                for i in range(foos)
+            ])
+            Foo.bars.through.objects.bulk_create([
+                Foo.bars.through(foo=foo, bar=bar_instances[(i + j) % len(bar_instances)])
+                for i, foo in enumerate(foo_instances) for j in range(bars)
+            ])
+            report = R.map_dict(
+                lambda query: R.merge(time_query(lambda: list(query()), repeat), dict(sql=str(query().query))),
+                dict(or_querysets=or_querysets, filter_sets=filter_sets)
+            )
+            raise Rollback()
+    except Rollback:
+        pass
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--foos', type=int, default=20000)
+    parser.add_argument('--bars', type=int, default=3)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    report = run(args.foos, args.bars, args.page_size, args.repeat)
+
+    for name, result in report.items():
+        print(f"{name}:\n{result['sql']}\n")
+    print(f"{'filter':<14}{'seconds':>10}{'queries':>10}{'results':>10}")
+    for name, result in report.items():
+        print(f"{name:<14}{result['seconds']:>10.3f}{result['queries']:>10}{result['count']:>10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,113 @@
+"""
+    Measures the memory that each forked worker doesn't share with its master process, depending on whether the
+    schema is built in the worker, built in the master, or built in the master with rescape_graphene.schema.prebuild_schema,
+    which also freezes the built objects out of garbage collection. Linux only since it reads /proc/self/smaps_rollup.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/schema_fork_memory.py [--workers 4] [--json path]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODES = ['worker', 'preload', 'prebuild']
+
+
+def memory_kb():
+    """
+        Resident and private memory of the current process from /proc/self/smaps_rollup
+    :return: dict(rss=kB, private=kB)
+    """
+    values = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return dict(rss=values['Rss'], private=values['Private_Clean'] + values['Private_Dirty'])
+
+
+def build_schema():
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.utils.module_loading import import_string
+    return import_string(settings.GRAPHENE['SCHEMA'])
+
+
+def serve(schema):
+    # What a worker does to long-lived objects while serving: introspection walks every type and collections
+    # traverse every tracked object
+    import gc
+    schema.introspect()
+    gc.collect()
+
+
+def run_mode(mode, workers):
+    """
+        Runs in a fresh interpreter. Forks workers and reports the memory of each after serving
+    :param mode: One of MODES
+    :param workers: The number of workers to fork
+    :return: List of dict(rss=kB, private=kB), one per worker
+    """
+    schema = None
+    if mode == 'preload':
+        schema = build_schema()
+    elif mode == 'prebuild':
+        build_schema()
+        from rescape_graphene.schema import prebuild_schema
+        schema = prebuild_schema()
+
+    pipes = []
+    for _ in range(workers):
+        read_fd, write_fd = os.pipe()
+        if os.fork() == 0:
+            os.close(read_fd)
+            serve(schema or build_schema())
+            with os.fdopen(write_fd, 'w') as f:
+                json.dump(memory_kb(), f)
+            os._exit(0)
+        os.close(write_fd)
+        pipes.append(read_fd)
+
+    results = []
+    for read_fd in pipes:
+        with os.fdopen(read_fd) as f:
+            results.append(json.load(f))
+        os.wait()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        json.dump(run_mode(args.mode, args.workers), sys.stdout)
+        return
+
+    report = {}
+    for mode in MODES:
+        output = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--workers', str(args.workers)],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+        report[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<10}{'worker':>8}{'rss kB':>12}{'private kB':>12}")
+    for mode, results in report.items():
+        for i, result in enumerate(results):
+            print(f"{mode:<10}{i:>8}{result['rss']:>12}{result['private']:>12}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,103 @@
+"""
+    Compares query_sequentially with query_with_to_many_exists on Foo.bars, filtering for Foos that have two
+    given Bars. Creates --foos Foos each with --bars-per-foo of --bars Bars in a transaction that is rolled back.
+    Needs the database of the settings, which must be migrated.
+
+    Usage from the repository root:
+    DJANGO_SETTINGS_MODULE=test_settings python benchmarks/to_many_filters.py [--foos 100000] [--json path]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+
+class Rollback(Exception):
+    pass
+
+
+def time_query(query, repeat):
+    """
+        Evaluates the query repeat times
+    :param query: Function returning a QuerySet
+    :return: dict(seconds=the best time, count=the number of results)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = len(list(query()))
+        seconds.append(time.perf_counter() - start)
+    return dict(seconds=min(seconds), count=count)
+
+
+def run(foos, bars, bars_per_foo, repeat):
+    from django.contrib.auth.models import User
+    from django.contrib.gis.geos import GeometryCollection
+    from django.db import transaction
+    from sample_webapp.models import Foo, Bar
+    from rescape_graphene.graphql_helpers.schema_helpers import process_filter_kwargs_with_to_manys, \
+        query_sequentially, query_with_to_many_exists
+
+    report = {}
+    try:
+        with transaction.atomic():
+            user = User.objects.create(username='to_many_filters_benchmark')
+            bar_instances = Bar.objects.bulk_create([Bar(key=f'bar{i}') for i in range(bars)])
+            foo_instances = Foo.objects.bulk_create([
+                Foo(key=f'foo{i}', name=f'Foo {i}', user=user, data={}, geojson={},
+                    geo_collection=GeometryCollection())
+                for i in range(foos)
+            ], batch_size=10000)
+            random.seed(0)
+            Foo.bars.through.objects.bulk_create([
+                Foo.bars.through(foo_id=foo.id, bar_id=bar.id)
+                for foo in foo_instances
+                for bar in random.sample(bar_instances, bars_per_foo)
+            ], batch_size=10000)
+
+            q_expressions_sets = process_filter_kwargs_with_to_manys(
+                Foo,
+                bars=[dict(key='bar0'), dict(key='bar1')]
+            )
+            report = dict(
+                query_sequentially=time_query(
+                    lambda: query_sequentially(Foo.objects, 'filter', q_expressions_sets).values_list('id'),
+                    repeat
+                ),
+                query_with_to_many_exists=time_query(
+                    lambda: query_with_to_many_exists(Foo.objects, 'filter', q_expressions_sets).values_list('id'),
+                    repeat
+                )
+            )
+            raise Rollback()
+    except Rollback:
+        pass
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--foos', type=int, default=100000)
+    parser.add_argument('--bars', type=int, default=100)
+    parser.add_argument('--bars-per-foo', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='Write the results as JSON to this path')
+    args = parser.parse_args()
+
+    import django
+    django.setup()
+    report = run(args.foos, args.bars, args.bars_per_foo, args.repeat)
+
+    print(f"{'query':<28}{'seconds':>10}{'results':>10}")
+    for name, result in report.items():
+        print(f"{name:<28}{result['seconds']:>10.3f}{result['count']:>10}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
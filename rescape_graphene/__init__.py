@@ -1,91 +1,129 @@
-import django
-django.setup()
+import os
+from importlib import import_module
 
-from .django_helpers.pagination import (
-    get_paginator,
-    create_paginated_type_mixin
-)
-from .django_helpers.write_helpers import (
-    increment_prop_until_unique,
-    enforce_unique_props
-)
-from .graphql_helpers.json_field_helpers import (
-    resolver_for_feature_collection,
-    pick_selections,
-    resolve_selections,
-    model_resolver_for_dict_field,
-    resolver_for_dict_field,
-    resolver_for_dict_list
-)
-from .graphql_helpers.schema_helpers import (
-    input_type_class,
-    related_input_field,
-    related_input_field_for_crud_type,
-    django_to_graphene_type,
-    process_field,
-    parse_django_class,
-    merge_with_django_properties,
-    allowed_read_fields,
-    allowed_filter_arguments,
-    guess_update_or_create,
-    instantiate_graphene_type_or_fields,
-    input_type_fields,
-    input_type_parameters_for_update_or_create,
-    graphql_query,
-    graphql_update_or_create,
-    merge_data_fields_on_update,
-    process_filter_kwargs,
-    deep_merge_existing_json,
-    invert_q_expressions_sets,
-    process_filter_kwargs_with_to_manys,
-    query_sequentially,
-    type_modify_fields,
-    DENY,
-    CREATE,
-    UPDATE,
-    UNIQUE,
-    ALLOW,
-    DELETE,
-    REQUIRE,
-    READ
-)
-from .graphql_helpers.views import (
-    SafeGraphQLView
-)
+from django.conf import settings, ENVIRONMENT_VARIABLE
 
-from .schema_models.geojson import (
-    GrapheneFeatureCollection,
-    FeatureCollectionDataType, FeatureDataType, FeatureGeometryDataType, feature_data_type_fields,
-    feature_geometry_data_type_fields
-)
+# Django is set up by the host project, not on import. Registers the graphene-django converter of
+# GeometryCollectionField before any DjangoObjectType is created. graphene-django reads the settings when imported,
+# so without them the converter is registered once rescape_graphene.schema_models.geojson is imported
+if settings.configured or os.environ.get(ENVIRONMENT_VARIABLE):
+    from .schema_models.geojson import converters
 
-from .schema_models.group_schema import (
-    GroupType,
-    UpsertGroup,
-    CreateGroup,
-    UpdateGroup,
-    graphql_update_or_create_group,
-    graphql_query_groups,
-    group_fields,
-    group_mutation_config,
-    graphql_update_or_create,
-)
-from .schema_models.user_schema import (
-    UserType,
-    UpsertUser,
-    CreateUser,
-    UpdateUser,
-    graphql_update_or_create_user,
-    graphql_query_users,
-    user_fields,
-    user_mutation_config,
-)
-from .testcases import (
-    client_for_testing
-)
-from .schema import (
-    create_query_mutation_schema,
-    create_schema,
-    create_query_and_mutation_classes
+# The public API keyed by name and valued by the module that defines it. Modules are imported when one of their
+# names is first accessed, since many of them build parts of the schema when imported. That way
+# from rescape_graphene import increment_prop_until_unique doesn't also build the user and group schemas.
+_LAZY_ATTRIBUTES = dict(
+    get_paginator='.django_helpers.pagination',
+    create_paginated_type_mixin='.django_helpers.pagination',
+    page_cache_stats='.django_helpers.page_cache',
+    invalidate_pages='.django_helpers.page_cache',
+    watch_pages='.django_helpers.page_cache',
+
+    increment_prop_until_unique='.django_helpers.write_helpers',
+    enforce_unique_props='.django_helpers.write_helpers',
+
+    resolver_for_feature_collection='.graphql_helpers.json_field_helpers',
+    pick_selections='.graphql_helpers.json_field_helpers',
+    resolve_selections='.graphql_helpers.json_field_helpers',
+    model_resolver_for_dict_field='.graphql_helpers.json_field_helpers',
+    resolver_for_dict_field='.graphql_helpers.json_field_helpers',
+    resolver_for_dict_list='.graphql_helpers.json_field_helpers',
+    json_list_containment='.graphql_helpers.json_field_helpers',
+    json_list_annotation_name='.graphql_helpers.json_field_helpers',
+    json_list_filter_expression='.graphql_helpers.json_field_helpers',
+    json_list_filter_annotations='.graphql_helpers.json_field_helpers',
+
+    input_type_class='.graphql_helpers.schema_helpers',
+    related_input_field='.graphql_helpers.schema_helpers',
+    related_input_field_for_crud_type='.graphql_helpers.schema_helpers',
+    django_to_graphene_type='.graphql_helpers.schema_helpers',
+    process_field='.graphql_helpers.schema_helpers',
+    parse_django_class='.graphql_helpers.schema_helpers',
+    merge_with_django_properties='.graphql_helpers.schema_helpers',
+    allowed_read_fields='.graphql_helpers.schema_helpers',
+    allowed_filter_arguments='.graphql_helpers.schema_helpers',
+    guess_update_or_create='.graphql_helpers.schema_helpers',
+    instantiate_graphene_type_or_fields='.graphql_helpers.schema_helpers',
+    input_type_fields='.graphql_helpers.schema_helpers',
+    input_type_parameters_for_update_or_create='.graphql_helpers.schema_helpers',
+    graphql_query='.graphql_helpers.schema_helpers',
+    merge_data_fields_on_update='.graphql_helpers.schema_helpers',
+    process_filter_kwargs='.graphql_helpers.schema_helpers',
+    deep_merge_existing_json='.graphql_helpers.schema_helpers',
+    invert_q_expressions_sets='.graphql_helpers.schema_helpers',
+    process_filter_kwargs_with_to_manys='.graphql_helpers.schema_helpers',
+    query_sequentially='.graphql_helpers.schema_helpers',
+    to_many_exists_expressions='.graphql_helpers.schema_helpers',
+    query_with_to_many_exists='.graphql_helpers.schema_helpers',
+    filter_sets_expression='.graphql_helpers.schema_helpers',
+    type_modify_fields='.graphql_helpers.schema_helpers',
+    DENY='.graphql_helpers.schema_helpers',
+    CREATE='.graphql_helpers.schema_helpers',
+    UPDATE='.graphql_helpers.schema_helpers',
+    UNIQUE='.graphql_helpers.schema_helpers',
+    ALLOW='.graphql_helpers.schema_helpers',
+    DELETE='.graphql_helpers.schema_helpers',
+    REQUIRE='.graphql_helpers.schema_helpers',
+    READ='.graphql_helpers.schema_helpers',
 
+    query_for_selections='.graphql_helpers.selection_query_helpers',
+    selection_query_plan='.graphql_helpers.selection_query_helpers',
+    selection_tree='.graphql_helpers.selection_query_helpers',
+
+    query_cost='.graphql_helpers.query_cost',
+
+    SafeGraphQLView='.graphql_helpers.views',
+
+    GrapheneFeatureCollection='.schema_models.geojson',
+    FeatureCollectionDataType='.schema_models.geojson',
+    FeatureDataType='.schema_models.geojson',
+    FeatureGeometryDataType='.schema_models.geojson',
+    feature_data_type_fields='.schema_models.geojson',
+    feature_geometry_data_type_fields='.schema_models.geojson',
+
+    GroupType='.schema_models.group_schema',
+    UpsertGroup='.schema_models.group_schema',
+    CreateGroup='.schema_models.group_schema',
+    UpdateGroup='.schema_models.group_schema',
+    graphql_update_or_create_group='.schema_models.group_schema',
+    graphql_query_groups='.schema_models.group_schema',
+    group_fields='.schema_models.group_schema',
+    group_mutation_config='.schema_models.group_schema',
+    graphql_update_or_create='.schema_models.group_schema',
+
+    UserType='.schema_models.user_schema',
+    UpsertUser='.schema_models.user_schema',
+    CreateUser='.schema_models.user_schema',
+    UpdateUser='.schema_models.user_schema',
+    graphql_update_or_create_user='.schema_models.user_schema',
+    graphql_query_users='.schema_models.user_schema',
+    user_fields='.schema_models.user_schema',
+    user_mutation_config='.schema_models.user_schema',
+
+    client_for_testing='.testcases',
+
+    create_query_mutation_schema='.schema',
+    create_schema='.schema',
+    create_query_and_mutation_classes='.schema'
 )
+
+__all__ = list(_LAZY_ATTRIBUTES.keys())
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    else:
+        # Submodules like rescape_graphene.schema used to be bound by the eager imports
+        try:
+            value = import_module(f'.{name}', __name__)
+        except ModuleNotFoundError as e:
+            if e.name != f'{__name__}.{name}':
+                raise
+            raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals().keys()) | set(_LAZY_ATTRIBUTES.keys()))
@@ -0,0 +1,243 @@
+import inspect
+import json
+import re
+from collections import Counter
+
+import graphene
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+from django.db.models import Index, Q, JSONField, CharField, TextField
+from rescape_python_helpers import ramda as R
+from safedelete.models import SafeDeleteModel
+
+from rescape_graphene.graphql_helpers.schema_helpers import filter_fields_for_field, filter_suffixes_for_class, \
+    EXCLUDED_PROP_KEYS_FROM_FILTERING, READ, DENY
+
+###
+# Proposes the indexes that the filters of a schema's field configs need, optionally narrowed to the lookups of
+# captured queries, and writes them as migrations. See IndexAdvisorCommand
+###
+
+# jsonb @>, which process_filter_kwargs makes of json filters
+JSONB_PATH_OPS = 'jsonb_path_ops'
+# jsonb ?, ?| and ?&, which jsonb_path_ops doesn't support
+JSONB_OPS = 'jsonb_ops'
+# LIKE '%...%', which a btree can't serve
+TRIGRAM = 'trigram'
+# Ranges, date parts, equality and ordering
+BTREE = 'btree'
+
+# The index each filter suffix needs, by whether the field is a JSONField
+_JSON_SUFFIX_KINDS = dict(
+    exact=JSONB_PATH_OPS,
+    contains=JSONB_PATH_OPS,
+    has_key=JSONB_OPS,
+    has_keys=JSONB_OPS,
+    has_any_keys=JSONB_OPS
+)
+_SUFFIX_KINDS = dict(
+    contains=TRIGRAM,
+    startswith=TRIGRAM,
+    endswith=TRIGRAM,
+    gt=BTREE,
+    gte=BTREE,
+    lt=BTREE,
+    lte=BTREE,
+    range=BTREE,
+    year=BTREE,
+    month=BTREE,
+    day=BTREE,
+    week_day=BTREE,
+    hour=BTREE,
+    minute=BTREE,
+    second=BTREE
+)
+
+_INDEX_NAME_SUFFIXES = dict(jsonb_path_ops='jpo', jsonb_ops='jo', trigram='trgm', btree='bt')
+
+_COLUMN = r'"(?P<table>[^"]+)"\."(?P<column>[^"]+)"'
+# Patterns of the SQL Django generates for each kind of lookup
+_QUERY_LOG_PATTERNS = [
+    [JSONB_PATH_OPS, re.compile(_COLUMN + r'\s*@>')],
+    [JSONB_OPS, re.compile(_COLUMN + r'\s*\?[|&]?')],
+    [TRIGRAM, re.compile(_COLUMN + r'(?:::text)?\)?\s+I?LIKE\s')],
+    [BTREE, re.compile(_COLUMN + r'\s*(?:BETWEEN\s|IN\s*\(|[<>]=?|=\s*[^"\s])')],
+    [BTREE, re.compile(r'EXTRACT\(\s*\'?\w+\'?\s+FROM\s+' + _COLUMN)]
+]
+_ORDER_BY = re.compile(r'ORDER BY (.*?)(?:\sLIMIT\s|\sOFFSET\s|\sFOR\s|$)', re.S)
+
+
+def read_query_log(path):
+    """
+        Reads captured SQL. A .json file holds a list of statements or of dicts with a 'sql' key, like the
+        captured_queries of django.test.utils.CaptureQueriesContext or connection.queries.
+        Any other file holds a statement per line, like a Postgres log with log_statement enabled
+    :param path: The file path
+    :return: The list of SQL statements
+    """
+    with open(path) as f:
+        if path.endswith('.json'):
+            return R.map(lambda query: R.prop('sql', query) if isinstance(query, dict) else query, json.load(f))
+        return R.filter(lambda line: line, R.map(lambda line: line.strip(), f.readlines()))
+
+
+def query_log_lookups(statements):
+    """
+        Counts the lookups of each column in SQL statements by the kind of index that serves them
+    :param statements: List of SQL statements
+    :return: Counter keyed by (table, column, kind)
+    """
+    counts = Counter()
+    for statement in statements:
+        for kind, pattern in _QUERY_LOG_PATTERNS:
+            counts.update((match.group('table'), match.group('column'), kind) for match in pattern.finditer(statement))
+        for order_by in _ORDER_BY.findall(statement):
+            counts.update(
+                (match.group('table'), match.group('column'), BTREE)
+                for match in re.finditer(_COLUMN, order_by)
+            )
+    return counts
+
+
+def _filter_suffixes(graphene_type, field_name, field_config):
+    """
+        The filter suffixes the schema creates for a field, see allowed_filter_pairs
+    """
+    if field_name in EXCLUDED_PROP_KEYS_FROM_FILTERING or R.prop_eq_or_in(READ, DENY, field_config):
+        return []
+    typ = R.prop_or(None, 'type', field_config)
+    if not (inspect.isclass(typ) and issubclass(typ, graphene.Scalar)):
+        # Related and json fields have input types rather than filter suffixes
+        return []
+    filter_fields = filter_fields_for_field(graphene_type, field_config)
+    return R.filter(lambda suffix: suffix in filter_fields, filter_suffixes_for_class(typ))
+
+
+def _field_kinds(field, suffixes):
+    """
+        The kinds of index that the suffixes of field need
+    :return: dict keyed by kind and valued by the suffixes that need it
+    """
+    if isinstance(field, JSONField):
+        # Filtering by a json value is always a containment, see _json_q_expressions
+        suffix_kinds = R.merge(dict(containment=JSONB_PATH_OPS), _JSON_SUFFIX_KINDS)
+        suffixes = R.concat(['containment'], suffixes)
+    elif isinstance(field, (CharField, TextField)):
+        suffix_kinds = _SUFFIX_KINDS
+    else:
+        # Other fields are cast to text for LIKE, which a trigram index of the field can't serve
+        suffix_kinds = R.filter_dict(lambda suffix_kind: suffix_kind[1] != TRIGRAM, _SUFFIX_KINDS)
+    kinds = {}
+    for suffix in suffixes:
+        kind = R.prop_or(None, suffix, suffix_kinds)
+        if kind:
+            kinds.setdefault(kind, []).append(suffix)
+    return kinds
+
+
+def _index(model, field, kind):
+    """
+        Creates the index of kind for field. Indexes of safedelete models only cover rows that aren't deleted,
+        since those are the rows the models' managers query
+    """
+    condition = Q(deleted__isnull=True) if issubclass(model, SafeDeleteModel) else None
+    # Index names are limited to 30 characters
+    name = R.join('_', R.concat(
+        [model._meta.model_name[:10], field.column[:10], _INDEX_NAME_SUFFIXES[kind]],
+        ['p'] if condition else []
+    ))
+    if kind == BTREE:
+        return Index(fields=[field.name], name=name, condition=condition)
+    opclasses = dict(jsonb_path_ops=['jsonb_path_ops'], trigram=['gin_trgm_ops']).get(kind, [])
+    return GinIndex(fields=[field.name], name=name, opclasses=opclasses, condition=condition)
+
+
+def _is_indexed(model, field, index):
+    """
+        Whether model already has index or one that serves the same lookups
+    """
+    if isinstance(index, Index) and not isinstance(index, GinIndex) and (
+            field.primary_key or field.unique or field.db_index
+    ):
+        return True
+    return R.any_satisfy(
+        lambda existing: type(existing) == type(index) and
+                         list(existing.fields) == list(index.fields) and
+                         list(existing.opclasses) == list(index.opclasses) and
+                         (existing.condition is None or existing.condition == index.condition),
+        model._meta.indexes
+    )
+
+
+def index_proposals(class_config, query_log_counts=None, min_count=1):
+    """
+        Proposes an index for each field and kind of index its filters need. The filters are those that the field
+        configs create, see allowed_filter_pairs, plus containment for JSONFields. With a query log, equality and
+        order_by of any field that isn't a JSONField are also considered. Fields that are already indexed for
+        the kind are skipped
+    :param class_config: The class config of the schema, see create_query_mutation_schema. Each value has
+    the model_class, graphene_class and graphene_fields whose filters are advised on
+    :param query_log_counts: Optional result of query_log_lookups. If given only the fields and kinds
+    used at least min_count times in the queries are proposed, ordered by the count
+    :param min_count: The minimum count in query_log_counts
+    :return: List of dict(model, field, kind, suffixes, count, index)
+    """
+    proposals = []
+    for config in class_config.values():
+        model = R.prop('model_class', config)
+        graphene_type = R.prop_or(None, 'graphene_class', config)
+        for field_name, field_config in R.prop_or({}, 'graphene_fields', config).items():
+            field = R.prop_or(None, field_name, {field.name: field for field in model._meta.concrete_fields})
+            if not field or field.is_relation:
+                continue
+            kinds = _field_kinds(field, _filter_suffixes(graphene_type, field_name, field_config))
+            if query_log_counts is not None and not isinstance(field, JSONField):
+                # Any column can be compared and ordered by
+                kinds = R.merge(dict(btree=['exact', 'order_by']), kinds)
+            for kind, suffixes in kinds.items():
+                count = query_log_counts[(model._meta.db_table, field.column, kind)] if \
+                    query_log_counts is not None else None
+                if count is not None and count < min_count:
+                    continue
+                index = _index(model, field, kind)
+                if not _is_indexed(model, field, index):
+                    proposals.append(dict(
+                        model=model, field=field.name, kind=kind, suffixes=suffixes, count=count, index=index
+                    ))
+    return sorted(proposals, key=lambda proposal: -(proposal['count'] or 0)) if \
+        query_log_counts is not None else proposals
+
+
+def index_migrations(proposals):
+    """
+        Creates a migration per app of the proposals that adds their indexes, after the app's latest migration
+    :param proposals: The result of index_proposals
+    :return: List of MigrationWriter, whose path and as_string() give the file to write
+    """
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    proposals_by_app = {}
+    for proposal in proposals:
+        proposals_by_app.setdefault(proposal['model']._meta.app_label, []).append(proposal)
+    writers = []
+    for app_label, app_proposals in proposals_by_app.items():
+        leaves = sorted(loader.graph.leaf_nodes(app_label))
+        number = (MigrationAutodetector.parse_number(R.last(leaves)[1]) or 0) + 1 if leaves else 1
+        migration = migrations.Migration(f'{number:04d}_advised_indexes', app_label)
+        migration.dependencies = leaves
+        migration.operations = R.concat(
+            # CREATE EXTENSION IF NOT EXISTS pg_trgm
+            [TrigramExtension()] if R.any_satisfy(lambda proposal: proposal['kind'] == TRIGRAM, app_proposals) else [],
+            R.map(
+                lambda proposal: migrations.AddIndex(
+                    model_name=proposal['model']._meta.model_name,
+                    index=proposal['index']
+                ),
+                app_proposals
+            )
+        )
+        writers.append(MigrationWriter(migration))
+    return writers
@@ -0,0 +1,184 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db.migrations.writer import MigrationWriter
+from django.utils.module_loading import import_string
+from rescape_python_helpers import ramda as R
+
+from rescape_graphene.graphql_helpers.schema_profiler import SCHEMA_PROFILE_ENV
+
+# rescape_graphene can't be an installed app since importing it sets up Django, so projects expose these commands
+# by subclassing them in their own app's management/commands package, e.g.
+# from rescape_graphene.django_helpers.management import ProfileSchemaCommand
+# class Command(ProfileSchemaCommand):
+#     pass
+
+# Run in a fresh interpreter so that the schema built at import time is profiled from the start
+_PROFILE_SCHEMA_SCRIPT = '''
+import time
+start = time.perf_counter()
+import json, sys
+import django
+django.setup()
+from rescape_graphene.graphql_helpers.schema_profiler import profile_schema_import
+report = profile_schema_import(sys.argv[1], start)
+with open(sys.argv[2], 'w') as f:
+    json.dump(report, f)
+'''
+
+
+class ProfileSchemaCommand(BaseCommand):
+    help = 'Profiles the construction of the graphene schema and prints the time spent per function and per model'
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--schema',
+            help="Dotted path to the schema. Defaults to settings.GRAPHENE['SCHEMA']"
+        )
+        parser.add_argument(
+            '--json',
+            help='Write the report as JSON to this path'
+        )
+        parser.add_argument(
+            '--compare',
+            help='Path to a JSON report written by a previous run to print the differences to'
+        )
+
+    def handle(self, *args, **options):
+        schema_path = options['schema'] or R.item_str_path_or(None, 'SCHEMA', getattr(settings, 'GRAPHENE', {}))
+        if not schema_path:
+            raise CommandError("Specify --schema or settings.GRAPHENE['SCHEMA']")
+
+        report = self.profile(schema_path)
+        self.print_report(report)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), report)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Wrote {options['json']}")
+
+    def profile(self, schema_path):
+        """
+            Builds the schema in a subprocess with profiling enabled
+        :param schema_path: Dotted path to the schema
+        :return: The report of schema_profiler.profile_schema_import
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            report_path = os.path.join(directory, 'report.json')
+            result = subprocess.run(
+                [sys.executable, '-c', _PROFILE_SCHEMA_SCRIPT, schema_path, report_path],
+                env=R.merge(os.environ, {
+                    SCHEMA_PROFILE_ENV: '1',
+                    'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', settings.SETTINGS_MODULE)
+                }),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                universal_newlines=True
+            )
+            if result.returncode:
+                raise CommandError(f'Building schema {schema_path} failed:\n{result.stderr}')
+            with open(report_path) as f:
+                return json.load(f)
+
+    def print_report(self, report):
+        self.stdout.write(f"Built {report['schema']} in {report['seconds']:.3f}s")
+        self.stdout.write('')
+        self.stdout.write(f"{'function':<32}{'calls':>8}{'misses':>8}{'hit rate':>10}{'seconds':>10}")
+        for name, record in sorted(report['functions'].items(), key=lambda item: -item[1]['seconds']):
+            self.stdout.write(
+                f"{name:<32}{record['calls']:>8}{_or_dash(record['misses']):>8}"
+                f"{_or_dash(record['hit_rate']):>10}{record['seconds']:>10.3f}"
+            )
+        self.stdout.write('')
+        self.stdout.write(f"{'model':<40}{'calls':>8}{'seconds':>10}{'created':>9}{'reused':>8}")
+        for model, record in sorted(report['models'].items(), key=lambda item: -item[1]['seconds']):
+            self.stdout.write(
+                f"{model:<40}{record['calls']:>8}{record['seconds']:>10.3f}"
+                f"{record['classes_created']:>9}{record['classes_reused']:>8}"
+            )
+
+    def print_comparison(self, previous, report):
+        self.stdout.write('')
+        self.stdout.write(f"Compared to {previous['schema']}: {report['seconds'] - previous['seconds']:+.3f}s")
+        for name in sorted(set(previous['functions']) | set(report['functions'])):
+            before = R.item_path_or(0, [name, 'seconds'], previous['functions'])
+            after = R.item_path_or(0, [name, 'seconds'], report['functions'])
+            self.stdout.write(f'{name:<32}{before:>10.3f}{after:>10.3f}{after - before:>+10.3f}')
+
+
+class IndexAdvisorCommand(BaseCommand):
+    help = 'Proposes the indexes that the filters of the schema need and optionally writes them as migrations'
+    # Dotted path to the class config of the schema, see create_query_mutation_schema. Subclasses can set it
+    class_config = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--class-config',
+            help='Dotted path to the class config of the schema, e.g. sample_webapp.sample_schema.default_class_config'
+        )
+        parser.add_argument(
+            '--query-log',
+            help='Captured SQL to limit the proposals to the lookups that are used, either JSON like '
+                 'CaptureQueriesContext.captured_queries or a statement per line'
+        )
+        parser.add_argument(
+            '--min-count',
+            type=int,
+            default=1,
+            help='With --query-log, the number of times a lookup must occur to propose its index'
+        )
+        parser.add_argument(
+            '--write',
+            action='store_true',
+            help="Write the migrations to the apps' migrations packages rather than printing them"
+        )
+
+    def handle(self, *args, **options):
+        from rescape_graphene.django_helpers.index_advisor import index_proposals, index_migrations, \
+            read_query_log, query_log_lookups
+
+        class_config_path = options['class_config'] or self.class_config
+        if not class_config_path:
+            raise CommandError('Specify --class-config or set class_config on the command')
+
+        query_log_counts = query_log_lookups(read_query_log(options['query_log'])) if \
+            options['query_log'] else None
+        proposals = index_proposals(import_string(class_config_path), query_log_counts, options['min_count'])
+        if not proposals:
+            self.stdout.write('No indexes to propose')
+            return
+
+        self.stdout.write(f"{'model':<24}{'field':<20}{'index':<16}{'count':>7}  lookups")
+        for proposal in proposals:
+            self.stdout.write(
+                f"{proposal['model'].__name__:<24}{proposal['field']:<20}{proposal['kind']:<16}"
+                f"{_or_dash(proposal['count']):>7}  {', '.join(proposal['suffixes'])}"
+            )
+
+        self.stdout.write('')
+        self.stdout.write("Add the indexes to the models' Meta.indexes too, or makemigrations will remove them:")
+        for proposal in proposals:
+            self.stdout.write(f"{proposal['model'].__name__}: {MigrationWriter.serialize(proposal['index'])[0]}")
+
+        for writer in index_migrations(proposals):
+            if options['write']:
+                with open(writer.path, 'w') as f:
+                    f.write(writer.as_string())
+                self.stdout.write(f'Wrote {writer.path}')
+            else:
+                self.stdout.write('')
+                self.stdout.write(f'# {writer.path}')
+                self.stdout.write(writer.as_string())
+
+
+def _or_dash(value):
+    return '-' if value is None else str(value)
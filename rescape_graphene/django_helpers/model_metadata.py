@@ -0,0 +1,90 @@
+from django.db.models import ForeignKey, OneToOneField, ManyToManyField
+from rescape_python_helpers import ramda as R
+
+# Relation kinds of model_metadata(model)['relation_kinds']
+FOREIGN_KEY = 'foreign_key'
+ONE_TO_ONE = 'one_to_one'
+MANY_TO_MANY = 'many_to_many'
+REVERSE = 'reverse'
+
+# Metadata keyed by model
+_model_metadata = {}
+
+
+def _relation_kind(field):
+    # OneToOneField subclasses ForeignKey, so test it first
+    if isinstance(field, OneToOneField):
+        return ONE_TO_ONE
+    if isinstance(field, ForeignKey):
+        return FOREIGN_KEY
+    if isinstance(field, ManyToManyField):
+        return MANY_TO_MANY
+    if field.auto_created and not field.concrete:
+        return REVERSE
+    return None
+
+
+def _field_to_unique_field_groups(model):
+    # Maps each attr to all "unique together" tuples it's in
+    return R.from_pairs_to_array_values(
+        R.flatten(
+            R.map(
+                lambda uniq_field_group:
+                R.map(
+                    lambda attrname: [attrname, R.join(',', uniq_field_group)],
+                    uniq_field_group
+                ),
+                model._meta.unique_together
+            )
+        )
+    )
+
+
+def _create_model_metadata(model):
+    meta = model._meta
+    fields = R.concat(list(meta.fields), R.concat(list(meta.many_to_many), list(meta.related_objects)))
+    return dict(
+        # Used to detect that Django expired its own field caches, see model_metadata
+        meta_fields=meta.fields,
+        meta_related_objects=meta.related_objects,
+
+        fields=fields,
+        field_by_name={field.name: field for field in fields},
+        forward_fields_map=meta._forward_fields_map,
+        related_objects_by_name={related_object.name: related_object for related_object in meta.related_objects},
+        relation_kinds={field.name: _relation_kind(field) for field in fields},
+        field_to_unique_field_groups=_field_to_unique_field_groups(model)
+    )
+
+
+def model_metadata(model):
+    """
+        The field metadata of a Django model that schema construction and query kwarg processing need, computed
+        once per model. Django expires the field caches of every model's _meta when the app registry is
+        reloaded, after which _meta.fields and _meta.related_objects are recomputed as new objects. Metadata
+        computed from the expired caches is then recomputed here too
+    :param model: The Django model class
+    :return: dict(
+        fields=the concrete fields, then many-to-many fields, then related objects,
+        field_by_name=dict of those fields keyed by name,
+        forward_fields_map=model._meta._forward_fields_map, keyed by name and attname,
+        related_objects_by_name=dict of the reverse relations keyed by name,
+        relation_kinds=dict keyed by field name valued by FOREIGN_KEY, ONE_TO_ONE, MANY_TO_MANY, REVERSE or None,
+        field_to_unique_field_groups=dict keyed by attribute name valued by the unique_together groups it's in
+    )
+    """
+    metadata = _model_metadata.get(model)
+    if not metadata or \
+            metadata['meta_fields'] is not model._meta.fields or \
+            metadata['meta_related_objects'] is not model._meta.related_objects:
+        metadata = _create_model_metadata(model)
+        _model_metadata[model] = metadata
+    return metadata
+
+
+def clear_model_metadata():
+    """
+        Clears the metadata of all models, for instance after changing models dynamically in tests
+    :return:
+    """
+    _model_metadata.clear()
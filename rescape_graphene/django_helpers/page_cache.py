@@ -0,0 +1,174 @@
+import hashlib
+import time
+
+import reversion
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import EmptyResultSet
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from rescape_python_helpers import ramda as R
+
+###
+# Caches the pages of get_paginator in the Django cache named by settings.RESCAPE_GRAPHENE_PAGE_CACHE, so that
+# clients polling the same page don't each query it. A page is stored as the ids of its objects and its metadata,
+# keyed by a hash of the paginated query's SQL and parameters, the pagination arguments and a generation of the
+# paginated model. The generation is stored in the same cache and incremented by the post_save, post_delete and
+# m2m_changed signals of the model and by reversion's post_revision_commit, so any change to the model, saved
+# through Django, invalidates its pages in every process. The receivers are connected by watch_pages, which
+# create_paginated_type_mixin calls for the model of each paginated type, so any process that imports the schema
+# invalidates pages whether or not it serves them. Processes that write without importing the schema, like a
+# worker or management command, must import it or call watch_pages for the paginated models, e.g. in the
+# ready() of an AppConfig, or their changes aren't seen until the pages time out. A generation that is evicted
+# from the cache restarts
+# from the current time rather than 0, so pages of earlier generations that are still cached aren't served again.
+# Changes that send no signals, like QuerySet.update(), aren't seen until the pages time out after
+# settings.RESCAPE_GRAPHENE_PAGE_CACHE_TIMEOUT seconds. Neither are changes to related models: a page filtered or
+# ordered by a related model's field, e.g. Foos filtered by user__username, is only invalidated by changes to the
+# paginated model and its many-to-many relations. Call invalidate_pages(model) after changing the related models
+# when such pages must not be stale
+###
+
+# The paginated type fields that are cached with the ids of a page's objects
+PAGE_METADATA = ['page', 'pages', 'pages_approximate', 'page_size', 'has_next', 'has_prev', 'cursor', 'next_cursor']
+
+_PAGE_CACHE_PREFIX = 'rescape_graphene.page_cache'
+_COUNTER_KEYS = dict(
+    hits=f'{_PAGE_CACHE_PREFIX}.hits',
+    misses=f'{_PAGE_CACHE_PREFIX}.misses',
+    invalidations=f'{_PAGE_CACHE_PREFIX}.invalidations'
+)
+
+# The models whose changes invalidate their pages, keyed by the models whose signals do so
+_watched_models = {}
+
+
+def page_cache():
+    """
+        The Django cache configured by settings.RESCAPE_GRAPHENE_PAGE_CACHE, or None if pages aren't cached,
+        which is the default
+    :return: A Django cache or None
+    """
+    alias = getattr(settings, 'RESCAPE_GRAPHENE_PAGE_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def page_cache_timeout():
+    return getattr(settings, 'RESCAPE_GRAPHENE_PAGE_CACHE_TIMEOUT', 60)
+
+
+def _increment(cache, key, start=1):
+    # add and incr are atomic in the shared caches, unlike get and set
+    if not cache.add(key, start, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, start, None)
+
+
+def page_cache_stats():
+    """
+        The hits, misses and invalidations of the page cache, counted in the cache so they include every process
+    :return: dict(hits=, misses=, invalidations=)
+    """
+    cache = page_cache()
+    return R.map_dict(lambda key: cache.get(key, 0) if cache else 0, _COUNTER_KEYS)
+
+
+def reset_page_cache_stats():
+    cache = page_cache()
+    if cache:
+        cache.delete_many(list(_COUNTER_KEYS.values()))
+
+
+def _generation_key(model):
+    return f'{_PAGE_CACHE_PREFIX}.generation.{model._meta.label}'
+
+
+def _generation(cache, model):
+    # Generations start from the time rather than 0, so that one that was evicted never repeats
+    key = _generation_key(model)
+    cache.add(key, time.time_ns(), None)
+    return cache.get(key)
+
+
+def invalidate_pages(model):
+    """
+        Invalidates the cached pages of model. Called by the signals of the models that get_paginator has
+        cached pages of, or directly after changes that send no signals
+    :param model: The paginated model
+    """
+    cache = page_cache()
+    if cache:
+        _increment(cache, _generation_key(model), time.time_ns())
+        _increment(cache, _COUNTER_KEYS['invalidations'])
+
+
+def _invalidate_sender(sender, **kwargs):
+    invalidate_pages(_watched_models[sender])
+
+
+def _invalidate_revision_models(sender, revision, versions, **kwargs):
+    for model in set(R.map(lambda version: version.content_type.model_class(), versions)):
+        if model in _watched_models:
+            invalidate_pages(model)
+
+
+def watch_pages(model):
+    """
+        Connects the signals that invalidate the cached pages of model, once. Called for the model of each
+        paginated type, so that changes made by processes that never serve a page invalidate the pages too
+    :param model: The paginated model
+    """
+    if model in _watched_models:
+        return
+    # Changes to many-to-many relations are sent by their through models
+    for sender in R.concat([model], R.map(lambda field: field.remote_field.through, model._meta.many_to_many)):
+        _watched_models[sender] = model
+        for signal in [post_save, post_delete, m2m_changed]:
+            signal.connect(_invalidate_sender, sender=sender, dispatch_uid=f'{_PAGE_CACHE_PREFIX}.{sender._meta.label}')
+    reversion.signals.post_revision_commit.connect(_invalidate_revision_models, dispatch_uid=_PAGE_CACHE_PREFIX)
+
+
+def cached_page(qs, key_args, get_page, make_page):
+    """
+        Gets a page from the page cache or else with get_page, caching its ids and metadata. The page is
+        invalidated by changes to qs.model but not by changes to the related models that qs filters or orders by
+    :param qs: The queryset being paginated with its filters. Its SQL and parameters are part of the key
+    :param key_args: The other arguments that determine the page, e.g. page_size, page and order_by
+    :param get_page: Function returning the paginated type instance of the page
+    :param make_page: Binary function of the page's objects, which are queried by id from qs, and the cached
+    metadata, returning the paginated type instance
+    :return: The paginated type instance
+    """
+    cache = page_cache()
+    if not cache:
+        return get_page()
+    try:
+        sql, params = qs.query.sql_with_params()
+    except EmptyResultSet:
+        # A filter like id__in=[] that can't match anything
+        return get_page()
+    watch_pages(qs.model)
+    digest = hashlib.md5(repr([_generation(cache, qs.model), sql, params, key_args]).encode()).hexdigest()
+    key = f'{_PAGE_CACHE_PREFIX}.{qs.model._meta.label}.{digest}'
+    cached = cache.get(key)
+    if cached is not None:
+        _increment(cache, _COUNTER_KEYS['hits'])
+        objects_by_pk = {obj.pk: obj for obj in qs.filter(pk__in=cached['ids'])}
+        return make_page(
+            # Objects deleted since aren't in the page
+            R.map(lambda pk: objects_by_pk[pk], R.filter(lambda pk: pk in objects_by_pk, cached['ids'])),
+            cached['metadata']
+        )
+    _increment(cache, _COUNTER_KEYS['misses'])
+    page = get_page()
+    cache.set(
+        key,
+        dict(
+            ids=R.map(lambda obj: obj.pk, page.objects),
+            metadata={name: getattr(page, name, None) for name in PAGE_METADATA}
+        ),
+        page_cache_timeout()
+    )
+    return page
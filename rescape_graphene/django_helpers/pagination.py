@@ -1,23 +1,206 @@
+import base64
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import F, Q
 from rescape_python_helpers import ramda as R
 from graphene import Int, Boolean, ObjectType, List, String
 
-from rescape_graphene.graphql_helpers.schema_helpers import DENY, top_level_allowed_filter_arguments
+from rescape_graphene.django_helpers.page_cache import cached_page, watch_pages
+from rescape_graphene.graphql_helpers.schema_helpers import DENY, top_level_allowed_filter_arguments, \
+    filter_sets_expression, process_filter_kwargs
+from rescape_graphene.graphql_helpers.selection_query_helpers import query_for_selections, selection_tree
 
 
-def get_paginator(qs, page_size, page, paginated_type, order_by, **kwargs):
+def _order_by_columns(order_by):
     """
-    Adapted from https://gist.github.com/mbrochh/f92594ab8188393bd83c892ef2af25e6
-    Creates a pagination_type based on the paginated_type function
-    :param qs:
-    :param page_size:
-    :param page:
-    :param paginated_type:
-    :param order_by default id. Optional kwarg to order by in django format as a string, e.g. '-key,+name'
-    :param kwargs: Additional kwargs to pass paginated_type function, usually unneeded
-    :return:
+        The columns of a django style order_by, with the primary key added as the last column if it isn't already
+        ordered by, so that every row has a unique position
+    :param order_by: E.g. '-key,+name'
+    :return: List of [column, descending]
+    """
+    columns = R.map(
+        lambda column: [column.lstrip('-+'), column.startswith('-')],
+        R.filter(lambda column: column, (order_by or 'id').split(','))
+    )
+    return columns if R.any_satisfy(lambda column: column[0] in ['id', 'pk'], columns) else \
+        R.concat(columns, [['pk', False]])
+
+
+def _order_by(columns):
+    return R.map(lambda column: ('-' if column[1] else '') + column[0], columns)
+
+
+def encode_cursor(columns, values):
+    """
+        Encodes the order_by values of a row as an opaque cursor, see get_paginator
+    :param columns: The result of _order_by_columns
+    :param values: The row's value of each column
+    :return: The cursor string
+    """
+    return base64.urlsafe_b64encode(json.dumps(
+        dict(order_by=_order_by(columns), values=values),
+        # Not DjangoJSONEncoder, which truncates microseconds
+        default=lambda value: value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    ).encode()).decode()
+
+
+def decode_cursor(columns, cursor):
+    """
+        Decodes a cursor of encode_cursor
+    :param columns: The result of _order_by_columns. Must be the columns that the cursor was created with
+    :param cursor: The cursor string
+    :return: The values of the columns
     """
-    p = Paginator(qs.order_by(*(order_by or 'id').split(',')), page_size)
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise ValueError(f'Invalid cursor {cursor}')
+    if decoded['order_by'] != _order_by(columns):
+        raise ValueError(
+            f"The cursor is for order_by {','.join(decoded['order_by'])}, not {','.join(_order_by(columns))}"
+        )
+    return decoded['values']
+
+
+def _is_nullable(model, column):
+    try:
+        return model._meta.get_field(column).null if column != 'pk' else False
+    except FieldDoesNotExist:
+        # Related paths can be null because of their joins
+        return True
+
+
+def _keyset_after(model, column, descending, value):
+    """
+        The filter of the rows after value in the order of column. Postgres orders nulls last ascending and first
+        descending
+    :return: The Q expression or None if no rows come after value
+    """
+    if value is None:
+        return Q(**{f'{column}__isnull': False}) if descending else None
+    after = Q(**{f"{column}__{'lt' if descending else 'gt'}": value})
+    return after | Q(**{f'{column}__isnull': True}) if not descending and _is_nullable(model, column) else after
+
+
+def keyset_filter(model, columns, values):
+    """
+        The filter of the rows after the row with values in the order of columns, the or of each column being after
+        its value while the columns before it equal theirs
+    :param model: The model
+    :param columns: The result of _order_by_columns
+    :param values: The result of decode_cursor
+    :return: The Q expression
+    """
+    q_expressions = []
+    equal = Q()
+    for (column, descending), value in zip(columns, values):
+        after = _keyset_after(model, column, descending, value)
+        if after is not None:
+            q_expressions.append(equal & after)
+        equal &= Q(**{column: value}) if value is not None else Q(**{f'{column}__isnull': True})
+    if not q_expressions:
+        return Q(pk__in=[])
+    q_expression = R.reduce(lambda accum, q: accum | q, R.head(q_expressions), R.tail(q_expressions))
+    (column, descending), value = R.head(columns), R.head(values)
+    # Redundant but lets an index on the first column start the scan at the cursor
+    return Q(**{f"{column}__{'lte' if descending else 'gte'}": value}) & q_expression if \
+        value is not None and not _is_nullable(model, column) else q_expression
+
+
+def _keyset_page(qs, page_size, cursor, paginated_type, order_by, **kwargs):
+    """
+        The page of get_paginator after cursor, fetching one more row than page_size to know if there's a next page
+    """
+    columns = _order_by_columns(order_by)
+    if cursor:
+        qs = qs.filter(keyset_filter(qs.model, columns, decode_cursor(columns, cursor)))
+    rows = list(
+        qs.annotate(**{f'keyset_{i}': F(column) for i, (column, _) in enumerate(columns)}).order_by(
+            *_order_by(columns)
+        )[:page_size + 1]
+    )
+    objects = rows[:page_size]
+    has_next = len(rows) > page_size and len(objects) > 0
+    return paginated_type(
+        page_size=page_size,
+        has_next=has_next,
+        has_prev=bool(cursor),
+        cursor=cursor,
+        next_cursor=encode_cursor(
+            columns,
+            R.map(lambda i: getattr(R.last(objects), f'keyset_{i}'), range(len(columns)))
+        ) if has_next else None,
+        objects=objects,
+        **R.omit(['order_by'], kwargs)
+    )
+
+
+def approximate_count_threshold():
+    """
+        The planner's row estimate at or above which get_paginator uses the estimate for pages rather than counting.
+        None, the default, always counts
+    """
+    return getattr(settings, 'RESCAPE_GRAPHENE_APPROXIMATE_COUNT_THRESHOLD', None)
+
+
+def _planner_row_estimate(qs):
+    """
+        The Postgres planner's estimate of the rows of qs, which comes from table statistics rather than a scan
+    """
+    sql, params = qs.order_by().query.sql_with_params()
+    with connections[qs.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = R.head(cursor.fetchone())
+    return R.head(json.loads(plan) if isinstance(plan, str) else plan)['Plan']['Plan Rows']
+
+
+def _offset_page(qs, page_size, page, paginated_type, pages=None, pages_approximate=None, **kwargs):
+    """
+        The page of get_paginator without an exact count, fetching one more row than page_size to know if there's
+        a next page. A page after the last is empty rather than the last page, since that isn't known
+    """
+    number = page if isinstance(page, int) and page > 0 else 1
+    rows = list(qs[(number - 1) * page_size:number * page_size + 1])
+    return paginated_type(
+        page=number,
+        pages=pages,
+        pages_approximate=pages_approximate,
+        page_size=page_size,
+        has_next=len(rows) > page_size,
+        has_prev=number > 1,
+        objects=rows[:page_size],
+        **R.omit(['order_by'], kwargs)
+    )
+
+
+def _page(qs, page_size, page, paginated_type, order_by, counted, cursor, approximate_count_over, **kwargs):
+    """
+        The uncached page of get_paginator
+    :param counted: False if pages isn't selected, in which case the rows aren't counted
+    """
+    if cursor is not None:
+        return _keyset_page(qs, page_size, cursor, paginated_type, order_by, **kwargs)
+    qs = qs.order_by(*(order_by or 'id').split(','))
+    if not counted:
+        return _offset_page(qs, page_size, page, paginated_type, **kwargs)
+
+    threshold = approximate_count_over if approximate_count_over is not None else approximate_count_threshold()
+    if threshold is not None:
+        estimate = _planner_row_estimate(qs)
+        if estimate >= threshold:
+            return _offset_page(
+                qs, page_size, page, paginated_type,
+                pages=max(1, math.ceil(estimate / page_size)),
+                pages_approximate=True,
+                **kwargs
+            )
+
+    p = Paginator(qs, page_size)
     try:
         page_obj = p.page(page)
     except PageNotAnInteger:
@@ -27,6 +210,7 @@ def get_paginator(qs, page_size, page, paginated_type, order_by, **kwargs):
     return paginated_type(
         page=page_obj.number,
         pages=p.num_pages,
+        pages_approximate=False,
         page_size=page_size,
         has_next=page_obj.has_next(),
         has_prev=page_obj.has_previous(),
@@ -35,15 +219,63 @@ def get_paginator(qs, page_size, page, paginated_type, order_by, **kwargs):
     )
 
 
-def create_paginated_type_mixin(model_object_type, model_object_type_fields):
+def get_paginator(qs, page_size, page, paginated_type, order_by, info=None, fields=None, cursor=None,
+                  approximate_count_over=None, **kwargs):
+    """
+    Adapted from https://gist.github.com/mbrochh/f92594ab8188393bd83c892ef2af25e6
+    Creates a pagination_type based on the paginated_type function. If settings.RESCAPE_GRAPHENE_PAGE_CACHE names
+    a cache the page's ids and metadata are cached until the paginated model changes, see cached_page
+    :param qs:
+    :param page_size:
+    :param page:
+    :param paginated_type:
+    :param order_by default id. Optional kwarg to order by in django format as a string, e.g. '-key,+name'
+    :param info: Optional resolve info of the paginated field. If given the page's objects are queried for the
+    selections of objects, see query_for_selections, and the rows are only counted if pages is selected. Otherwise
+    one more row than page_size is fetched for has_next, pages is None and a page after the last is empty
+    :param fields: The field configs of the objects' graphene type, used with info
+    :param cursor: Optional. If not None the page is the page_size rows after cursor in the order of order_by,
+    or the first page_size rows if cursor is ''. Rows are compared to the cursor's order_by values in the query,
+    so there's no count or offset and every page costs the same. page and pages are None, and next_cursor is
+    the cursor of the next page, or None on the last page
+    :param approximate_count_over: Optional. If the Postgres planner estimates at least this many rows, pages is
+    computed from the estimate rather than an exact count and pages_approximate is True. Defaults to
+    approximate_count_threshold()
+    :param kwargs: Additional kwargs to pass paginated_type function, usually unneeded
+    :return:
+    """
+    selections = selection_tree(info.field_asts, info.fragments) if info else None
+    if info:
+        qs = query_for_selections(qs, info, fields, R.prop_or([], 'objects', selections))
+    counted = selections is None or 'pages' in selections
+    return cached_page(
+        qs,
+        [order_by, page_size, page, cursor, counted, approximate_count_over],
+        lambda: _page(qs, page_size, page, paginated_type, order_by, counted, cursor, approximate_count_over, **kwargs),
+        lambda objects, metadata: paginated_type(
+            objects=objects,
+            **R.merge(metadata, R.omit(['order_by'], kwargs))
+        )
+    )
+
+
+def create_paginated_type_mixin(model_object_type, model_object_type_fields, approximate_count_over=None):
     """
         Constructs a PaginatedTypeMixin class and the fields object (for use in allowed filtering).
         The pagination is for the given model_object_type
     :param model_object_type: E.g. LocationType
     :param model_object_type_fields: The fields of the model_object_type, e.g. location_fields
+    :param approximate_count_over: Optional. The approximate_count_over of get_paginator that
+    resolve_paginated_for_type uses for the paginated type, e.g. for a type of a very large table.
+    Defaults to approximate_count_threshold()
     :return: An object containing {type: The class, fields: The field}
     """
 
+    # Changes to the model invalidate its cached pages in every process that builds the type, see page_cache
+    model = getattr(model_object_type._meta, 'model', None)
+    if model:
+        watch_pages(model)
+
     """
         Mixin for adding pagination to any Graphene Type
     """
@@ -53,20 +285,30 @@ def create_paginated_type_mixin(model_object_type, model_object_type_fields):
         dict(
             # order_by is extracted for ordering in django style, like '+key,-name'
             order_by=String(required=False),
+            # The cursor of the page for keyset pagination, see get_paginator
+            cursor=String(required=False),
+            next_cursor=String(),
             page_size=Int(),
             page=Int(),
             pages=Int(),
+            # True if pages is from the planner's row estimate, see get_paginator
+            pages_approximate=Boolean(),
             has_next=Boolean(),
             has_prev=Boolean(),
             objects=List(model_object_type),
+            # Not a field. Read by resolve_paginated_for_type
+            approximate_count_over=approximate_count_over
         )
     )
 
     paginated_fields = dict(
         page_size=dict(type=Int, graphene_type=Int, create=DENY, update=DENY),
         order_by=dict(type=String, graphene_type=String, create=DENY, update=DENY),
+        cursor=dict(type=String, graphene_type=String, create=DENY, update=DENY),
+        next_cursor=dict(type=String, graphene_type=String, create=DENY, update=DENY),
         page=dict(type=Int, graphene_type=Int, create=DENY, update=DENY),
         pages=dict(type=Int, graphene_type=Int, create=DENY, update=DENY),
+        pages_approximate=dict(type=Boolean, graphene_type=Boolean, create=DENY, update=DENY),
         has_next=dict(type=Boolean, graphene_type=Boolean, create=DENY, update=DENY),
         has_prev=dict(type=Boolean, graphene_type=Boolean, create=DENY, update=DENY),
         objects=dict(
@@ -80,37 +322,60 @@ def create_paginated_type_mixin(model_object_type, model_object_type_fields):
     return dict(type=paginated_type_mixin, fields=paginated_fields)
 
 
-def resolve_paginated_for_type(paginated_type, type_resolver, **kwargs):
+def resolve_paginated_for_type(paginated_type, type_resolver, info=None, fields=None,
+                               process_filter_kwargs=process_filter_kwargs, approximate_count_over=None, **kwargs):
     """
         Resolver for paginated types
     :param paginated_type: The paginated Type, e.g. LocationPaginationType
-    :param type_resolver: The resolver for the non-paginated type, e.g. location_resolver
+    :param type_resolver: The resolver for the non-paginated type, e.g. location_resolver. It's called once
+    without filter kwargs and its queryset is filtered by one expression of the items of objects, see
+    filter_sets_expression, so the page is a single query without duplicate joins. If an item has a filter
+    that only Django's joins answer, like an isnull lookup across a to-many relation, type_resolver is instead
+    called with the kwargs of each item of objects and the querysets are or'd into the one query of the page
+    :param info: Optional resolve info of the paginated field, see get_paginator
+    :param fields: The field configs of the non-paginated type, used with info
+    :param process_filter_kwargs: Defaults to schema_helpers.process_filter_kwargs. Processes the kwargs of
+    each item of objects for the single expression. Pass None if type_resolver does more with its kwargs
+    than filter by them that way, e.g. applies permissions or handles custom keys, so that it's always
+    called with the kwargs of each item
+    :param approximate_count_over: Optional. See get_paginator. Defaults to the approximate_count_over that
+    create_paginated_type_mixin configured for paginated_type
     :param kwargs: The kwargs Array of prop sets for the non-paginated objects in 'objects'.
-    Normally it's just a 1-item array.
-    Other required kwargs are for pagination are page_size and page and optional order_by
+    Normally it's just a 1-item array. Instances matching any of the prop sets are paginated
+    Other required kwargs are for pagination are page_size and page and optional order_by. Pass cursor instead of
+    page for keyset pagination, see get_paginator
     :return: The paginated query
     """
 
-    def reduce_or(q_expressions):
-        return R.reduce(
-            lambda qs, q: qs | q if qs else q,
+    objects = R.prop_or([], 'objects', kwargs)
+    instances = type_resolver('filter')
+    q_expression = filter_sets_expression(
+        instances.model,
+        objects,
+        process_filter_kwargs=process_filter_kwargs,
+        semi_joins=False
+    ) if process_filter_kwargs else None
+    if q_expression is not None:
+        instances = instances.filter(q_expression)
+    elif objects:
+        # Or the querysets' conditions without evaluating them
+        instances = R.reduce(
+            lambda qs, q: q if qs is None else qs | q,
             None,
-            q_expressions
+            R.map(lambda obj: type_resolver('filter', **obj), objects)
         )
 
-    objects = R.prop_or({}, 'objects', kwargs)
-
-    instances = reduce_or(R.map(
-        lambda obj: type_resolver('filter', **obj),
-        objects
-    ))
-
     return get_paginator(
         instances,
         R.prop('page_size', kwargs),
         R.prop('page', kwargs),
         paginated_type,
-        R.prop('order_by', kwargs)
+        R.prop('order_by', kwargs),
+        info=info,
+        fields=fields,
+        cursor=R.prop_or(None, 'cursor', kwargs),
+        approximate_count_over=approximate_count_over if approximate_count_over is not None else
+        getattr(paginated_type, 'approximate_count_over', None)
     )
 
 
@@ -0,0 +1,40 @@
+from snapshottest import TestCase
+
+from rescape_graphene.django_helpers.index_advisor import index_proposals, index_migrations, query_log_lookups, \
+    TRIGRAM, BTREE, JSONB_PATH_OPS
+
+
+class TestIndexAdvisor(TestCase):
+    def test_index_proposals(self):
+        from sample_webapp.sample_schema import default_class_config
+
+        proposals = index_proposals(default_class_config)
+        kinds = [[proposal['field'], proposal['kind']] for proposal in proposals]
+        assert ['name', TRIGRAM] in kinds
+        assert ['created_at', BTREE] in kinds
+        assert ['geojson', JSONB_PATH_OPS] in kinds
+        # Foo.data already has a jsonb_path_ops index and key's unique index serves its range lookups
+        assert not [field for field, kind in kinds if field == 'data' or [field, kind] == ['key', BTREE]]
+
+        migration = index_migrations(proposals)[0].as_string()
+        assert 'TrigramExtension(' in migration
+        assert "opclasses=['jsonb_path_ops']" in migration
+
+    def test_index_proposals_query_log(self):
+        from sample_webapp.sample_schema import default_class_config
+
+        counts = query_log_lookups([
+            'SELECT "sample_webapp_foo"."id" FROM "sample_webapp_foo" '
+            'WHERE ("sample_webapp_foo"."name"::text LIKE %a% AND "sample_webapp_foo"."created_at" >= 2020) '
+            'ORDER BY "sample_webapp_foo"."updated_at" DESC LIMIT 10',
+            'SELECT "sample_webapp_foo"."id" FROM "sample_webapp_foo" '
+            'WHERE EXTRACT(\'year\' FROM "sample_webapp_foo"."created_at") = 2020'
+        ])
+        assert counts[('sample_webapp_foo', 'created_at', BTREE)] == 2
+        # Only what the queries use is proposed, most used first
+        assert [[proposal['field'], proposal['kind'], proposal['count']] for proposal in
+                index_proposals(default_class_config, counts)] == [
+            ['created_at', BTREE, 2],
+            ['name', TRIGRAM, 1],
+            ['updated_at', BTREE, 1]
+        ]
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from django.apps import apps
+
+from sample_webapp.models import Foo, Bar
+from .model_metadata import model_metadata, FOREIGN_KEY, MANY_TO_MANY, REVERSE
+
+
+class ModelMetadataTestCase(TestCase):
+
+    def test_model_metadata(self):
+        metadata = model_metadata(Foo)
+        assert model_metadata(Foo) is metadata
+        assert metadata['field_by_name']['key'] is Foo._meta.get_field('key')
+        assert metadata['forward_fields_map']['user_id'] is Foo._meta.get_field('user')
+        assert metadata['relation_kinds']['user'] == FOREIGN_KEY
+        assert metadata['relation_kinds']['bars'] == MANY_TO_MANY
+        assert metadata['relation_kinds']['name'] is None
+        assert model_metadata(Bar)['relation_kinds']['foo'] == REVERSE
+        assert 'foo' in model_metadata(Bar)['related_objects_by_name']
+
+    def test_model_metadata_expires_with_app_registry(self):
+        metadata = model_metadata(Foo)
+        # Django expires the _meta caches of every model when the registry is reloaded
+        apps.clear_cache()
+        assert model_metadata(Foo) is not metadata
+        assert model_metadata(Foo) is model_metadata(Foo)
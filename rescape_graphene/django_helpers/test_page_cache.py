@@ -0,0 +1,85 @@
+from django.core.cache import caches
+from django.db.models.signals import post_save, m2m_changed
+from django.test import override_settings
+from snapshottest import TestCase
+
+from rescape_graphene.django_helpers.page_cache import cached_page, page_cache_stats, reset_page_cache_stats, \
+    invalidate_pages, _generation_key
+
+PAGE_CACHE_SETTINGS = dict(
+    CACHES=dict(
+        default=dict(BACKEND='django.core.cache.backends.locmem.LocMemCache', LOCATION='default'),
+        pages=dict(BACKEND='django.core.cache.backends.locmem.LocMemCache', LOCATION='test_page_cache')
+    ),
+    RESCAPE_GRAPHENE_PAGE_CACHE='pages'
+)
+
+
+class Page:
+    def __init__(self, objects, **metadata):
+        self.objects = objects
+        for name, value in metadata.items():
+            setattr(self, name, value)
+
+
+class TestPageCache(TestCase):
+    def test_cached_page(self):
+        from sample_webapp.models import Foo
+        qs = Foo.objects.filter(name='Foo').order_by('id')
+        fetched = []
+
+        def get_page():
+            fetched.append(1)
+            return Page([], page=1, pages=0, page_size=10, has_next=False, has_prev=False)
+
+        def page(key_args=None):
+            return cached_page(qs, key_args or [1], get_page, lambda objects, metadata: Page(objects, **metadata))
+
+        # Without a cache every page is fetched
+        page()
+        assert len(fetched) == 1 and page_cache_stats() == dict(hits=0, misses=0, invalidations=0)
+
+        with override_settings(**PAGE_CACHE_SETTINGS):
+            reset_page_cache_stats()
+            assert page().pages == 0
+            assert page().page_size == 10
+            assert len(fetched) == 2
+            # Other arguments or filters are other pages
+            page([2])
+            qs = qs.filter(key='foo')
+            page()
+            assert len(fetched) == 4
+
+            # Saving a Foo or changing its bars invalidates its pages
+            post_save.send(sender=Foo, instance=Foo(), created=False, raw=True, using='default', update_fields=None)
+            page()
+            m2m_changed.send(sender=Foo.bars.through, instance=Foo(), action='post_add', reverse=False,
+                             model=Foo, pk_set={1}, using='default')
+            page()
+            page()
+            invalidate_pages(Foo)
+            page()
+            assert len(fetched) == 7
+            assert page_cache_stats() == dict(hits=2, misses=6, invalidations=3)
+
+            # An evicted generation doesn't restart, which would serve the pages of earlier generations
+            caches['pages'].delete(_generation_key(Foo))
+            page()
+            caches['pages'].delete(_generation_key(Foo))
+            invalidate_pages(Foo)
+            page()
+            assert len(fetched) == 9
+
+    def test_paginated_type_watches_pages(self):
+        from sample_webapp.foo_schema import BarType, bar_fields
+        from sample_webapp.models import Bar
+        from rescape_graphene.django_helpers.pagination import create_paginated_type_mixin
+
+        # Creating a paginated type connects the signals of its model, so that a process that never
+        # serves a page of Bars still invalidates them
+        create_paginated_type_mixin(BarType, bar_fields)
+        with override_settings(**PAGE_CACHE_SETTINGS):
+            cache = caches['pages']
+            cache.set(_generation_key(Bar), 1, None)
+            post_save.send(sender=Bar, instance=Bar(), created=False, raw=True, using='default', update_fields=None)
+            assert cache.get(_generation_key(Bar)) == 2
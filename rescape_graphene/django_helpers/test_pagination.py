@@ -0,0 +1,31 @@
+from django.db.models import Q
+from snapshottest import TestCase
+
+from rescape_graphene.django_helpers.pagination import _order_by_columns, encode_cursor, decode_cursor, keyset_filter
+
+
+class TestPagination(TestCase):
+    def test_cursor(self):
+        from datetime import datetime, timezone
+        columns = _order_by_columns('-created_at,+name')
+        assert columns == [['created_at', True], ['name', False], ['pk', False]]
+
+        created_at = datetime(2020, 1, 1, 0, 0, 0, 123456, tzinfo=timezone.utc)
+        cursor = encode_cursor(columns, [created_at, 'Foo', 2])
+        # Microseconds are kept
+        assert decode_cursor(columns, cursor) == [created_at.isoformat(), 'Foo', 2]
+        with self.assertRaises(ValueError):
+            decode_cursor(_order_by_columns('name'), cursor)
+
+    def test_keyset_filter(self):
+        from sample_webapp.models import Foo
+
+        assert keyset_filter(Foo, _order_by_columns('-created_at,name'), ['2020-01-01', 'Foo', 2]) == \
+               Q(created_at__lte='2020-01-01') & (
+                       Q(created_at__lt='2020-01-01') |
+                       Q(created_at='2020-01-01') & Q(name__gt='Foo') |
+                       Q(created_at='2020-01-01') & Q(name='Foo') & Q(pk__gt=2)
+               )
+        # Postgres orders nulls last, so nothing but ties come after a null
+        assert keyset_filter(Foo, _order_by_columns('user__username'), [None, 2]) == \
+               Q(user__username__isnull=True) & Q(pk__gt=2)
@@ -1,37 +1,123 @@
 from operator import itemgetter
 
 import graphene
-from graphene import Int, ObjectType, List, Field
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import serializers
+from django.core.serializers.base import DeserializationError
+from graphene import Int, ObjectType, List, Field, String, Boolean, DateTime
 from graphene_django import DjangoObjectType
+from graphql import GraphQLError
 from rescape_python_helpers import ramda as R
 from reversion.models import Version, Revision
+from reversion.revisions import _get_options
 
+from rescape_graphene.django_helpers.pagination import encode_cursor, decode_cursor, keyset_filter
 from rescape_graphene.graphql_helpers.schema_helpers import DENY, merge_with_django_properties, \
-    top_level_allowed_filter_arguments
+    top_level_allowed_filter_arguments, process_filter_kwargs
 from rescape_graphene.schema_models.user_schema import UserType, user_fields
 
 
-def get_versioner(single_object_qs, versions_type, **kwargs):
+# Versions are newest first. An instance has one version per revision, so the revision orders them uniquely,
+# and Version's unique index on (db, content_type, object_id, revision) serves the order of an instance's versions
+VERSION_ORDER = [['revision_id', True]]
+
+
+def version_limit():
     """
+        The number of versions get_versioner returns if no limit is given. None, the default, returns every version
+    """
+    return getattr(settings, 'RESCAPE_GRAPHENE_VERSION_LIMIT', None)
+
 
-    Cre
-    First we create a little helper function, becase we will potentially have many PaginatedTypes
-    and we will potentially want to turn many querysets into paginated results:
+def get_versioner(single_object_qs, versions_type, limit=None, cursor=None, before=None, after=None, user=None,
+                  **kwargs):
+    """
+        Creates a versions_type holding the versions of the instance of single_object_qs, newest first.
+        The arguments window and filter the versions in the query of Version, so that a window costs the same
+        however long the instance's history is
     :param single_object_qs: The queryset that must return exactly one instance
     :param versions_type Class created by create_versions_type to hold all the versions of one model instance
+    :param limit: Optional. The number of versions to return, one more being fetched for has_next. Defaults to
+    version_limit(). Must be positive, since it comes from the client
+    :param cursor: Optional. The next_cursor of the previous window. The versions are those older than it
+    :param before: Optional. Only versions whose revision's date_created is before this datetime
+    :param after: Optional. Only versions whose revision's date_created is after this datetime
+    :param user: Optional. User filter kwargs, e.g. dict(id=1). Only versions whose revision's user matches
     :param kwargs: Addition kwargs to versioned_type, usually not needed
     :return:
     """
 
+    limit = limit if limit is not None else version_limit()
+    if limit is not None and limit < 1:
+        raise GraphQLError(f'limit must be a positive number of versions, not {limit}')
+
     instance = R.head(single_object_qs)
     versions = Version.objects.get_for_object(instance)
+    if before:
+        versions = versions.filter(revision__date_created__lt=before)
+    if after:
+        versions = versions.filter(revision__date_created__gt=after)
+    if user:
+        versions = versions.filter(
+            revision__user__in=get_user_model().objects.filter(*process_filter_kwargs(get_user_model(), **user))
+        )
+    if cursor:
+        versions = versions.filter(keyset_filter(Version, VERSION_ORDER, decode_cursor(VERSION_ORDER, cursor)))
+    versions = versions.select_related('revision__user').order_by('-revision_id')
+
+    rows = list(versions[:limit + 1] if limit is not None else versions)
+    objects = rows[:limit] if limit is not None else rows
+    has_next = len(rows) > len(objects) and len(objects) > 0
 
     return versions_type(
-        objects=list(versions),  # R.map(lambda version: version._object_version.object, list(versions)),
+        objects=deserialize_versions(objects),
+        limit=limit,
+        cursor=cursor,
+        next_cursor=encode_cursor(VERSION_ORDER, [R.last(objects).revision_id]) if has_next else None,
+        has_next=has_next,
+        before=before,
+        after=after,
         **kwargs
     )
 
 
+def deserialize_versions(versions):
+    """
+        Deserializes the serialized_data of versions in one pass per model and format rather than one
+        serializers.deserialize call per version, caching each result as the version's _object_version like
+        reversion does on first access. Only json versions are combined. Versions of other formats, and those
+        of a model whose combined data fails to deserialize, are left to be deserialized on access, which
+        raises reversion's RevertError for bad data
+    :param versions: Version instances
+    :return: versions
+    """
+    batches = {}
+    for version in versions:
+        if version.format == 'json' and '_object_version' not in version.__dict__:
+            batches.setdefault(version.content_type_id, []).append(version)
+
+    for batch in batches.values():
+        # Each version's json is a list of its one object
+        data = R.map(lambda version: version.serialized_data.strip(), batch)
+        if not all(datum.startswith('[{') and datum.endswith('}]') for datum in data):
+            continue
+        try:
+            object_versions = list(serializers.deserialize(
+                'json',
+                f"[{','.join(R.map(lambda datum: datum[1:-1], data))}]",
+                ignorenonexistent=True,
+                use_natural_foreign_keys=_get_options(R.head(batch)._model).use_natural_foreign_keys
+            ))
+        except DeserializationError:
+            continue
+        if len(object_versions) != len(batch):
+            continue
+        for version, object_version in zip(batch, object_versions):
+            version.__dict__['_object_version'] = object_version
+    return versions
+
+
 class RevisionType(DjangoObjectType):
     id = graphene.Int(source='pk')
 
@@ -113,12 +199,28 @@ def create_version_container_type(model_object_type, model_object_type_fields):
         f'VersionContainerTypeModelFor{model_object_type.__name__}',
         (ObjectType,),
         dict(
+            # The window and filters of the versions, see get_versioner
+            limit=Int(),
+            cursor=String(),
+            next_cursor=String(),
+            has_next=Boolean(),
+            before=DateTime(),
+            after=DateTime(),
+            user=Field(UserType),
             objects=List(version_type)
         )
     )
 
     # Merge the Revision Django properties with our field config
     versions_fields = merge_with_django_properties(VersionType, dict(
+        # The window and filters are arguments without filters of their own
+        limit=dict(type=Int, graphene_type=Int, filters=[], create=DENY, update=DENY),
+        cursor=dict(type=String, graphene_type=String, filters=[], create=DENY, update=DENY),
+        next_cursor=dict(type=String, graphene_type=String, filters=[], create=DENY, update=DENY),
+        has_next=dict(type=Boolean, graphene_type=Boolean, filters=[], create=DENY, update=DENY),
+        before=dict(type=DateTime, graphene_type=DateTime, filters=[], create=DENY, update=DENY),
+        after=dict(type=DateTime, graphene_type=DateTime, filters=[], create=DENY, update=DENY),
+        user=dict(graphene_type=UserType, fields=user_fields, filters=[], create=DENY, update=DENY),
         # Versions
         objects=dict(
             type=version_type,
@@ -136,7 +238,8 @@ def resolve_version_instance(model_versioned_type, resolver, **kwargs):
         The kwargs must contain objects: [{id: the id}]
     :param model_versioned_type: Graphene model class created by create_version_container_type
     :param resolver: Resolver for the model
-    :param kwargs: Must contain objects: [{id: the id}] to resolve the versions of the instance given by id
+    :param kwargs: Must contain objects: [{id: the id}] to resolve the versions of the instance given by id.
+    Optionally contains the limit, cursor, before, after and user arguments of get_versioner
     :return:
     """
     # We technically receive an array but never accept more than the first item
@@ -150,6 +253,7 @@ def resolve_version_instance(model_versioned_type, resolver, **kwargs):
     return get_versioner(
         objs,
         model_versioned_type,
+        **R.pick(['limit', 'cursor', 'before', 'after', 'user'], kwargs)
     )
 
 def versioning_allowed_filter_arguments(fields, graphene_type):
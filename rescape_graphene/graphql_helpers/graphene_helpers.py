@@ -14,6 +14,18 @@ def call_if_lambda(maybe_lambda):
     return R.when(R.isfunction, lambda f: f())(maybe_lambda)
 
 
+def fullname(klass):
+    """
+        The module qualified name of the class, e.g. graphene.types.scalars.String
+    :param klass:
+    :return:
+    """
+    module = klass.__module__
+    if module == 'builtins':
+        return klass.__qualname__  # avoid outputs like 'builtins.str'
+    return module + '.' + klass.__qualname__
+
+
 def handleGrapheneTypes(key, value):
     """
         Handle related Graphene types. This is recursive since it calls dump_grpahql_keys
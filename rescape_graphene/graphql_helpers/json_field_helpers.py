@@ -1,4 +1,11 @@
 import ast
+import hashlib
+import json
+from django.db import connection
+from django.db.models import Model, JSONField
+from django.db.models.expressions import RawSQL
+from graphene import String
+from graphql.language import ast as graphql_ast
 from safedelete.models import SafeDeleteModel
 from collections import namedtuple
 
@@ -22,15 +29,163 @@ def resolve_selections(context):
     return R.map(lambda sel: sel.name.value, context.field_asts[0].selection_set.selections)
 
 
-def pick_selections(selections, data):
+def pick_selections(selections, data, json_source=None):
     """
         Pick the selections from the current data
     :param {[Sting]} selections: The field names to that are in the query
     :param {dict} data: Data to pick from
+    :param {dict} json_source: Optional dict(instance=model instance, path=keys of data in the instance)
+    that lets resolver_for_dict_list find the lists that the query filtered in the database
     :return: {DataTuple} data with limited to selections
     """
     dct = R.pick(selections, data)
-    return namedtuple('DataTuple', R.keys(dct))(*R.values(dct))
+    data_tuple = namedtuple('DataTuple', R.keys(dct))
+    if json_source:
+        # Subclass so that the source doesn't become a field
+        data_tuple = type('DataTuple', (data_tuple,), dict(_json_source=json_source))
+    return data_tuple(*R.values(dct))
+
+
+def _json_source(resource, field_name):
+    """
+        Where the value of resource[field_name] is stored, if it's a model instance's json field or in one
+    :param resource: A model instance or a DataTuple of resolver_for_dict_field
+    :param field_name: The field of resource
+    :return: dict(instance=model instance, path=tuple of keys of the value from the instance) or None
+    """
+    if isinstance(resource, Model):
+        return dict(instance=resource, path=(field_name,))
+    source = getattr(resource, '_json_source', None)
+    return R.merge(source, dict(path=source['path'] + (field_name,))) if source else None
+
+
+def json_list_containment(kwargs):
+    """
+        Translates the filter arguments of a json list to the jsonb value that matching elements contain.
+        Elements contain a value when it's a subset of them, which is what R.dict_matches_params_deep matches,
+        except for lists, which R.dict_matches_params_deep matches item by item in order
+    :param kwargs: The arguments of resolver_for_dict_list
+    :return: The value for jsonb @> or None if kwargs are empty or can't be translated
+    """
+
+    def translatable(value):
+        if isinstance(value, dict):
+            return R.all_pass_dict(lambda key, v: translatable(v), value)
+        return value is None or isinstance(value, (str, int, float))
+
+    return kwargs if kwargs and translatable(kwargs) else None
+
+
+def json_list_annotation_name(path, containment):
+    """
+        The name of the annotation holding the elements of the json list at path that contain containment.
+        The name is derived from both so that resolver_for_dict_list only uses an annotation for its own arguments
+    :param path: The keys of the list from the model instance, starting with the json field
+    :param containment: The result of json_list_containment
+    :return: The annotation name
+    """
+    digest = hashlib.md5(json.dumps([list(path), containment], sort_keys=True).encode()).hexdigest()
+    return f'json_list_{digest[:16]}'
+
+
+def json_list_filter_expression(model, path, containment):
+    """
+        Selects the elements of the json list at path that contain containment, in their order.
+        The value is null when path isn't a list, in which case resolver_for_dict_list filters in Python
+    :param model: The model of the json field
+    :param path: The keys of the list from the model instance, starting with the json field
+    :param containment: The result of json_list_containment
+    :return: A RawSQL expression to annotate model's queryset with
+    """
+    field = model._meta.get_field(underscore(R.head(path)))
+    column = f'{connection.ops.quote_name(model._meta.db_table)}.{connection.ops.quote_name(field.column)}'
+    keys = list(R.tail(path))
+    return RawSQL(
+        f"""CASE WHEN jsonb_typeof({column} #> %s::text[]) = 'array' THEN (
+            SELECT coalesce(jsonb_agg(element ORDER BY position), '[]'::jsonb)
+            FROM jsonb_array_elements({column} #> %s::text[]) WITH ORDINALITY AS elements(element, position)
+            WHERE element @> %s::jsonb
+        ) END""",
+        (keys, keys, json.dumps(containment)),
+        output_field=JSONField()
+    )
+
+
+def _json_field_resolver(field_config):
+    """
+        The resolver that the type_modifier of a json field config gives the field
+    :param field_config: A field config of a json field, e.g. feature_collection_data_type_fields['features']
+    :return: The resolver or None
+    """
+    if not R.has('type_modifier', field_config):
+        return None
+    modified = field_config['type_modifier'](R.prop_or(String, 'graphene_type', field_config))
+    return getattr(modified, 'resolver', None) or R.prop_or(None, 'resolver', getattr(modified, 'kwargs', {}))
+
+
+def argument_value(value_ast, variables):
+    """
+        The value of an argument in a query document, with the keys of input objects underscored like the kwargs
+        that graphene passes to resolvers, whether the value is a literal or a variable
+    :param value_ast: The value of the argument's ast
+    :param variables: The variable values of the query, whose input object keys are camel case
+    :return: The value
+    """
+    if isinstance(value_ast, graphql_ast.Variable):
+        return R.map_keys_deep(
+            lambda key, value: underscore(key) if isinstance(key, str) else key,
+            R.prop_or(None, value_ast.name.value, variables or {})
+        )
+    if isinstance(value_ast, graphql_ast.IntValue):
+        return int(value_ast.value)
+    if isinstance(value_ast, graphql_ast.FloatValue):
+        return float(value_ast.value)
+    if isinstance(value_ast, graphql_ast.ListValue):
+        return R.map(lambda value: argument_value(value, variables), value_ast.values)
+    if isinstance(value_ast, graphql_ast.ObjectValue):
+        return {underscore(field.name.value): argument_value(field.value, variables) for field in value_ast.fields}
+    return value_ast.value
+
+
+def json_list_filter_annotations(model, field_config, field_asts, fragments=None, variables=None):
+    """
+        Plans the annotations of model's queryset that filter the json lists selected with arguments under
+        the json field that field_asts select, so that the database returns only the matching elements
+        and resolver_for_dict_list doesn't filter every element in Python. Lists are followed through json dicts
+        resolved by resolver_for_dict_field but not into the elements of lists. The argument values are
+        evaluated from the query here, and resolver_for_dict_list only uses an annotation whose name
+        matches the arguments it's called with, see json_list_annotation_name
+    :param model: The model of the json field
+    :param field_config: The field config of the json field, e.g. foo_fields['geojson']
+    :param field_asts: The field asts that select the json field
+    :param fragments: The fragment definitions of the query
+    :param variables: The variable values of the query
+    :return: dict of annotation names and expressions
+    """
+    from rescape_graphene.graphql_helpers.selection_query_helpers import selection_tree
+
+    def annotations(path, config, asts):
+        if _json_field_resolver(config) == resolver_for_dict_list:
+            containments = R.filter(
+                lambda containment: containment is not None,
+                R.map(
+                    lambda field_ast: json_list_containment({
+                        underscore(argument.name.value): argument_value(argument.value, variables)
+                        for argument in field_ast.arguments or []
+                    }),
+                    asts
+                )
+            )
+            return {
+                json_list_annotation_name(path, containment): json_list_filter_expression(model, path, containment)
+                for containment in containments
+            }
+        return R.merge_all([{}] + [
+            annotations(path + (R.head(selections).name.value,), R.prop_or({}, name, R.prop_or({}, 'fields', config)), selections)
+            for name, selections in selection_tree(asts, fragments).items()
+        ])
+
+    return annotations((R.head(field_asts).name.value,), field_config, field_asts)
 
 
 def resolver_for_dict_field(resource, context, **kwargs):
@@ -52,7 +207,8 @@ def resolver_for_dict_field(resource, context, **kwargs):
     # need some way to figure out where they are in data
     passes = R.dict_matches_params_deep(kwargs, data)
     # Pick the selections from our resource json field value default to {} if resource[field_name] is null
-    return pick_selections(selections, data) if passes else namedtuple('DataTuple', [])()
+    return pick_selections(selections, data, _json_source(resource, field_name)) if passes else \
+        namedtuple('DataTuple', [])()
 
 
 def resolver_for_dict_list(resource, context, **kwargs):
@@ -60,7 +216,8 @@ def resolver_for_dict_list(resource, context, **kwargs):
         Resolver for the data field that is a list. This extracts the desired json fields from the context
         and creates a tuple of the field values. Graphene has no built in way for drilling into json types.
         The property value must be a list or null. Null values will return null, list values will be processed
-        in turn by graphene
+        in turn by graphene. If the query annotated the model instance with the elements that match kwargs,
+        see json_list_filter_annotations, those are used. Otherwise the elements are filtered in Python
     :param resource:
     :param context:
     :params kwargs: Arguments to filter with
@@ -71,6 +228,13 @@ def resolver_for_dict_list(resource, context, **kwargs):
     # Value defaults to None. Empty is not the same as None
     value = R.prop(field_name, resource) if R.has(field_name, resource) else None
 
+    source = _json_source(resource, field_name)
+    containment = json_list_containment(kwargs)
+    filtered = getattr(source['instance'], json_list_annotation_name(source['path'], containment), None) if \
+        source and containment is not None else None
+    if filtered is not None:
+        return R.map(lambda data: pick_selections(selections, data), filtered)
+
     return R.map(
         lambda data: pick_selections(selections, data),
         R.filter(
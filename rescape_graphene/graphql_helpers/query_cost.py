@@ -0,0 +1,195 @@
+import inspect
+from collections import Counter
+
+from django.conf import settings
+from graphene_django import DjangoObjectType
+from graphql import GraphQLList, GraphQLNonNull, GraphQLObjectType, GraphQLInterfaceType
+from graphql.language import ast
+from inflection import underscore, camelize
+from more_itertools import first
+from rescape_python_helpers import ramda as R
+
+from .graphene_helpers import call_if_lambda
+from .json_field_helpers import argument_value
+from .schema_helpers import FILTER_FIELDS, top_level_field_configs
+from .selection_query_helpers import selection_tree
+
+###
+# Estimates the cost of a query from its document and variables before any resolver runs, so that SafeGraphQLView
+# can reject or downgrade queries that would tie up a database connection. See query_cost
+###
+
+# The default weights of query_cost. settings.RESCAPE_GRAPHENE_QUERY_COST_WEIGHTS overrides any of them
+QUERY_COST_WEIGHTS = dict(
+    # Each object resolved, unless the field config of the object's field has a cost
+    object=1,
+    # The assumed length of a list whose field has no page_size or limit argument
+    list_size=100,
+    # Each filter of a related model, which is a join or an EXISTS subquery
+    relation_filter=10,
+    # Each filtered json field or json list
+    json_filter=5,
+    # Each value of an in filter
+    in_value=0.1
+)
+
+# Arguments that limit the length of a list, either of the field's own list or, for a paginated type, of the
+# lists it selects
+_PAGE_SIZE_ARGUMENTS = ['page_size', 'limit']
+
+# Filter suffixes longest first, so that name_in_not is matched by in_not rather than not
+_FILTER_SUFFIXES = sorted(R.keys(FILTER_FIELDS), key=lambda suffix: -len(suffix))
+
+
+def query_cost_weights():
+    return R.merge(QUERY_COST_WEIGHTS, getattr(settings, 'RESCAPE_GRAPHENE_QUERY_COST_WEIGHTS', {}))
+
+
+def _named_type(graphql_type):
+    while isinstance(graphql_type, (GraphQLList, GraphQLNonNull)):
+        graphql_type = graphql_type.of_type
+    return graphql_type
+
+
+def _is_list(graphql_type):
+    return isinstance(
+        graphql_type.of_type if isinstance(graphql_type, GraphQLNonNull) else graphql_type,
+        GraphQLList
+    )
+
+
+def _is_django_type(graphql_type):
+    graphene_type = getattr(_named_type(graphql_type), 'graphene_type', None)
+    return inspect.isclass(graphene_type) and issubclass(graphene_type, DjangoObjectType)
+
+
+def _filter_suffix(key):
+    return first(R.filter(lambda suffix: key.endswith(f'_{suffix}'), _FILTER_SUFFIXES), None)
+
+
+def _filter_counts(graphql_type, kwargs, in_json=False):
+    """
+        Counts the related model filters, json field filters and in filter values of filter kwargs
+    :param graphql_type: The graphql type of the filtered objects
+    :param kwargs: The underscored filter kwargs
+    :param in_json: True if the kwargs filter a json field. Their nested filters are part of the same containment
+    :return: Counter of relation_filters, json_filters and in_values
+    """
+    counts = Counter()
+    fields = getattr(graphql_type, 'fields', {})
+    for key, value in kwargs.items():
+        suffix = _filter_suffix(key)
+        if suffix in ['in', 'in_not'] and isinstance(value, list):
+            # Compared as a column, see process_query_kwarg
+            counts['in_values'] += len(value)
+            continue
+        field = R.prop_or(None, camelize(key[:-len(suffix) - 1] if suffix else key, False), fields)
+        dcts = R.filter(lambda item: isinstance(item, dict), value if isinstance(value, list) else [value])
+        if not field or not dcts:
+            continue
+        if in_json:
+            related_in_json = True
+        elif not _is_django_type(field.type):
+            related_in_json = True
+            counts['json_filters'] += 1
+        else:
+            related_in_json = False
+            # A Django type that isn't a Django type's field is a container, like the objects of a paginated type
+            if _is_django_type(graphql_type):
+                counts['relation_filters'] += len(dcts)
+        for dct in dcts:
+            counts.update(_filter_counts(_named_type(field.type), dct, related_in_json))
+    return counts
+
+
+def query_cost(schema, document_ast, variables=None, operation_name=None):
+    """
+        Estimates the cost of executing an operation of a query document. Each object that a field resolves costs
+        the field config's cost or the object weight, and each list multiplies the cost of its objects by its
+        page_size or limit argument, by the page_size of the paginated type that selects it, or else by the
+        list_size weight. Filter arguments add the relation_filter weight for each filter of a related model,
+        the json_filter weight for each filtered json field or json list and the in_value weight for each value
+        of an in filter. The weights are QUERY_COST_WEIGHTS merged with settings.RESCAPE_GRAPHENE_QUERY_COST_WEIGHTS.
+        Introspection fields cost nothing
+    :param schema: The graphene Schema
+    :param document_ast: The parsed query document
+    :param variables: The variable values of the operation
+    :param operation_name: The name of the operation to execute. Needed if the document has more than one
+    :return: dict(cost=the cost, depth=the deepest nesting of objects, lists=the number of list fields,
+    relation_filters, json_filters, in_values), or None if the document has no such operation
+    """
+    weights = query_cost_weights()
+    operations = R.filter(
+        lambda definition: isinstance(definition, ast.OperationDefinition) and (
+            not operation_name or (definition.name and definition.name.value == operation_name)
+        ),
+        document_ast.definitions
+    )
+    if len(operations) != 1:
+        return None
+    operation = R.head(operations)
+    fragments = {
+        definition.name.value: definition for definition in document_ast.definitions
+        if isinstance(definition, ast.FragmentDefinition)
+    }
+    root_type = dict(
+        query=schema.get_query_type(),
+        mutation=schema.get_mutation_type(),
+        subscription=schema.get_subscription_type()
+    )[operation.operation]
+
+    def selections_cost(graphql_type, field_asts, field_configs, page_size, depth):
+        """
+        :return: [Counter of cost, lists, relation_filters, json_filters and in_values, depth]
+        """
+        counts = Counter()
+        max_depth = depth - 1
+        for name, selections in selection_tree(field_asts, fragments).items():
+            for field_ast in selections:
+                field = R.prop_or(None, field_ast.name.value, getattr(graphql_type, 'fields', {}))
+                named_type = _named_type(field.type) if field else None
+                if not isinstance(named_type, (GraphQLObjectType, GraphQLInterfaceType)):
+                    # Scalars are part of their object's cost
+                    continue
+                kwargs = {
+                    underscore(argument.name.value): argument_value(argument.value, variables)
+                    for argument in field_ast.arguments or []
+                }
+                argument_page_size = first(R.filter(
+                    lambda size: isinstance(size, int),
+                    R.map(lambda key: R.prop_or(None, key, kwargs), _PAGE_SIZE_ARGUMENTS)
+                ), None)
+                filter_kwargs = R.omit(_PAGE_SIZE_ARGUMENTS + ['page', 'cursor', 'order_by'], kwargs)
+                if _is_django_type(named_type):
+                    filter_counts = _filter_counts(named_type, filter_kwargs)
+                else:
+                    # Arguments of json lists filter their elements, see resolver_for_dict_list
+                    filter_counts = Counter(json_filters=1 if filter_kwargs else 0)
+
+                field_config = R.prop_or({}, name, field_configs or {})
+                child_counts, child_depth = selections_cost(
+                    named_type,
+                    [field_ast],
+                    call_if_lambda(R.prop_or(None, 'fields', field_config)) or
+                    top_level_field_configs(getattr(named_type, 'graphene_type', None)),
+                    None if _is_list(field.type) else argument_page_size,
+                    depth + 1
+                )
+                size = (argument_page_size or page_size or weights['list_size']) if _is_list(field.type) else 1
+                counts.update(filter_counts)
+                counts.update(R.omit(['cost'], child_counts))
+                counts.update(dict(
+                    lists=1 if _is_list(field.type) else 0,
+                    cost=filter_counts['relation_filters'] * weights['relation_filter'] +
+                         filter_counts['json_filters'] * weights['json_filter'] +
+                         filter_counts['in_values'] * weights['in_value'] +
+                         size * (R.prop_or(weights['object'], 'cost', field_config) + child_counts['cost'])
+                ))
+                max_depth = max(max_depth, child_depth)
+        return [counts, max_depth]
+
+    counts, depth = selections_cost(root_type, [operation], None, None, 1)
+    return R.merge(
+        dict(lists=0, relation_filters=0, json_filters=0, in_values=0),
+        R.merge(dict(counts), dict(cost=round(counts['cost'], 2), depth=depth))
+    )
@@ -0,0 +1,561 @@
+import functools
+import hashlib
+import inspect
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.base import ModelBase
+from django.utils.module_loading import import_string
+from graphene import InputObjectType, InputField, Field
+from graphene.types.structures import Structure
+from graphene.types.unmountedtype import UnmountedType
+from inflection import camelize
+from rescape_python_helpers import ramda as R
+
+from .graphene_helpers import fullname
+from .schema_profiler import record_schema_build_class
+
+logger = logging.getLogger('rescape_graphene')
+
+###
+# Persistent cache of the field tables computed while building the dynamic input types of the schema.
+# input_type_class is memoized, but only for the life of the process, so every worker boot and test run
+# repeats the filter field expansion and Django property merging for every model. When
+# settings.RESCAPE_GRAPHENE_SCHEMA_CACHE names a Django cache alias (ideally a persistent one like FileBasedCache),
+# the fields of each input type are described as plain data, keyed by a fingerprint of the field configs
+# and Django model metadata that produced them, and stored in that cache. The next process with an identical
+# configuration rebuilds the graphene fields from the description instead of recomputing them.
+# Any change to a field config, model or the filter definitions changes the fingerprint, so stale tables
+# are simply never looked up again and are dropped the next time the tables are flushed.
+# A configuration that references a value whose contents the fingerprint can't describe, like an object without
+# a __dict__, isn't cached at all, since a change to that value would go unseen.
+###
+
+# Bump whenever input type construction changes in a way that the fingerprints can't see,
+# so that tables written by an older version of this library are never reused
+SCHEMA_BUILD_CACHE_VERSION = 3
+SCHEMA_BUILD_CACHE_KEY = f'rescape_graphene.schema_build_tables.v{SCHEMA_BUILD_CACHE_VERSION}'
+
+# Field config keys whose no-arg lambdas are called during schema construction to avoid circular imports.
+# Their results, not the lambdas, determine the generated types
+LAZY_FIELD_CONFIG_KEYS = ['graphene_type', 'type', 'fields']
+
+# Input types created by input_type_class, keyed by name. Graphene won't accept two different types of the same name
+# in a schema, so a name always resolves to the one class. Each value is dict(cls=, fields=, table=, shared=) where
+# table is the description of fields once computed, or False if the fields can't be described, and shared is
+# [the fullname of the graphene class, the crud] if the type is shared by ancestries, otherwise None
+_input_types = {}
+
+# The input types shared by ancestries, keyed by the fullname of their graphene class and their crud and then by a hash
+# of their described fields. input_type_class names types by their parent ancestry, so the same related type,
+# e.g. the UserType of a Group and of a Region, would otherwise be generated once per reference path.
+# Each value is dict(cls=, names=the ancestry names that resolve to cls)
+_shared_input_types = {}
+
+# The tables loaded from the cache and the ones read or written by this process
+_schema_build_tables = dict(loaded=None, used={}, dirty=False)
+
+_importable_classes = {}
+_class_canonicals = {}
+_model_fingerprints = {}
+
+
+class UndescribableFieldError(Exception):
+    """
+        Raised for a field value that can't be stored as plain data, such as a lazy type reference
+    """
+    pass
+
+
+class UnfingerprintableValueError(Exception):
+    """
+        Raised for a value whose contents can't be reduced to plain values by fingerprint, such as an object
+        without a __dict__
+    """
+    pass
+
+
+def schema_build_cache():
+    """
+        The Django cache configured by settings.RESCAPE_GRAPHENE_SCHEMA_CACHE, or None if the schema build cache
+        is disabled, which is the default
+    :return: A Django cache or None
+    """
+    alias = getattr(settings, 'RESCAPE_GRAPHENE_SCHEMA_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def deduplicate_input_types():
+    """
+        Whether the related input types of a graphene type and crud with identical field structures are reused
+        under one name for every ancestry, see input_type_class_for_fields. Enabling
+        settings.RESCAPE_GRAPHENE_DEDUPLICATE_INPUT_TYPES renames the shared input types, which breaks clients
+        whose queries declare variables of the ancestry based names, so it defaults to False
+    :return: Boolean
+    """
+    return getattr(settings, 'RESCAPE_GRAPHENE_DEDUPLICATE_INPUT_TYPES', False)
+
+
+def model_fingerprint(model):
+    """
+        The metadata of a Django model that input type generation depends on: the field names, classes,
+        nullability, uniqueness and relations, plus unique_together
+    :param model: Django model class
+    :return: A tuple of plain values
+    """
+    if model not in _model_fingerprints:
+        _model_fingerprints[model] = (
+            model._meta.label,
+            tuple(
+                (
+                    field.name,
+                    fullname(field.__class__),
+                    getattr(field, 'null', False),
+                    getattr(field, 'unique', False),
+                    getattr(field, 'primary_key', False),
+                    field.related_model._meta.label if getattr(field, 'related_model', None) else None
+                ) for field in R.concat(model._meta.fields, R.concat(model._meta.many_to_many, model._meta.related_objects))
+            ),
+            tuple(tuple(group) for group in model._meta.unique_together)
+        )
+    return _model_fingerprints[model]
+
+
+def _code_canonical(code):
+    return (
+        code.co_code,
+        code.co_names,
+        tuple(_code_canonical(const) if inspect.iscode(const) else repr(const) for const in code.co_consts)
+    )
+
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        # Empty cell
+        return None
+
+
+def _canonical(value, stack=()):
+    """
+        Reduces a field config or anything it references to nested tuples of plain values whose repr is stable
+        across processes. Classes are represented by name and, for graphene types of Django models, by their model's
+        metadata. Functions are represented by their bytecode and closures, so that editing a type_modifier lambda
+        changes the result, partials by their function and arguments and other objects by their class and __dict__.
+        No-arg lambdas of LAZY_FIELD_CONFIG_KEYS are called, just as schema construction does
+    :param value:
+    :param stack: ids of the containers being canonicalized, to stop on cyclic references
+    :return: A tuple or primitive
+    :raises UnfingerprintableValueError: If value references an object whose contents can't be reduced,
+    which would otherwise give configs that differ only in that object the same result
+    """
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if id(value) in stack:
+        return '<cycle>'
+    stack = stack + (id(value),)
+
+    if isinstance(value, dict):
+        return ('dict', tuple(
+            (
+                str(key),
+                _canonical(
+                    item() if key in LAZY_FIELD_CONFIG_KEYS and _is_no_arg_function(item) else item,
+                    stack
+                )
+            ) for key, item in value.items()
+        ))
+    if isinstance(value, (list, tuple)):
+        return ('list', tuple(_canonical(item, stack) for item in value))
+    if isinstance(value, (set, frozenset)):
+        return ('set', tuple(sorted(repr(_canonical(item, stack)) for item in value)))
+    if inspect.isclass(value):
+        return _class_canonical(value)
+    if inspect.ismethod(value):
+        return ('method', fullname(value.__self__.__class__), _canonical(value.__func__, stack))
+    if inspect.isfunction(value):
+        return (
+            'function',
+            value.__module__,
+            value.__qualname__,
+            _code_canonical(value.__code__),
+            _canonical(value.__defaults__, stack),
+            tuple(_canonical(_cell_contents(cell), stack) for cell in (value.__closure__ or ()))
+        )
+    if isinstance(value, UnmountedType):
+        return ('unmounted', fullname(value.__class__), _canonical(value.args, stack), _canonical(value.kwargs, stack))
+    if isinstance(value, functools.partial):
+        return (
+            'partial',
+            _canonical(value.func, stack),
+            _canonical(value.args, stack),
+            _canonical(value.keywords, stack)
+        )
+    if inspect.isbuiltin(value):
+        # Functions of builtin modules have no state, but bound builtin methods like [].append do
+        owner = getattr(value, '__self__', None)
+        return (
+            'builtin',
+            getattr(value, '__module__', None),
+            value.__qualname__,
+            None if owner is None or inspect.ismodule(owner) else _canonical(owner, stack)
+        )
+    if hasattr(value, '__dict__'):
+        # Instances, including those with a __call__, are described by their attributes
+        return ('object', fullname(value.__class__), _canonical(vars(value), stack))
+    raise UnfingerprintableValueError(f'Value {value!r} of {fullname(value.__class__)} can not be fingerprinted')
+
+
+def _class_canonical(cls):
+    """
+        Classes are represented by name and, for graphene types of Django models, by their model's metadata
+    :param cls:
+    :return:
+    """
+    if cls not in _class_canonicals:
+        if isinstance(cls, ModelBase):
+            _class_canonicals[cls] = ('model', model_fingerprint(cls))
+        else:
+            model = getattr(getattr(cls, '_meta', None), 'model', None)
+            _class_canonicals[cls] = (
+                'class',
+                fullname(cls),
+                model_fingerprint(model) if isinstance(model, ModelBase) else None
+            )
+    return _class_canonicals[cls]
+
+
+def _is_no_arg_function(value):
+    return inspect.isfunction(value) and not inspect.signature(value).parameters
+
+
+def fingerprint(*values):
+    """
+        A stable hash of the given values, which are typically field configs, graphene types and
+        flags that determine a generated type
+    :param values:
+    :return: A hex digest
+    :raises UnfingerprintableValueError: If the values reference an object that can't be described, see _canonical
+    """
+    return hashlib.sha1(repr(_canonical(values)).encode('utf-8')).hexdigest()
+
+
+def schema_build_cache_key(*values):
+    """
+        The fingerprint of values to cache schema fields under, or None if the schema build cache is disabled or
+        the values can't be fingerprinted, in which case the fields are computed and not cached
+    :param values: See fingerprint
+    :return: A hex digest or None
+    """
+    if not schema_build_cache():
+        return None
+    try:
+        return fingerprint(*values)
+    except UnfingerprintableValueError as e:
+        logger.debug(f'Not caching schema fields: {e}')
+        return None
+
+
+def _importable_fullname(cls):
+    """
+        The fullname of cls, provided that importing the fullname gives back cls. Classes created dynamically
+        inside a function aren't importable, so they can't be described
+    :param cls:
+    :return:
+    """
+    if cls not in _importable_classes:
+        name = fullname(cls)
+        try:
+            _importable_classes[cls] = name if import_string(name) is cls else None
+        except ImportError:
+            _importable_classes[cls] = None
+    if not _importable_classes[cls]:
+        raise UndescribableFieldError(f'Class {fullname(cls)} is not importable')
+    return _importable_classes[cls]
+
+
+def _plain(value):
+    if isinstance(value, (str, int, float, bool, type(None))):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    raise UndescribableFieldError(f'Value {value} is not plain data')
+
+
+def _describe(value, types):
+    """
+        Describes a graphene field value as nested lists of plain values
+    :param value: A graphene type class, unmounted type instance, structure like List, Field or InputField
+    :param types: Dict collecting the tables of the input types referenced by value, keyed by name
+    :return: The description
+    """
+    if inspect.isclass(value):
+        input_type = _input_types.get(value.__name__)
+        if input_type and input_type['cls'] is value:
+            if value.__name__ not in types:
+                # Reserve the name before recursing
+                types[value.__name__] = None
+                types[value.__name__] = _input_type_description(value.__name__, types)
+            return ['input', value.__name__]
+        return ['class', _importable_fullname(value)]
+    if isinstance(value, Structure):
+        return [
+            'structure',
+            _importable_fullname(value.__class__),
+            _describe(value._of_type, types),
+            _plain(value.args),
+            _plain(value.kwargs)
+        ]
+    if isinstance(value, UnmountedType):
+        return ['unmounted', _describe(value.__class__, types), _plain(value.args), _plain(value.kwargs)]
+    if isinstance(value, (InputField, Field)):
+        return [
+            'input_field' if isinstance(value, InputField) else 'field',
+            _describe(value._type, types),
+            _plain(value.default_value),
+            _plain(value.description)
+        ]
+    raise UndescribableFieldError(f'Field value {value} can not be described')
+
+
+def _describe_fields(fields, types):
+    # Graphene orders the fields of a type by creation, so record each field's creation rank
+    ranks = {
+        name: rank for rank, name in enumerate(sorted(fields.keys(), key=lambda name: fields[name].creation_counter))
+    }
+    return [[name, ranks[name], _describe(value, types)] for name, value in fields.items()]
+
+
+def _input_type_table(name, types):
+    input_type = _input_types[name]
+    if input_type['table'] is None:
+        try:
+            input_type['table'] = _describe_fields(input_type['fields'], {})
+        except UndescribableFieldError:
+            input_type['table'] = False
+    if input_type['table'] is False:
+        raise UndescribableFieldError(f'Input type {name} can not be described')
+    # Collect the tables of nested input types
+    for _, _, description in input_type['table']:
+        _collect_input_types(description, types)
+    return input_type['table']
+
+
+def _input_type_description(name, types):
+    shared = _input_types[name]['shared']
+    return dict(
+        fields=_input_type_table(name, types),
+        # The graphene class is imported to share the type again when it's materialized
+        shared=[_importable_fullname(import_string(R.head(shared))), R.last(shared)] if shared else None
+    )
+
+
+def _collect_input_types(description, types):
+    if not isinstance(description, list) or not description:
+        return
+    if description[0] == 'input':
+        if description[1] not in types:
+            types[description[1]] = None
+            types[description[1]] = _input_type_description(description[1], types)
+        return
+    for item in description[1:]:
+        _collect_input_types(item, types)
+
+
+def describe_fields(fields):
+    """
+        Describes the fields of an input type or argument dict as plain data that can be pickled
+        and later turned back into equivalent graphene fields with materialize_fields
+    :param fields: Dict keyed by field name and valued by graphene field values
+    :return: dict(fields=table of fields, types=tables of the input types referenced by the fields keyed by name)
+    :raises UndescribableFieldError: If any field value can't be described, such as a field config used by search types
+    """
+    types = {}
+    return dict(fields=_describe_fields(fields, types), types=types)
+
+
+def _materialize(description, types):
+    kind = description[0]
+    if kind == 'input':
+        return _materialize_input_type(description[1], types)
+    elif kind == 'class':
+        return import_string(description[1])
+    elif kind == 'structure':
+        return import_string(description[1])(_materialize(description[2], types), *description[3], **description[4])
+    elif kind == 'unmounted':
+        return _materialize(description[1], types)(*description[2], **description[3])
+    elif kind in ['input_field', 'field']:
+        return (InputField if kind == 'input_field' else Field)(
+            _materialize(description[1], types),
+            default_value=description[2],
+            description=description[3]
+        )
+    raise Exception(f'Unknown field description {description}')
+
+
+def _materialize_fields(table, types):
+    # Create the values in their original creation order so graphene orders the fields identically
+    values = {
+        name: _materialize(description, types)
+        for name, _, description in sorted(table, key=lambda name_rank_description: name_rank_description[1])
+    }
+    return {name: values[name] for name, _, _ in table}
+
+
+def _materialize_input_type(name, types):
+    if name in _input_types:
+        return _input_types[name]['cls']
+    shared = types[name]['shared']
+    return input_type_class_for_fields(
+        name,
+        _materialize_fields(types[name]['fields'], types),
+        graphene_class=import_string(R.head(shared)) if shared else None,
+        crud=R.last(shared) if shared else None
+    )
+
+
+def materialize_fields(description):
+    """
+        The inverse of describe_fields
+    :param description: dict(fields=, types=) from describe_fields
+    :return: Dict keyed by field name and valued by graphene field values
+    """
+    return _materialize_fields(description['fields'], description['types'])
+
+
+def _input_type_shape(fields):
+    """
+        A hash of the structure of the given fields. Nested input types are described by name, and since they were
+        deduplicated before their parent, equal names imply equal structures
+    :param fields:
+    :return: A hex digest or None if the fields can't be described, in which case the type isn't shared
+    """
+    try:
+        return hashlib.sha1(repr(_describe_fields(fields, {})).encode('utf-8')).hexdigest()
+    except UndescribableFieldError:
+        return None
+
+
+def canonical_input_type_name(graphene_class, crud):
+    """
+        The name of the related input type of graphene_class and crud when it's shared by every ancestry,
+        e.g. UserTypeRelatedReadInputType
+    """
+    return '%sRelated%sInputType' % (graphene_class.__name__, camelize(crud, True))
+
+
+def _name_shared_input_types(graphene_class, crud):
+    """
+        Names the shared input types of graphene_class and crud. If every ancestry has the same fields, the one type
+        takes the canonical name. Otherwise, e.g. if depth limits reduce some ancestries, each type takes the least of
+        its ancestry names. Either way the names don't depend on the order in which the types were built
+    """
+    shared_types = _shared_input_types[(fullname(graphene_class), crud)]
+    canonical_name = canonical_input_type_name(graphene_class, crud)
+    for shared in shared_types.values():
+        name = canonical_name if len(shared_types) == 1 and R.prop_or(
+            shared, canonical_name, _input_types
+        )['cls'] is shared['cls'] else min(shared['names'])
+        if shared['cls']._meta.name != name:
+            # Graphene freezes the options of a class, but only reads the name when the schema is built
+            object.__setattr__(shared['cls']._meta, 'name', name)
+
+
+def input_type_class_for_fields(name, fields, graphene_class=None, crud=None):
+    """
+        Creates an InputObjectType subclass with the given name and fields, or returns the one already
+        created under that name. If graphene_class is given and deduplicate_input_types() is True, the existing
+        input type of graphene_class and crud with the same field structure is returned instead of creating a new one,
+        so that the types of other graphene classes or cruds are never shared even if their fields are identical.
+        Shared types are named by _name_shared_input_types
+    :param name: The type name, usually including the parent ancestry
+    :param fields: Dict of graphene field values
+    :param graphene_class: Optional graphene class whose related input type this is, to share it by ancestries
+    :param crud: The crud of the input type. Required with graphene_class
+    :return: The InputObjectType subclass
+    """
+    if name in _input_types:
+        return _input_types[name]['cls']
+
+    shape = _input_type_shape(fields) if graphene_class and deduplicate_input_types() else None
+    shared_types = _shared_input_types.setdefault((fullname(graphene_class), crud), {}) if shape else {}
+    if shape in shared_types:
+        # Register the name as an alias of the identical type
+        _input_types[name] = _input_types[shared_types[shape]['cls'].__name__]
+        shared_types[shape]['names'].append(name)
+        _name_shared_input_types(graphene_class, crud)
+        record_schema_build_class(created=False)
+        return _input_types[name]['cls']
+
+    _input_types[name] = dict(
+        cls=type(name, (InputObjectType,), fields),
+        fields=fields,
+        table=None,
+        shared=[fullname(graphene_class), crud] if shape else None
+    )
+    record_schema_build_class(created=True)
+    if shape:
+        shared_types[shape] = dict(cls=_input_types[name]['cls'], names=[name])
+        _name_shared_input_types(graphene_class, crud)
+    return _input_types[name]['cls']
+
+
+def _loaded_schema_build_tables():
+    if _schema_build_tables['loaded'] is None:
+        _schema_build_tables['loaded'] = schema_build_cache().get(SCHEMA_BUILD_CACHE_KEY) or {}
+    return _schema_build_tables['loaded']
+
+
+def get_cached_schema_fields(key):
+    """
+        Returns the fields stored for the given fingerprint key by this or a previous process
+    :param key: Fingerprint from fingerprint() or None if the cache is disabled
+    :return: Dict of graphene field values or None
+    """
+    if not key:
+        return None
+    description = _loaded_schema_build_tables().get(key)
+    if not description:
+        return None
+    try:
+        fields = materialize_fields(description)
+    except Exception as e:
+        # A class that was described has since moved or been removed. Rebuild it
+        logger.warning(f'Could not reuse cached schema fields {key}: {e}')
+        return None
+    _schema_build_tables['used'][key] = description
+    return fields
+
+
+def set_cached_schema_fields(key, fields):
+    """
+        Stores the description of the given fields under key, to be written by flush_schema_build_cache
+    :param key: Fingerprint from fingerprint() or None if the cache is disabled
+    :param fields: Dict of graphene field values
+    :return: None
+    """
+    if not key:
+        return
+    try:
+        _schema_build_tables['used'][key] = describe_fields(fields)
+        _schema_build_tables['dirty'] = True
+    except UndescribableFieldError as e:
+        logger.debug(f'Not caching schema fields {key}: {e}')
+
+
+def flush_schema_build_cache():
+    """
+        Writes the tables used by this process to the schema build cache if any are new. Tables that weren't used,
+        because their configuration changed, are dropped. Call this once the schema is built
+    :return: None
+    """
+    cache = schema_build_cache()
+    if not cache or not _schema_build_tables['dirty']:
+        return
+    cache.set(SCHEMA_BUILD_CACHE_KEY, _schema_build_tables['used'], None)
+    _schema_build_tables['loaded'] = _schema_build_tables['used']
+    _schema_build_tables['dirty'] = False
@@ -1,8 +1,11 @@
 import inspect
 import json
 import logging
+import re
 import sys
+from datetime import datetime, timedelta, timezone as dt_timezone
 from decimal import Decimal
+from functools import lru_cache
 
 import graphene
 import reversion
@@ -11,9 +14,13 @@ from django.contrib.gis.db.models import OneToOneField, ManyToManyField, Foreign
     GeometryCollectionField
 from django.db.models import JSONField, AutoField, CharField, BooleanField, BigAutoField, DecimalField, \
     DateTimeField, DateField, BinaryField, TimeField, FloatField, EmailField, UUIDField, TextField, IntegerField, \
-    BigIntegerField, NullBooleanField, Q
+    BigIntegerField, NullBooleanField, Q, Exists, OuterRef
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import connection
+from django.db.models.expressions import RawSQL
+from django.utils import timezone
 from graphene import Scalar, InputObjectType, ObjectType, String, Field
-from graphql import parse
+from graphql import parse, GraphQLInputObjectType, GraphQLObjectType
 from graphql.language import ast
 from graphql.language.printer import print_ast
 from inflection import camelize
@@ -21,8 +28,14 @@ from rescape_python_helpers import ramda as R, memoize
 from rescape_python_helpers.functional.ramda import to_dict_deep, flatten_dct_until, \
     to_array_if_not
 
+from .schema_cache import schema_build_cache_key, get_cached_schema_fields, set_cached_schema_fields, \
+    input_type_class_for_fields, deduplicate_input_types
+from rescape_graphene.django_helpers.model_metadata import model_metadata, FOREIGN_KEY, ONE_TO_ONE, MANY_TO_MANY, \
+    REVERSE
+from .schema_profiler import profile_schema_build, profile_schema_build_miss
+from .selection_query_helpers import query_for_selections
 from .graphene_helpers import dump_graphql_keys, dump_graphql_data_object, camelize_graphql_data_object, call_if_lambda, \
-    resolve_field_type
+    resolve_field_type, fullname
 
 logger = logging.getLogger('rescape_graphene')
 from django.conf import settings
@@ -57,83 +70,75 @@ DELETE = 'delete'
 # TODO
 NON_COMPLEX_TYPES = [graphene.Date, graphene.DateTime, graphene.Int, graphene.Boolean, graphene.String, graphene.List]
 
+
+def _date_part_type_modifier(*type_and_args):
+    # Date parts are numbers, e.g. createdAtYear: 2020, rather than values of the date field's type
+    return graphene.Int()
+
+
 # From django-filters. Whenever graphene supports filtering without Relay we can get rid of this here
 # Educated guesss about what types for each to support. Django/Postgres might support fewer or more of these
 # combinations than I'm aware of
-# Skip most if testing. These take forever
 # Results in a dict keyed by the filter suffix and valued by a dict of the allowed types and possibly a type_modifier
-# lambda to create a grapheene.List of the given type for the 'in' and 'range' suffixes
+# lambda to create a grapheene.List of the given type for the 'in' and 'range' suffixes, or an Int for the date parts
+# Which of these are actually added to the schema is configured with filter profiles, see filter_fields_for_field
 FILTER_FIELDS = R.compose(
     # Create not versions of each. This is a pseudo syntax not supported by Django. Django uses exclude() or ~Q(expr).
     # We can't create an equivalent here with keys, so we use _not and convert it to ~Q(expr) later
     lambda pairs: R.from_pairs(pairs),
     lambda pairs: R.chain(lambda key_value: [list(key_value), [f'{key_value[0]}_not', key_value[1]]], pairs),
     lambda dct: R.to_pairs(dct),
-
-    R.if_else(
-        lambda settings: settings.TESTING,
-        # Minimum set for debugging speed
-        lambda _: {
-            # Contains can be used for javascript matching and string matching
-            # I think anything can have a contains filter, even complex types, because we might want
-            # to test if a complex type contains certain javascript
-            # https://docs.djangoproject.com/en/4.0/topics/db/queries/#containment-and-key-lookups
-            'contains': dict(type_modifier=lambda typ: graphene.List(typ),
-                             allowed_types=[graphene.String, graphene.ObjectType]),
-            'in': dict(type_modifier=lambda typ: graphene.List(typ), allowed_types=NON_COMPLEX_TYPES)
-        },
-        lambda _: {
-            'year': dict(allowed_types=[graphene.Date, graphene.DateTime]),
-            'month': dict(allowed_types=[graphene.Date, graphene.DateTime]),
-            'day': dict(allowed_types=[graphene.Date, graphene.DateTime]),
-            'week_day': dict(allowed_types=[graphene.Date, graphene.DateTime]),
-            'hour': dict(allowed_types=[graphene.DateTime]),
-            'minute': dict(allowed_types=[graphene.DateTime]),
-            'second': dict(allowed_types=[graphene.DateTime]),
-
-            # standard lookups
-            'exact': dict(allowed_types=NON_COMPLEX_TYPES),
-            # this is the default, but keep so we can do negative queries, i.e. exact__not
-            # 'iexact': dict(allowed_types=NON_COMPLEX_TYPES),
-            # I think anything can have a contains filter, even complex types, because we might want
-            # to test if a complex type contains certain javascript
-            'contains': dict(),
-            # 'icontains': dict(),
-            'in': dict(type_modifier=lambda typ: graphene.List(typ), allowed_types=NON_COMPLEX_TYPES),
-            'gt': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
-            'gte': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
-            'lt': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
-            'lte': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
-            'startswith': dict(allowed_types=[graphene.String]),
-            # 'istartswith': dict(allowed_types=[graphene.String]),
-            'endswith': dict(allowed_types=[graphene.String]),
-            # 'iendswith': dict(allowed_types=[graphene.String]),
-            # Range expects a 2 item tuple, so give it a list
-            'range': dict(type_modifier=lambda typ: graphene.List(typ), allowed_types=NON_COMPLEX_TYPES),
-            'isnull': dict(allowed_types=NON_COMPLEX_TYPES),
-            # 'regex': dict(allowed_types=[graphene.String]),
-            # 'iregex': dict(allowed_types=[graphene.String]),
-            'search': dict(allowed_types=[graphene.String]),
-
-            # postgres lookups
-            'contained_by': dict(allowed_types=NON_COMPLEX_TYPES),
-            # Date overlap
-            'overlap': dict(allowed_types=[graphene.Date, graphene.DateTime]),
-            # These are probably for json types so maybe useful
-            'has_key': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
-            'has_keys': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
-            'has_any_keys': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
-            # groups of 3 characters for similarity recognition
-            # 'trigram_similar': dict(allowed_types=[graphene.String])
-        }
-    )
-)(settings)
+)({
+    'year': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.Date, graphene.DateTime]),
+    'month': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.Date, graphene.DateTime]),
+    'day': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.Date, graphene.DateTime]),
+    'week_day': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.Date, graphene.DateTime]),
+    'hour': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.DateTime]),
+    'minute': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.DateTime]),
+    'second': dict(type_modifier=_date_part_type_modifier, allowed_types=[graphene.DateTime]),
+
+    # standard lookups
+    'exact': dict(allowed_types=NON_COMPLEX_TYPES),
+    # this is the default, but keep so we can do negative queries, i.e. exact__not
+    # 'iexact': dict(allowed_types=NON_COMPLEX_TYPES),
+    # I think anything can have a contains filter, even complex types, because we might want
+    # to test if a complex type contains certain javascript
+    'contains': dict(),
+    # 'icontains': dict(),
+    'in': dict(type_modifier=lambda typ: graphene.List(typ), allowed_types=NON_COMPLEX_TYPES),
+    'gt': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
+    'gte': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
+    'lt': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
+    'lte': dict(allowed_types=[graphene.Int, graphene.Float, graphene.DateTime, graphene.Date]),
+    'startswith': dict(allowed_types=[graphene.String]),
+    # 'istartswith': dict(allowed_types=[graphene.String]),
+    'endswith': dict(allowed_types=[graphene.String]),
+    # 'iendswith': dict(allowed_types=[graphene.String]),
+    # Range expects a 2 item tuple, so give it a list
+    'range': dict(type_modifier=lambda typ: graphene.List(typ), allowed_types=NON_COMPLEX_TYPES),
+    'isnull': dict(allowed_types=NON_COMPLEX_TYPES),
+    # 'regex': dict(allowed_types=[graphene.String]),
+    # 'iregex': dict(allowed_types=[graphene.String]),
+    'search': dict(allowed_types=[graphene.String]),
+
+    # postgres lookups
+    'contained_by': dict(allowed_types=NON_COMPLEX_TYPES),
+    # Date overlap
+    'overlap': dict(allowed_types=[graphene.Date, graphene.DateTime]),
+    # These are probably for json types so maybe useful
+    'has_key': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
+    'has_keys': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
+    'has_any_keys': dict(allowed_types=[graphene.JSONString, graphene.InputObjectType]),
+    # groups of 3 characters for similarity recognition
+    # 'trigram_similar': dict(allowed_types=[graphene.String])
+})
 
 # Exclude some common prop keys, like for revisioning, that should never get filters.
 # For instance, we don't want to create revision_id_contains or revision_id_in,
 # because we don't want to be able to search for revisions by an id range
 EXCLUDED_PROP_KEYS_FROM_FILTERING = [
-    'order_by', 'version_number', 'revision', 'revision_id', 'page', 'pages', 'page_size', 'has_next', 'has_prev'
+    'order_by', 'version_number', 'revision', 'revision_id', 'page', 'pages', 'page_size', 'has_next', 'has_prev',
+    'cursor', 'next_cursor', 'pages_approximate'
 ]
 
 
@@ -164,13 +169,6 @@ class DataPointRelatedCreateInputType(InputObjectType):
     id = graphene.String(required=True)
 
 
-def fullname(klass):
-    module = klass.__module__
-    if module == 'builtins':
-        return klass.__qualname__  # avoid outputs like 'builtins.str'
-    return module + '.' + klass.__qualname__
-
-
 def _memoize(args):
     return [
         # Only use graphene_type here. type is a function and can't be serialized
@@ -178,20 +176,64 @@ def _memoize(args):
             call_if_lambda(args[0]['graphene_type'])
         ),
         args[1],
-        # TODO We use the parent_type_class to make each type unique. I don't know why graphene won't let us reuse
-        # input types within the schema. It seems like a UserInputType should be reusable whether it's the User
-        # of a Region or the user of a Group.
+        # The parent_type_class makes each type name unique. Graphene won't accept two different types with the same
+        # name. If deduplicate_input_types() is True, input_type_class_for_fields reuses one type for every ancestry
+        # that produces identical fields
         R.map(
             lambda cls: cls if isinstance(cls, str) else fullname(cls),
             args[2] if R.length(args) > 2 and R.isinstance((list, tuple), args[2]) else [args[2]]
-        )
+        ),
+        # The remaining nesting depth
+        args[3]
     ]
 
 
-@memoize(
-    map_args=_memoize,
-    # Only fields_only can vary for the same input class
-    map_kwargs=lambda kwargs: [R.prop_or(False, 'fields_only', kwargs)]
+def _profiled_type_label(graphene_type):
+    """
+        The label that schema profiling reports graphene_type's time and classes under, the label of its Django model
+        if it has one, otherwise its name
+    :param graphene_type: Graphene type or no-arg lambda returning one
+    :return: The label
+    """
+    graphene_class = call_if_lambda(graphene_type)
+    model = django_model_of_graphene_type(graphene_class)
+    return model._meta.label if model else graphene_class.__name__
+
+
+# The nesting depth budgets of the input types being built by input_type_class, innermost last
+_input_type_depth_budgets = []
+
+
+def max_input_type_depth():
+    """
+        settings.RESCAPE_GRAPHENE_MAX_INPUT_TYPE_DEPTH, the number of levels of related input types that can be
+        nested in query arguments and mutation inputs. Deeper related types are reduced to an id-only reference
+        type. Defaults to None, meaning no limit
+    :return: The depth or None
+    """
+    return getattr(settings, 'RESCAPE_GRAPHENE_MAX_INPUT_TYPE_DEPTH', None)
+
+
+def input_type_depth_budget(field_config):
+    """
+        The number of levels of related input types that can still be nested for field_config, given the
+        input types currently being built, max_input_type_depth() and field_config['max_depth']
+    :param field_config: The field config passed to input_type_class
+    :return: The number of levels or None if unlimited
+    """
+    budgets = R.filter(
+        lambda budget: budget is not None,
+        [
+            _input_type_depth_budgets[-1] if _input_type_depth_budgets else max_input_type_depth(),
+            R.prop_or(None, 'max_depth', field_config)
+        ]
+    )
+    return min(budgets) if R.length(budgets) else None
+
+
+@profile_schema_build(
+    'input_type_class',
+    model_of=lambda args, kwargs: _profiled_type_label(args[0]['graphene_type'] or args[0]['type'])
 )
 def input_type_class(field_config, crud, parent_type_classes, fields_only=False, with_filter_fields=True,
                      create_filter_fields_for_search_type=False):
@@ -200,11 +242,12 @@ def input_type_class(field_config, crud, parent_type_classes, fields_only=False,
     The subclass is dynamically created based on the field_dict_value['graphene_type'] and the crud type.
     The fields are based on field_dicta_values['fields'] and the underlying Django model of the graphene_type,
     as well as the rules for the crud type spcecified in field_dict_vale.
-    :param field_config:
+    :param field_config: Contains graphene_type or type and fields. max_depth optionally limits how many levels of
+    related input types can be nested starting with this one. 0 makes this an id-only reference type
     :param crud: CREATE, UPDATE, or READ, or None (for top-level search types with fields_only=True)
-    :param parent_type_classes: String or String array of parent graphene type classes. Unfortunately, Graphene doesn't
-    let us reuse input types around the schema, even if they are identical, so we must give them unique names
-    based on the parent ancestry
+    :param parent_type_classes: String or String array of parent graphene type classes. The ancestry gives each
+    input type a unique name. If deduplicate_input_types() is True, ancestries whose fields are identical share one
+    type, see input_type_class_for_fields
     :param fields_only Default False. Don't create the inpub class, just return the fields that are created,
     including filter fields. This is like calling fields_with_filter_fields with a bit of prep
     :param with_filter_fields Default True. If False don't create filter fields. Only needed for things like
@@ -213,8 +256,67 @@ def input_type_class(field_config, crud, parent_type_classes, fields_only=False,
     You can also use and array of field names here to just add filter fields at the top level for those fields
     :param create_filter_fields_for_search_type Default False, Usually we only add filter fields for READ crud types. This
     overrides that so that Search types can add filters
+    :return: An InputObjectType subclass, or if the nesting depth is exhausted an id-only reference type.
+    See input_type_depth_budget
+    """
+    # The top-level arguments of a query are fields_only calls that aren't nested in another input type.
+    # They don't count as a level
+    top_level = fields_only and not _input_type_depth_budgets
+    depth_budget = input_type_depth_budget(field_config)
+    if not top_level and depth_budget is not None and depth_budget <= 0:
+        return reference_input_type_class(field_config, crud, fields_only=fields_only)
+
+    _input_type_depth_budgets.append(
+        depth_budget if top_level or depth_budget is None else depth_budget - 1
+    )
+    try:
+        return _input_type_class(
+            field_config,
+            crud,
+            parent_type_classes,
+            _input_type_depth_budgets[-1],
+            fields_only=fields_only,
+            with_filter_fields=with_filter_fields,
+            create_filter_fields_for_search_type=create_filter_fields_for_search_type
+        )
+    finally:
+        _input_type_depth_budgets.pop()
+
+
+def reference_input_type_class(field_config, crud, fields_only=False):
+    """
+        An input type with only the id of field_config's graphene type. This replaces related input types that are
+        nested deeper than allowed. See input_type_depth_budget
+    :param field_config: Contains graphene_type or type and fields
+    :param crud: CREATE, UPDATE, or READ
+    :param fields_only: Default False. Return the id field config instead of the type
     :return: An InputObjectType subclass
     """
+    graphene_class = call_if_lambda(field_config['graphene_type'] or field_config['type'])
+    fields = call_if_lambda(field_config['fields'])
+    id_fields = R.map_with_obj(
+        # We're just referencing an instance, so never require the id
+        lambda key, value: R.omit(['create', 'update'], value),
+        merge_with_django_properties(graphene_class, R.pick(['id'], fields) or dict(id=dict()))
+        if django_model_of_graphene_type(graphene_class) else
+        R.pick(['id'], fields) or dict(id=dict(type=graphene.ID))
+    )
+    if fields_only:
+        return id_fields
+    return input_type_class_for_fields(
+        '%sReference%sInputType' % (graphene_class.__name__, camelize(crud, True)),
+        input_type_fields(id_fields, crud, [graphene_class], with_filter_fields=False)
+    )
+
+
+@memoize(
+    map_args=_memoize,
+    # Only fields_only can vary for the same input class
+    map_kwargs=lambda kwargs: [R.prop_or(False, 'fields_only', kwargs)]
+)
+@profile_schema_build_miss('input_type_class')
+def _input_type_class(field_config, crud, parent_type_classes, depth_budget, fields_only=False,
+                      with_filter_fields=True, create_filter_fields_for_search_type=False):
     # Get the Graphene type. This comes from graphene_type if the class containing the field is a Django Model,
     # It defaults to type, which is what we expect if we didn't have to use a graphene_type to distinguish
     # from the underlying Django type
@@ -224,26 +326,43 @@ def input_type_class(field_config, crud, parent_type_classes, fields_only=False,
     # Make it an array if not
     modified_parent_type_classes = to_array_if_not(parent_type_classes)
 
-    combined_fields = fields_with_filter_fields(
-        fields,
+    # If settings.RESCAPE_GRAPHENE_SCHEMA_CACHE is configured, reuse the fields that a previous process computed
+    # for the identical configuration instead of expanding filters and merging Django properties again
+    cache_key = schema_build_cache_key(
         graphene_class,
-        parent_type_classes=modified_parent_type_classes,
-        crud=crud,
-        # Only continue with fields_only for search types. Otherwise we need types for the sub fields
-        fields_only=create_filter_fields_for_search_type,
-        with_filter_fields=with_filter_fields,
-        create_filter_fields_for_search_type=create_filter_fields_for_search_type
+        fields,
+        crud,
+        modified_parent_type_classes,
+        fields_only,
+        with_filter_fields,
+        create_filter_fields_for_search_type,
+        FILTER_FIELDS,
+        filter_profile_settings(),
+        deduplicate_input_types(),
+        depth_budget
     )
+    combined_fields = get_cached_schema_fields(cache_key)
+    if combined_fields is None:
+        combined_fields = fields_with_filter_fields(
+            fields,
+            graphene_class,
+            parent_type_classes=modified_parent_type_classes,
+            crud=crud,
+            # Only continue with fields_only for search types. Otherwise we need types for the sub fields
+            fields_only=create_filter_fields_for_search_type,
+            with_filter_fields=with_filter_fields,
+            create_filter_fields_for_search_type=create_filter_fields_for_search_type
+        )
+        set_cached_schema_fields(cache_key, combined_fields)
     if fields_only:
         return combined_fields
 
-    return type(
+    return input_type_class_for_fields(
         '%s%sRelated%sInputType' % (
             graphene_class.__name__,
             # Use the ancestry for uniqueness of name
             R.join('of', R.concat([''], modified_parent_type_classes)),
             camelize(crud, True)),
-        (InputObjectType,),
         # RECURSION
         # Create Graphene types for the InputType based on the field_dict_value.fields
         # This will typically just be an id field to reference an existing object.
@@ -253,10 +372,14 @@ def input_type_class(field_config, crud, parent_type_classes, fields_only=False,
         # Django object.
         #
         # Otherwise field_dict_value['fields'] are independent of a Django model and each have their own type property
-        combined_fields
+        combined_fields,
+        # Ancestries with identical fields may share the type, see input_type_class_for_fields
+        graphene_class=graphene_class,
+        crud=crud
     )
 
 
+@profile_schema_build('fields_with_filter_fields', model_of=lambda args, kwargs: _profiled_type_label(args[1]))
 def fields_with_filter_fields(fields, graphene_class, parent_type_classes=[], crud=None, with_filter_fields=True,
                               fields_only=False,
                               create_filter_fields_for_search_type=False):
@@ -384,6 +507,22 @@ def django_to_graphene_type(field, field_dict_value, parent_type_classes):
         # the other graphene types above
         return related_input_field_for_crud_type(field_dict_value, parent_type_classes)
 
+    return graphene_type_of_django_field_class(field.__class__)
+
+
+_graphene_types_by_django_field_class = {}
+
+
+def graphene_type_of_django_field_class(field_class):
+    """
+        The graphene type of a non-relation Django field class. The result only depends on the class, so it's
+        computed once per class
+    :param field_class: The Django Field class
+    :return: The graphene type
+    """
+    if field_class in _graphene_types_by_django_field_class:
+        return _graphene_types_by_django_field_class[field_class]
+
     from rescape_graphene.schema_models.geojson.types import GrapheneFeatureCollection
     types = {
         AutoField: graphene.Int,
@@ -407,13 +546,14 @@ def django_to_graphene_type(field, field_dict_value, parent_type_classes):
         # If we do use a GeosGeometryCollection I'm not sure if this mapping works
         GeometryCollectionField: GrapheneFeatureCollection
     }
-    cls = field.__class__
+    cls = field_class
     match = R.prop_or(None, cls, types)
     # Find the type that matches. If not match we assume that the class only has one base class,
     # such as GeometryField subclasses
     while not match:
         cls = cls.__bases__[0]
         match = R.prop_or(None, cls, types)
+    _graphene_types_by_django_field_class[field_class] = match
     return match
 
 
@@ -446,6 +586,7 @@ def process_field(field_to_unique_field_groups, field, field_dict_value, parent_
     )
 
 
+@profile_schema_build('parse_django_class', model_of=lambda args, kwargs: args[0]._meta.label)
 def parse_django_class(model, field_dict, parent_type_classes=[]):
     """
         Parse the fields of a Django model to merge important properties with
@@ -457,26 +598,14 @@ def parse_django_class(model, field_dict, parent_type_classes=[]):
     :param parent_type_classes Single class or array of parent classes of this graphene class
     :return:
     """
-    # This mess just maps each attr to all "unique together" tuples it's in
-    field_to_unique_field_groups = R.from_pairs_to_array_values(
-        R.flatten(
-            R.map(
-                lambda uniq_field_group:
-                R.map(
-                    lambda attrname: [attrname, R.join(',', uniq_field_group)],
-                    uniq_field_group
-                ),
-                model._meta.unique_together
-            )
-        )
-    )
+    metadata = model_metadata(model)
     return R.from_pairs(R.map(
         lambda field: [
             # Key by file.name
             field.name,
             # Process each field
             process_field(
-                field_to_unique_field_groups,
+                metadata['field_to_unique_field_groups'],
                 field,
                 R.prop(field.name, field_dict),
                 R.to_array_if_not(parent_type_classes)
@@ -485,7 +614,7 @@ def parse_django_class(model, field_dict, parent_type_classes=[]):
         # Only accept model fields that are defined in field_dict
         R.filter(
             lambda field: field.name in field_dict,
-            R.concat(model._meta.fields, R.concat(model._meta.many_to_many, model._meta.related_objects))
+            metadata['fields']
         )
     ))
 
@@ -571,45 +700,135 @@ def allowed_read_fields(fields_dict, graphene_type):
     )(fields_dict)
 
 
-def _matches_graphene_type(graphene_instance, typ):
+def _default_filter_type_modifier(*type_and_args):
+    return type_and_args[0]()
+
+
+# The type_modifier of each of FILTER_FIELDS, defaulting to instantiating the field's type
+FILTER_TYPE_MODIFIERS = R.map_dict(
+    lambda config: R.prop_or(_default_filter_type_modifier, 'type_modifier', config),
+    FILTER_FIELDS
+)
+
+# The FILTER_FIELDS suffixes whose allowed_types match a graphene class, keyed by the class. Filled the first time
+# each class is seen so that expanding the filters of a field doesn't have to test every suffix's allowed_types
+_filter_suffixes_by_class = {}
+
+
+def _filter_match_class(graphene_instance):
     """
-        Determines if the given graphene_instance, which might be an instance or a dict with a type, matches typ
-    :param graphene_instance:
-    :param typ: A grahene type to match
-    :return: Boolean
+        The class whose filters apply to graphene_instance. For a field config dict this is the class of its type,
+        or None if it has no type
+    :param graphene_instance: A graphene instance or field config dict
+    :return: The class or None
     """
     if isinstance(graphene_instance, dict):
-        if R.has('type', graphene_instance):
-            return R.isinstance(typ, graphene_instance['type']) if \
-                R.isinstance(graphene.Scalar, graphene_instance['type']) else \
-                issubclass(graphene_instance['type'], typ)
-        else:
-            return False
-    else:
-        return issubclass(graphene_instance.__class__, typ)
+        if not R.has('type', graphene_instance):
+            return None
+        typ = graphene_instance['type']
+        return typ.__class__ if isinstance(typ, graphene.Scalar) else typ
+    return graphene_instance.__class__
+
+
+def filter_suffixes_for_class(cls):
+    """
+        The FILTER_FIELDS suffixes that apply to fields of the given graphene class, in the order of FILTER_FIELDS
+    :param cls: The graphene class, e.g. graphene.String, or None for fields without a type
+    :return: List of suffixes
+    """
+    if cls not in _filter_suffixes_by_class:
+        _filter_suffixes_by_class[cls] = [
+            suffix for suffix, config in FILTER_FIELDS.items()
+            if 'allowed_types' not in config or (
+                    cls is not None and any(issubclass(cls, typ) for typ in config['allowed_types'])
+            )
+        ]
+    return _filter_suffixes_by_class[cls]
+
+
+def filter_profile_settings():
+    """
+        The filter profiles configured in the settings. settings.RESCAPE_GRAPHENE_FILTERS is the list of
+        filter suffixes, e.g. ['exact', 'in'], to create for any field, defaulting to all of FILTER_FIELDS.
+        settings.RESCAPE_GRAPHENE_TYPE_FILTERS is a dict keyed by graphene type name, e.g. 'FooType', and valued by
+        the list of suffixes to create for fields of that type. Use [] as the default to only create the filters
+        declared for types and fields
+    :return: dict(filters=list or None, type_filters=dict)
+    """
+    return dict(
+        filters=getattr(settings, 'RESCAPE_GRAPHENE_FILTERS', None),
+        type_filters=getattr(settings, 'RESCAPE_GRAPHENE_TYPE_FILTERS', None) or {}
+    )
+
 
+_filter_field_subsets = {}
 
-def allowed_filter_pairs(field_name, graphene_instance, field_config, fields_only=False, with_filter_fields=True, create_filter_fields_for_search_type=False):
+
+def _filter_fields_subset(suffixes):
+    if suffixes not in _filter_field_subsets:
+        unknown = R.filter(lambda suffix: suffix not in FILTER_FIELDS, suffixes)
+        if R.length(unknown):
+            raise ImproperlyConfigured(
+                f"Unknown filter suffix {', '.join(unknown)}. Expected keys of FILTER_FIELDS: "
+                f"{', '.join(FILTER_FIELDS.keys())}"
+            )
+        # Declaring a suffix also declares its _not variant
+        declared = R.concat(list(suffixes), R.map(lambda suffix: f'{suffix}_not', suffixes))
+        _filter_field_subsets[suffixes] = R.filter_dict(
+            lambda key_value: key_value[0] in declared,
+            FILTER_FIELDS
+        )
+    return _filter_field_subsets[suffixes]
+
+
+def filter_fields_for_field(graphene_type, field_config):
+    """
+        The FILTER_FIELDS to create for a field. In order of precedence these are the suffixes listed
+        in field_config['filters'], e.g. dict(type=String, filters=['exact', 'startswith']),
+        those configured for the graphene_type by settings.RESCAPE_GRAPHENE_TYPE_FILTERS, and those configured
+        by settings.RESCAPE_GRAPHENE_FILTERS. If none are configured all FILTER_FIELDS are used
+    :param graphene_type: The graphene type that has the field. Can be None
+    :param field_config: The field config of the field
+    :return: The subset of FILTER_FIELDS
+    """
+    suffixes = R.prop_or(None, 'filters', field_config) if isinstance(field_config, dict) else None
+    if suffixes is None:
+        profiles = filter_profile_settings()
+        suffixes = R.prop_or(
+            profiles['filters'],
+            graphene_type.__name__,
+            profiles['type_filters']
+        ) if graphene_type else profiles['filters']
+    return FILTER_FIELDS if suffixes is None else _filter_fields_subset(tuple(suffixes))
+
+
+def allowed_filter_pairs(field_name, graphene_instance, field_config, fields_only=False, with_filter_fields=True,
+                         create_filter_fields_for_search_type=False, graphene_type=None):
     """
         Creates pairs of filter_field, graphene_type such as [id_contains, Int(), id_in, List(Int())] for
         filter fields that are allowed for the field_name's graphene_type
     :param field_name: Field being given filters
     :param field_config: Field config
+    :param graphene_type: The graphene type that has the field, used to look up its filter profile.
+    See filter_fields_for_field
     :return: List of pairs
 
     """
 
-    def filter_field_config_or_type(config):
-        type_modifier = config['type_modifier'] if R.has('type_modifier', config) else lambda *type_and_args: \
-            type_and_args[0]()
+    if not with_filter_fields or field_name in EXCLUDED_PROP_KEYS_FROM_FILTERING:
+        return []
+    filter_fields = filter_fields_for_field(graphene_type, field_config)
+
+    def filter_field_config_or_type(filter_str):
+        type_modifier = FILTER_TYPE_MODIFIERS[filter_str]
         return R.merge(field_config, dict(type_modifier=type_modifier)) if fields_only else (
             # If a type_modifier is needed for the filter type, such as a List constructor call it
             # with the field's type as an argument
             type_modifier(graphene_instance.__class__)
         )
 
-    return R.map_with_obj_to_values(
-        lambda filter_str, config: [
+    return [
+        [
             # Properties of Search Types need to be camel case because they are JSON fields
             # Make all the filter pairs for each key id: idContains, id: idIn, etc
             f'{field_name}{capitalize_first_letter(camelize(filter_str))}' if
@@ -617,23 +836,16 @@ def allowed_filter_pairs(field_name, graphene_instance, field_config, fields_onl
             # Regular filter properties are underscored to match Python/Graphene
             # Make all the filter pairs for each key label: label_contains, id: id_in, etc
             f'{field_name}_{filter_str}',
-            filter_field_config_or_type(config)
-        ],
-        # Only allow filters compliant with the type of pair[1]
-        R.filter_dict(
-            lambda keyvalue: field_name not in EXCLUDED_PROP_KEYS_FROM_FILTERING and (
-                    not R.has('allowed_types', keyvalue[1]) or
-                    R.any_satisfy(
-                        lambda typ: _matches_graphene_type(graphene_instance, typ),
-                        keyvalue[1]['allowed_types']
-                    )
-            ),
-            FILTER_FIELDS if with_filter_fields else dict()
-        )
-    )
+            filter_field_config_or_type(filter_str)
+        ]
+        # Only allow filters compliant with the type of graphene_instance
+        for filter_str in filter_suffixes_for_class(_filter_match_class(graphene_instance))
+        if filter_str in filter_fields
+    ]
 
 
-def make_filters(field_name, graphene_instance, field_config, fields_only=False, with_filter_fields=True, create_filter_fields_for_search_type=False):
+def make_filters(field_name, graphene_instance, field_config, fields_only=False, with_filter_fields=True,
+                 create_filter_fields_for_search_type=False, graphene_type=None):
     """
         Add the needed filters to the standard 'eq' value
         This compensates for django-filter not being implemented to work in graphene without Relay
@@ -649,16 +861,19 @@ def make_filters(field_name, graphene_instance, field_config, fields_only=False,
                 field_config,
                 fields_only=fields_only,
                 with_filter_fields=with_filter_fields,
-                create_filter_fields_for_search_type=create_filter_fields_for_search_type
+                create_filter_fields_for_search_type=create_filter_fields_for_search_type,
+                graphene_type=graphene_type
             )
         )
     )
 
 
-def add_filters(field_and_instance_and_config, fields_only=False, with_filter_fields=True, create_filter_fields_for_search_type=False):
+def add_filters(field_and_instance_and_config, fields_only=False, with_filter_fields=True,
+                create_filter_fields_for_search_type=False, graphene_type=None):
     """
         Adds filter arguments to 'eq' arguments.
     :param field_and_instance_and_config: list of dict(field_name, graphene_type, field_config)
+    :param graphene_type: The graphene type that has the fields
     :return: dict of the 'eq' arguments and the filter args e.g. {id: Int(), id_contains: List(Int), ...}
     """
     return R.compose(
@@ -668,13 +883,27 @@ def add_filters(field_and_instance_and_config, fields_only=False, with_filter_fi
                 *R.props(['field_name', 'graphene_instance', 'field_config'], field_and_type_and_config),
                 fields_only=fields_only,
                 with_filter_fields=with_filter_fields,
-                create_filter_fields_for_search_type=create_filter_fields_for_search_type
+                create_filter_fields_for_search_type=create_filter_fields_for_search_type,
+                graphene_type=graphene_type
             ),
             field_and_instance_and_config
         ),
     )(field_and_instance_and_config)
 
 
+# The field configs of the graphene types that have top-level filter arguments, keyed by the graphene type
+_top_level_field_configs = {}
+
+
+def top_level_field_configs(graphene_type):
+    """
+        The field configs that top_level_allowed_filter_arguments was called with for graphene_type
+    :param graphene_type: The graphene type, e.g. FooType
+    :return: The field configs or None
+    """
+    return call_if_lambda(R.prop_or(None, graphene_type, _top_level_field_configs))
+
+
 def top_level_allowed_filter_arguments(fields, graphene_type, with_filter_fields=True,
                                        create_filter_fields_for_search_type=False):
     """
@@ -690,6 +919,7 @@ def top_level_allowed_filter_arguments(fields, graphene_type, with_filter_fields
     You can also use and array of field names here to just add filter fields at the top level for those fields
     :return: dict of field keys and there graphene type, either a primitive or input type
     """
+    _top_level_field_configs[graphene_type] = fields
     return input_type_class(
         dict(fields=fields, graphene_type=graphene_type),
         'read', [], fields_only=True, with_filter_fields=with_filter_fields,
@@ -724,7 +954,8 @@ def allowed_filter_arguments(fields_dict, graphene_type, fields_only=False, with
             field_and_instance_and_config,
             fields_only=fields_only,
             with_filter_fields=with_filter_fields,
-            create_filter_fields_for_search_type=create_filter_fields_for_search_type
+            create_filter_fields_for_search_type=create_filter_fields_for_search_type,
+            graphene_type=graphene_type
         )
 
     return R.compose(
@@ -744,6 +975,61 @@ def allowed_filter_arguments(fields_dict, graphene_type, fields_only=False, with
     )(call_if_lambda(fields_dict))
 
 
+def _filter_argument_count(names):
+    """
+        Counts the names that are a filter of another of the names, e.g. idContains of id
+    :param names: The camelized field or argument names
+    :return: The count
+    """
+    name_set = set(names)
+    suffixes = R.map(lambda suffix: capitalize_first_letter(camelize(suffix)), R.keys(FILTER_FIELDS))
+    return R.length(R.filter(
+        lambda name: R.any_satisfy(
+            lambda suffix: name.endswith(suffix) and name[:-len(suffix)] in name_set,
+            suffixes
+        ),
+        names
+    ))
+
+
+def filter_argument_report(schema):
+    """
+        Reports how many arguments each type of the schema contributes, to find the types whose filters
+        should be limited with filter profiles. See filter_fields_for_field
+    :param schema: The graphene Schema
+    :return: List of dict(type=type name, kind='input' or 'object', arguments=count, filter_arguments=count)
+    sorted by arguments descending. Input types count their fields. Object types count the arguments of their fields
+    """
+    def report(name, graphql_type):
+        if isinstance(graphql_type, GraphQLInputObjectType):
+            names = list(graphql_type.fields.keys())
+            return dict(type=name, kind='input', arguments=R.length(names), filter_arguments=_filter_argument_count(names))
+        return dict(
+            type=name,
+            kind='object',
+            arguments=sum(R.map(lambda field: R.length(field.args), graphql_type.fields.values())),
+            filter_arguments=sum(R.map(
+                lambda field: _filter_argument_count(list(field.args.keys())),
+                graphql_type.fields.values()
+            ))
+        )
+
+    return sorted(
+        R.filter(
+            lambda type_report: type_report['arguments'],
+            R.map_with_obj_to_values(
+                report,
+                R.filter_dict(
+                    lambda key_value: not key_value[0].startswith('__') and
+                                      isinstance(key_value[1], (GraphQLInputObjectType, GraphQLObjectType)),
+                    schema.get_type_map()
+                )
+            )
+        ),
+        key=lambda type_report: -type_report['arguments']
+    )
+
+
 def guess_update_or_create(fields_dict):
     """
     Determines if the query is intended to be a create or update
@@ -789,7 +1075,7 @@ def instantiate_graphene_type_or_fields(field_config, parent_type_classes, crud,
         # ObjectTypes must be converted to a dynamic InputTypeVersion
         fields = R.prop('fields', field_config)
         resolved_graphene_type_or_fields = input_type_class(
-            dict(graphene_type=graphene_type, fields=fields),
+            dict(graphene_type=graphene_type, fields=fields, max_depth=R.prop_or(None, 'max_depth', field_config)),
             crud,
             parent_type_classes,
             fields_only=fields_only,
@@ -803,7 +1089,8 @@ def instantiate_graphene_type_or_fields(field_config, parent_type_classes, crud,
         _graphene_type = graphene_type()
         _fields = R.compose(call_if_lambda, R.prop('fields'))(field_config)
         resolved_graphene_type_or_fields = input_type_class(
-            dict(graphene_type=_graphene_type, fields=_fields), crud,
+            dict(graphene_type=_graphene_type, fields=_fields, max_depth=R.prop_or(None, 'max_depth', field_config)),
+            crud,
             parent_type_classes, fields_only=fields_only
         )
     elif R.isfunction(graphene_type):
@@ -981,7 +1268,8 @@ def graphql_query(graphene_type, fields, query_name):
         """
 
         # Map the field_type_lookup to the right graphene type, either a primitive like 'String' or a complex
-        # read input type like 'FeatureCollectionDataTypeofFooTypeRelatedReadInputType'
+        # read input type like 'FeatureCollectionDataTypeofFooTypeRelatedReadInputType', or the shared
+        # 'FeatureCollectionDataTypeRelatedReadInputType' if deduplicate_input_types() is True
         variable_definitions = R.map_key_values(
             lambda k, v: [
                 camelize(k, False),
@@ -1132,6 +1420,84 @@ def _flatten_until(key, value):
     return R.isinstance(str, key) and not R.isinstance(list, value)
 
 
+def _json_containment_path(lookup, container):
+    """
+        The path of a flattened JSONField lookup in a jsonb containment value, if the lookup can be merged into one.
+        Equality lookups of scalars and the __contains lookups of dicts and lists can. A containment value
+        must match every key of its path exactly, just like a chain of key transforms
+    :param lookup: The flattened lookup, e.g. 'data__friend__id'
+    :param container: Whether the value of the lookup is a dict or list
+    :return: The list of keys or None if the lookup must stay as is, like those of other filter suffixes and
+    array indexes, which mean something else in containment
+    """
+    path = R.tail(lookup.split('__'))
+    if container:
+        path = R.init(path) if R.last(path or ['']) == 'contains' else None
+    elif _key_matches_filter_field(lookup):
+        path = None
+    return path if path and not R.any_satisfy(lambda part: part.isdigit(), path) else None
+
+
+def _json_containment_partition(lookup_item_containers):
+    """
+        Partitions the flattened lookups of a JSONField into those merged into one containment value and the rest.
+        A lookup whose path is a prefix of another merged path, or has one as its prefix, isn't merged, since the
+        values could conflict
+    :param lookup_item_containers: List of [lookup, item, container]. Items are returned as is, so they can be
+    values or compiled filter steps
+    :return: dict(containment=list of [path, item], lookups=list of [lookup, item])
+    """
+    containment = []
+    lookups = []
+
+    def is_prefix(path1, path2):
+        return path1 == path2[:len(path1)]
+
+    for lookup, item, container in lookup_item_containers:
+        path = _json_containment_path(lookup, container)
+        if path and not R.any_satisfy(
+                lambda merged: is_prefix(merged[0], path) or is_prefix(path, merged[0]),
+                containment
+        ):
+            containment.append([path, item])
+        else:
+            lookups.append([lookup, item])
+    return dict(containment=containment, lookups=lookups)
+
+
+def _json_containment(paths_and_values):
+    """
+        Builds the containment value of paths and values from _json_containment_partition
+    :param paths_and_values: List of [path, value]
+    :return: The nested dict
+    """
+    containment = {}
+    for path, value in paths_and_values:
+        dct = containment
+        for path_key in R.init(path):
+            dct = dct.setdefault(path_key, {})
+        dct[R.last(path)] = value
+    return containment
+
+
+def _json_q_expressions(key, dct):
+    """
+        Creates the Q expressions of the flattened lookups of a JSONField. Equality and containment lookups are merged
+        into a single key__contains, jsonb's @>, which a GIN index on the field, e.g. with jsonb_path_ops, can serve.
+        Other lookups, like key__name__startswith, remain a Q expression each
+    :param key: The JSONField name
+    :param dct: The flattened lookups and their values
+    :return: The list of Q expressions, the containment first
+    """
+    partition = _json_containment_partition(
+        R.map_with_obj_to_values(lambda lookup, value: [lookup, value, isinstance(value, (dict, list, tuple))], dct)
+    )
+    return R.concat(
+        [Q(**{f'{key}__contains': _json_containment(partition['containment'])})] if partition['containment'] else [],
+        R.map(lambda lookup_value: Q(**{lookup_value[0]: lookup_value[1]}), partition['lookups'])
+    )
+
+
 def _key_matches_filter_field(key):
     """
         Returns true if the key string ends with a FILTER_FIELD like contains or range or in
@@ -1142,9 +1508,93 @@ def _key_matches_filter_field(key):
     return R.has(last_key, FILTER_FIELDS)
 
 
+def in_unnest_threshold():
+    """
+        The number of values above which __in lookups of lists of related objects compare with the unnested
+        array of the values rather than with a list of parameters, settings.RESCAPE_GRAPHENE_IN_UNNEST_THRESHOLD
+    :return: The threshold, 1000 by default
+    """
+    return getattr(settings, 'RESCAPE_GRAPHENE_IN_UNNEST_THRESHOLD', 1000)
+
+
+def _single_column(objs):
+    """
+        The key of a list of related objects that each have only that key, valued by a scalar, such as
+        [{id: 1}, {id: 2}]
+    :param objs: The objects of a __in lookup with their keys converted
+    :return: The key or None
+    """
+    columns = set(R.chain(lambda obj: list(obj.keys()) if isinstance(obj, dict) and len(obj) == 1 else [None], objs))
+    column = R.head(list(columns)) if len(columns) == 1 else None
+    if not column or '__' in column or \
+            R.any_satisfy(lambda obj: isinstance(obj[column], (dict, list, tuple)), objs):
+        return None
+    return column
+
+
+def _column_in_lookup(related_model, key, column):
+    """
+        The lookup that compares one column of the related objects of key__in with a list of values
+    :param related_model: The related model
+    :param key: The key ending with __in, e.g. 'foo__in'
+    :param column: The column, e.g. 'id' or 'key'
+    :return: E.g. 'foo__in' for the primary key or 'foo__key__in'
+    """
+    prefix = key[:-len('__in')]
+    if column in ('pk', related_model._meta.pk.name):
+        return f'{prefix}__in'
+    return f'{prefix}__{column}__in'
+
+
+def _column_in_field(related_model, column):
+    """
+        The field of the related model whose values _column_in_lookup compares, or None if column isn't a
+        concrete field of the related model
+    :param related_model: The related model
+    :param column: The column, e.g. 'id' or 'key'
+    :return: The field, e.g. the primary key field
+    """
+    if column == 'pk':
+        return related_model._meta.pk
+    try:
+        field = related_model._meta.get_field(column)
+    except FieldDoesNotExist:
+        return None
+    return field if field.concrete and not field.many_to_many else None
+
+
+def _column_in_expression(field, lookup, values):
+    """
+        Q(**{lookup: values}), or for more than in_unnest_threshold() values a comparison with
+        SELECT unnest(array), which passes the values as one array parameter that Postgres can hash.
+        Since RawSQL params bypass the field, the values are prepared by the field and the array is cast
+        to its column type, so that e.g. string ids of GraphQL ID arguments compare with an integer column
+    :param field: The field from _column_in_field. If None the values are always compared with Q(**{lookup: values})
+    :param lookup: The lookup from _column_in_lookup
+    :param values: The values to compare
+    :return: A Q expression
+    """
+    if field and len(values) > in_unnest_threshold():
+        # A foreign key's column has the type of its target field, while an AutoField's is integer rather than serial
+        db_type = field.db_type(connection) if field.is_relation else field.rel_db_type(connection)
+        return Q(**{lookup: RawSQL(
+            f'SELECT unnest(%s::{db_type}[])',
+            ([field.get_prep_value(value) for value in values],)
+        )})
+    return Q(**{lookup: values})
+
+
 def _related_model_expressions(related_model, value, key):
     # Convert the values to array if not and chain to flatten
     if R.equals('in', R.last(key.split('__'))):
+        column = _single_column(value)
+        if column:
+            # Objects like [{id: 1}, {id: 2}] only need their ids compared rather than an OR of each object
+            return [_column_in_expression(
+                _column_in_field(related_model, column),
+                _column_in_lookup(related_model, key, column),
+                R.map(R.prop(column), value)
+            )]
         # If we have an __in suffix we expect an array of related objects.
         # We do OR queries for these and return a single Q expression related_model_key__in=sub query
         qs = R.map(lambda obj: Q(**obj), value)
@@ -1191,12 +1641,11 @@ def process_query_kwarg(model, key, value):
         # If the key ends in not it tells us to convert to a ~Q(key) expression
         k = key.replace('__not', '')
         return [~Q(**{k: value})]
-    if isinstance(R.prop_or(None, key, model._meta._forward_fields_map), (JSONField,)):
+    metadata = model_metadata(model)
+    forward_fields_map = metadata['forward_fields_map']
+    if isinstance(R.prop_or(None, key, forward_fields_map), (JSONField,)):
         return R.compose(
-            lambda dct: R.map_with_obj_to_values(
-                lambda key, value: Q(**{key: value}),
-                dct
-            ),
+            lambda dct: _json_q_expressions(key, dct),
             # Small correction here to change the data filter to data... to data...__contains to handle any json
             # https://docs.djangoproject.com/en/2.0/ref/contrib/postgres/fields/#std:fieldlookup-hstorefield.contains
             # If the value is an object or array,
@@ -1215,23 +1664,17 @@ def process_query_kwarg(model, key, value):
                 '__'
             )
         )({key: value})
-    elif R.has(key, model._meta._forward_fields_map):
+    elif R.has(key, forward_fields_map):
         # If it's a model key
-        if isinstance(model._meta._forward_fields_map[key], (ForeignKey, OneToOneField, ManyToManyField)):
+        if isinstance(forward_fields_map[key], (ForeignKey, OneToOneField, ManyToManyField)):
             # Recurse on these, so foo: {bar: 1, car: 2} resolves to [['foo__bar' 1], ['foo__car', 2]]
-            related_model = model._meta._forward_fields_map[key].related_model
+            related_model = forward_fields_map[key].related_model
             return _related_model_expressions(related_model, value, key)
-        elif isinstance(model._meta._forward_fields_map[key], (ManyToManyField)):
-            raise NotImplementedError(f'Unrecognized field type for {model._meta._forward_fields_map[key]}')
-    elif R.contains(R.head(key.split('__')), R.map(R.prop('name'), model._meta.related_objects)):
+        elif isinstance(forward_fields_map[key], (ManyToManyField)):
+            raise NotImplementedError(f'Unrecognized field type for {forward_fields_map[key]}')
+    elif R.head(key.split('__')) in metadata['related_objects_by_name']:
         # Recurse on these, so foo: {bar: {id: 1}, car: {id: 2}} resolves to [['foo__bar__id' 1], ['foo__car__id', 2]]
-        many_to_many_rel = R.find(
-            lambda obj: R.compose(
-                R.equals(R.head(key.split('__'))),
-                R.prop('name')
-            )(obj),
-            model._meta.related_objects)
-        related_model = many_to_many_rel.related_model
+        related_model = metadata['related_objects_by_name'][R.head(key.split('__'))].related_model
         return _related_model_expressions(related_model, value, key)
 
     return [Q(**{key: value})]
@@ -1411,36 +1854,437 @@ def invert_q_expressions_sets(q_expressions):
     )(q_expressions)
 
 
+# Matches keys that contain _ followed by any of FILTER_FIELDS, such as name_contains or data__name_in
+_FILTER_KWARG_PATTERN = re.compile('|'.join(R.map(lambda suffix: f'_{re.escape(suffix)}', R.keys(FILTER_FIELDS))))
+
+
+# Bounded since nested JSON data in kwargs can have arbitrary keys
+@lru_cache(maxsize=4096)
+def _filter_kwarg_key(key):
+    """
+        Converts a filter kwarg key from _ to __, e.g. name_contains to name__contains. Keys that don't contain
+        a filter suffix are returned as is
+    :param key:
+    :return:
+    """
+    # Make sure __ or _ become __
+    return key.replace('__', '_').replace('_', '__') if _FILTER_KWARG_PATTERN.search(str(key)) else key
+
+
+def _filter_kwargs_shape(value):
+    """
+        The shape of filter kwargs or one of their values, which is everything process_query_kwarg decides on
+        besides the model. Scalars are all alike and so are lists that don't contain dicts, so the shape of
+        id__in=[1, 2, 3] doesn't depend on the number of ids. Neither does the shape of a list of dicts that
+        all have the same shape, like id__in=[{id: 1}, {id: 2}]
+    :param value:
+    :return: A hashable shape
+    """
+    if isinstance(value, dict):
+        return 'dict', tuple((key, _filter_kwargs_shape(inner_value)) for key, inner_value in value.items())
+    if isinstance(value, list):
+        if any(isinstance(item, dict) for item in value):
+            item_shapes = [_filter_kwargs_shape(item) for item in value]
+            if all(item_shape == item_shapes[0] for item_shape in item_shapes):
+                return 'list', ('each', item_shapes[0])
+            return 'list', ('items', tuple(item_shapes))
+        return 'list', None
+    if isinstance(value, tuple):
+        return 'tuple', None
+    return 'scalar', None
+
+
+class _UncompilableFilter(Exception):
+    """
+        Raised when compiling a kwarg whose processing depends on more than its shape
+    """
+    pass
+
+
+def _filter_step(path, lookup, shape, negated=False):
+    # Values that contain dicts are bound with their keys converted, as process_filter_kwargs converts all keys
+    return dict(
+        path=path,
+        lookup=lookup,
+        negated=negated,
+        convert=shape[0] == 'dict' or (shape[0] == 'list' and shape[1] is not None)
+    )
+
+
+def _json_filter_steps(lookup_keys, path, shape):
+    """
+        Compiles flatten_dct_until(dct, _flatten_until, '__') of a JSONField kwarg. Dicts are flattened into their
+        keys until a list, scalar or empty dict is reached
+    """
+    if shape[0] != 'dict' or not shape[1]:
+        return [[R.join('__', lookup_keys), path, shape]]
+    return R.chain(
+        lambda key_and_shape: _json_filter_steps(
+            R.concat(lookup_keys, [_filter_kwarg_key(key_and_shape[0])]),
+            R.concat(path, [key_and_shape[0]]),
+            key_and_shape[1]
+        ) if key_and_shape[1][0] != 'list' else [[
+            R.join('__', R.concat(lookup_keys, [_filter_kwarg_key(key_and_shape[0])])),
+            R.concat(path, [key_and_shape[0]]),
+            key_and_shape[1]
+        ]],
+        list(shape[1])
+    )
+
+
+def _prefix_filter_step(key, step):
+    # Like _related_model_expressions, this keeps the lookup of each related expression but not its negation
+    if 'each' in step:
+        return R.merge(step, dict(each=R.map(lambda each_step: _prefix_filter_step(key, each_step), step['each'])))
+    return R.merge(step, dict(lookup=f"{key}__{step['lookup']}", negated=False))
+
+
+def _compile_related_model_expressions(related_model, key, path, shape):
+    """
+        Compiles _related_model_expressions. Lists of related objects that all have the same shape are compiled
+        into a step whose 'each' steps are bound to every object
+    """
+    if R.equals('in', R.last(key.split('__'))):
+        item_shape = shape[1][1] if shape[0] == 'list' and shape[1] and shape[1][0] == 'each' else None
+        column = item_shape and len(item_shape[1]) == 1 and item_shape[1][0][1][0] == 'scalar' and \
+                 item_shape[1][0][0]
+        if not column or '__' in _filter_kwarg_key(column):
+            # Builds a subquery from the values
+            raise _UncompilableFilter()
+        return [dict(
+            path=path,
+            in_column=column,
+            field=_column_in_field(related_model, column),
+            lookup=_column_in_lookup(related_model, key, column)
+        )]
+    if shape[0] == 'list' and shape[1] is None:
+        # Lists without dicts fail in process_query_value
+        raise _UncompilableFilter()
+
+    def compile_item(item_path, item_shape):
+        if item_shape[0] != 'dict':
+            raise _UncompilableFilter()
+        return R.chain(
+            lambda key_and_shape: _compile_query_kwarg(
+                related_model,
+                _filter_kwarg_key(key_and_shape[0]),
+                R.concat(item_path, [key_and_shape[0]]),
+                key_and_shape[1]
+            ),
+            list(item_shape[1])
+        )
+
+    if shape[0] == 'list' and shape[1][0] == 'each':
+        steps = [dict(path=path, each=compile_item([], shape[1][1]))]
+    else:
+        steps = R.chain(
+            lambda item: compile_item(*item),
+            R.map(
+                lambda i_shape: [R.concat(path, [i_shape[0]]), i_shape[1]],
+                enumerate(shape[1][1])
+            ) if shape[0] == 'list' else [[path, shape]]
+        )
+    return R.map(lambda step: _prefix_filter_step(key, step), steps)
+
+
+def _compile_query_kwarg(model, key, path, shape):
+    """
+        Compiles process_query_kwarg(model, key, value) for any value of the given shape into steps that each
+        bind the value at path into one Q expression
+    :param model: The Django model
+    :param key: The key with filter suffixes already converted to __
+    :param path: The path of the value in the filter kwargs, using the kwargs' original keys
+    :param shape: The _filter_kwargs_shape of the value
+    :return: A list of _filter_step dicts
+    """
+    if key.endswith('__not'):
+        return [_filter_step(path, key.replace('__not', ''), shape, negated=True)]
+    if shape[0] == 'tuple':
+        raise _UncompilableFilter()
+    metadata = model_metadata(model)
+    forward_fields_map = metadata['forward_fields_map']
+    if isinstance(R.prop_or(None, key, forward_fields_map), (JSONField,)):
+        steps_and_containers = R.map(
+            lambda lookup_path_shape: [
+                _filter_step(
+                    lookup_path_shape[1],
+                    R.join('__', [lookup_path_shape[0], 'contains']) if
+                    lookup_path_shape[2][0] in ('dict', 'list') and not _key_matches_filter_field(lookup_path_shape[0])
+                    else lookup_path_shape[0],
+                    lookup_path_shape[2]
+                ),
+                # Tuples are uncompilable, so only dicts and lists are containers
+                lookup_path_shape[2][0] in ('dict', 'list')
+            ],
+            # Later duplicate lookups replace earlier ones like they do in flatten_dct_until
+            list({
+                lookup_path_shape[0]: lookup_path_shape
+                for lookup_path_shape in _json_filter_steps([key], path, shape)
+            }.values())
+        )
+        partition = _json_containment_partition(
+            R.map(
+                lambda step_and_container: [step_and_container[0]['lookup'], *step_and_container],
+                steps_and_containers
+            )
+        )
+        return R.concat(
+            [dict(
+                path=[],
+                lookup=f'{key}__contains',
+                negated=False,
+                containment=R.map(lambda path_step: dict(path_step[1], json_path=path_step[0]),
+                                  partition['containment'])
+            )] if partition['containment'] else [],
+            R.map(R.last, partition['lookups'])
+        )
+    elif R.has(key, forward_fields_map):
+        if isinstance(forward_fields_map[key], (ForeignKey, OneToOneField, ManyToManyField)):
+            return _compile_related_model_expressions(forward_fields_map[key].related_model, key, path, shape)
+    elif R.head(key.split('__')) in metadata['related_objects_by_name']:
+        related_model = metadata['related_objects_by_name'][R.head(key.split('__'))].related_model
+        return _compile_related_model_expressions(related_model, key, path, shape)
+    return [_filter_step(path, key, shape)]
+
+
+def _compile_filter_kwarg(model, key, shape):
+    try:
+        return _compile_query_kwarg(model, _filter_kwarg_key(key), [key], shape)
+    except _UncompilableFilter:
+        # Processed as is when bound
+        return [dict(path=[key], lookup=None, negated=False, convert=True, key=_filter_kwarg_key(key))]
+
+
+@lru_cache(maxsize=1024)
+def _filter_plan(model, kwargs_shape):
+    """
+        Compiles process_filter_kwargs for filter kwargs of the given shape
+    :param model: The Django model
+    :param kwargs_shape: The _filter_kwargs_shape of the kwargs
+    :return: dict(metadata=the model_metadata the plan was compiled with, steps=list of steps)
+    """
+    return dict(
+        metadata=model_metadata(model),
+        steps=R.chain(
+            lambda key_and_shape: _compile_filter_kwarg(model, *key_and_shape),
+            list(kwargs_shape[1])
+        )
+    )
+
+
+def filter_plan(model, kwargs):
+    """
+        The compiled plan of process_filter_kwargs(model, **kwargs), which is the same for any kwargs with the
+        same keys and kinds of values. Plans are recompiled if the model's metadata is recomputed
+    :param model: The Django model
+    :param kwargs: The filter kwargs
+    :return: dict(metadata, steps) where each step binds the value at step['path'] of kwargs into
+    Q(**{step['lookup']: value}), negated if step['negated']. Steps with 'each' steps bind those to every item
+    of the list at their path, steps with an 'in_column' bind the column of every item into one __in expression,
+    and steps whose lookup is None run process_query_kwarg with step['key'] when bound
+    """
+    kwargs_shape = _filter_kwargs_shape(kwargs)
+    plan = _filter_plan(model, kwargs_shape)
+    if plan['metadata'] is not model_metadata(model):
+        _filter_plan.cache_clear()
+        plan = _filter_plan(model, kwargs_shape)
+    return plan
+
+
+def _bound_value(kwargs, step):
+    value = R.reduce(lambda inner_value, key: inner_value[key], kwargs, step['path'])
+    return R.map_keys_deep(lambda k, v: _filter_kwarg_key(k), value) if step['convert'] else value
+
+
+def _bind_filter_step(model, kwargs, step):
+    if 'each' in step:
+        return [
+            q_expression
+            for item in R.reduce(lambda inner_value, key: inner_value[key], kwargs, step['path'])
+            for each_step in step['each']
+            for q_expression in _bind_filter_step(model, item, each_step)
+        ]
+    if 'in_column' in step:
+        items = R.reduce(lambda inner_value, key: inner_value[key], kwargs, step['path'])
+        return [_column_in_expression(step['field'], step['lookup'], [item[step['in_column']] for item in items])]
+    if 'containment' in step:
+        return [Q(**{step['lookup']: _json_containment(R.map(
+            lambda containment_step: [containment_step['json_path'], _bound_value(kwargs, containment_step)],
+            step['containment']
+        ))})]
+    value = _bound_value(kwargs, step)
+    if step['lookup'] is None:
+        return process_query_kwarg(model, step['key'], value)
+    q_expression = Q(**{step['lookup']: value})
+    return [~q_expression if step['negated'] else q_expression]
+
+
+# The date part suffixes of FILTER_FIELDS for date and datetime fields
+_DATE_PARTS = ['year', 'month', 'day', 'week_day']
+_DATETIME_PARTS = R.concat(_DATE_PARTS, ['hour', 'minute', 'second'])
+
+_date_part_kwarg_keys_by_model = {}
+
+
+def _date_part_kwarg_keys(model):
+    """
+        The filter kwarg keys of the date parts of model's date and datetime fields, e.g. created_at_year.
+        These are matched against the fields because _filter_kwarg_key can't tell the underscores of a field name
+        from the one before the suffix
+    :param model: The Django model
+    :return: dict keyed by kwarg key valued by dict(field, part, negated)
+    """
+    metadata = model_metadata(model)
+    cached = R.prop_or(None, model, _date_part_kwarg_keys_by_model)
+    if not cached or cached['metadata'] is not metadata:
+        cached = dict(metadata=metadata, keys={
+            f'{field.name}{separator}{part}{not_suffix}': dict(field=field, part=part, negated=bool(not_suffix))
+            for field in metadata['fields'] if isinstance(field, DateField) and field.concrete
+            for part in (_DATETIME_PARTS if isinstance(field, DateTimeField) else _DATE_PARTS)
+            for separator in ['_', '__']
+            for not_suffix in ['', f'{separator}not']
+        })
+        _date_part_kwarg_keys_by_model[model] = cached
+    return cached['keys']
+
+
+def _first_instant_at_or_after(local_datetime, tz):
+    """
+        The first instant whose local time in tz is at or after local_datetime, which is when a date starting at
+        local_datetime starts in tz. If local_datetime is skipped by a daylight saving time gap this is the end of
+        the gap. If it is repeated, this is the first occurrence
+    :param local_datetime: Naive datetime
+    :param tz: The time zone
+    :return: The aware datetime in UTC or None if local times go back across local_datetime, in which case
+    the instants of a date aren't a range
+    """
+    def local(instant):
+        return instant.astimezone(tz).replace(tzinfo=None)
+
+    utc_datetime = local_datetime.replace(tzinfo=dt_timezone.utc)
+    # The offsets in effect around local_datetime, which include those before and after any transition at it
+    offsets = set(R.map(
+        lambda days: (utc_datetime + timedelta(days=days)).astimezone(tz).utcoffset(),
+        [-1, 0, 1]
+    ))
+    candidates = sorted(R.filter(
+        lambda instant: local(instant) >= local_datetime,
+        set(R.map(lambda offset: utc_datetime - offset, offsets))
+    ))
+    if not candidates or (
+            R.length(candidates) > 1 and local(R.last(candidates) - timedelta(microseconds=1)) < local_datetime
+    ):
+        return None
+    return R.head(candidates)
+
+
+def _date_part_range(field, parts):
+    """
+        The half-open range of field values that have the given year, year and month, or year, month and day,
+        which is equivalent to comparing the date parts but can use an index on the field. Date parts of datetime
+        fields are those of the current time zone if settings.USE_TZ, as they are in Django's Extract
+    :param field: The DateField or DateTimeField
+    :param parts: dict of date parts and values, e.g. dict(year=2020, month=2)
+    :return: dict(start=, end=, parts=the date parts that the range replaces) or None if the parts
+    can't be rewritten
+    """
+    if 'year' not in parts:
+        return None
+    range_parts = R.concat(['year'], R.concat(['month'], ['day'] if 'day' in parts else []) if 'month' in parts else [])
+    values = R.props(range_parts, parts)
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+        return None
+    try:
+        start = datetime(*values, *[1] * (3 - R.length(values)))
+        if 'day' in range_parts:
+            end = start + timedelta(days=1)
+        elif 'month' in range_parts:
+            end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+        else:
+            end = datetime(start.year + 1, 1, 1)
+    except (ValueError, OverflowError):
+        # Invalid dates, which the date part lookups simply don't match
+        return None
+    if not isinstance(field, DateTimeField):
+        start, end = start.date(), end.date()
+    elif settings.USE_TZ:
+        tz = timezone.get_current_timezone()
+        start, end = _first_instant_at_or_after(start, tz), _first_instant_at_or_after(end, tz)
+        if not (start and end):
+            return None
+    return dict(start=start, end=end, parts=range_parts)
+
+
+def _date_part_expressions(date_part_kwargs):
+    """
+        Creates the Q expressions of the date part filter kwargs of a model. The year, month and day of a field are
+        rewritten as a range when possible, see _date_part_range. Other date parts are compared as is
+    :param date_part_kwargs: List of dict(field, part, negated, value)
+    :return: The list of Q expressions
+    """
+    q_expressions = []
+    for field_name in list(dict.fromkeys(R.map(lambda kwarg: kwarg['field'].name, date_part_kwargs))):
+        field_kwargs = R.filter(lambda kwarg: kwarg['field'].name == field_name, date_part_kwargs)
+        date_range = _date_part_range(
+            R.head(field_kwargs)['field'],
+            {kwarg['part']: kwarg['value'] for kwarg in field_kwargs if not kwarg['negated']}
+        )
+        if date_range:
+            q_expressions.append(Q(**{f'{field_name}__gte': date_range['start'], f'{field_name}__lt': date_range['end']}))
+        for kwarg in field_kwargs:
+            if kwarg['negated']:
+                q_expressions.append(~Q(**{f"{field_name}__{kwarg['part']}": kwarg['value']}))
+            elif not (date_range and kwarg['part'] in date_range['parts']):
+                q_expressions.append(Q(**{f"{field_name}__{kwarg['part']}": kwarg['value']}))
+    return q_expressions
+
+
 def process_filter_kwargs(model, **kwargs):
     """
-        Converts filter names for resolvers. They come in with an _ but need __ to match django's query language
+        Converts filter names for resolvers. They come in with an _ but need __ to match django's query language.
+        The conversion is compiled once per model and shape of kwargs by filter_plan, so this only binds the
+        values of kwargs into the plan's Q expressions. Date part filters of the model's fields, like
+        created_at_year and created_at_month, are rewritten as ranges where possible, see _date_part_expressions
     :param model: The django model--used to flatten the objects properly
     :param kwargs:
     :return: list of Q expressions representing each kwarg
     """
-    return R.compose(
-        lambda kwrgs: flatten_query_kwargs(model, kwrgs),
-
-        # Convert filters from _ to __
-        R.map_keys_deep(
-            # Make sure __ or _ become __
-            lambda k, v: k.replace('__', '_').replace('_', '__')
-            if R.any_satisfy(lambda string: '_%s' % string in str(k), R.keys(FILTER_FIELDS))
-            else k
+    date_part_keys = _date_part_kwarg_keys(model)
+    date_part_kwarg_keys = R.filter(lambda key: key in date_part_keys, R.keys(kwargs))
+    date_part_kwargs = R.map(
+        lambda key: R.merge(date_part_keys[key], dict(value=kwargs[key])),
+        date_part_kwarg_keys
+    )
+    if date_part_kwargs:
+        kwargs = R.omit(date_part_kwarg_keys, kwargs)
+    return R.concat(
+        _date_part_expressions(date_part_kwargs) if date_part_kwargs else [],
+        R.chain(
+            lambda step: _bind_filter_step(model, kwargs, step),
+            filter_plan(model, kwargs)['steps']
         )
-    )(kwargs)
+    )
+
 
+def _manager_for_selections(manager, info, fields):
+    # Resolvers that pass their info get querysets prepared for the selections, see query_for_selections
+    return query_for_selections(manager.all(), info, fields) if info else manager
 
-def query_with_filter_and_order_kwargs(model, **kwargs):
+
+def query_with_filter_and_order_kwargs(model, *, _info=None, _fields=None, **kwargs):
     """
         Calls process_filter_kwargs without the order_by kwarg, which if present is split by common and
         used with query.order_by(*order by clauses)
     :param model:
+    :param _info: Optional keyword-only resolve info. If given the query selects and prefetches the selected
+    relations and only loads the selected columns, see query_for_selections. Underscored so that it can't
+    collide with a filter kwarg
+    :param _fields: The field configs of the model's graphene type, used with _info
     :param kwargs:
     :return:
     """
     q_expressions = process_filter_kwargs(model, **R.omit(['order_by'], kwargs))
-    query = model.objects.filter(*q_expressions)
+    query = _manager_for_selections(model.objects, _info, _fields).filter(*q_expressions)
     if not R.has('order_by', kwargs):
         return query
     else:
@@ -1464,7 +2308,7 @@ def process_filter_kwargs_with_to_manys(model, process_filter_kwargs=process_fil
     )(kwargs)
 
 
-def query_sequentially(manager, manager_method, q_expressions_sets):
+def query_sequentially(manager, manager_method, q_expressions_sets, info=None, fields=None):
     """
         Sequentially queries the q_expression_sets formed by  process_filter_kwargs_with_to_manys/invert_q_expressions_sets
         Sequentially querying allows toMany values to be sought when multiple matching toMany instances are sought
@@ -1473,8 +2317,11 @@ def query_sequentially(manager, manager_method, q_expressions_sets):
     For sequential queries only the last query can be anything other than filter
     :param q_expressions_sets: List of lists of q expressions, where common query paths are separated into
     different sets so they can be run sequentially (see invert_q_expressions_sets)
+    :param info: Optional resolve info, see query_with_filter_and_order_kwargs
+    :param fields: The field configs of the model's graphene type, used with info
     :return: The query response
     """
+    manager = _manager_for_selections(manager, info, fields)
 
     if not R.length(q_expressions_sets):
         return getattr(manager, manager_method)()
@@ -1495,6 +2342,207 @@ def query_sequentially(manager, manager_method, q_expressions_sets):
     )
 
 
+def _to_many_lookup(model, lookup):
+    """
+        Splits a lookup at its first to-many relation
+    :param model: The Django model
+    :param lookup: A lookup like 'user__groups__name__contains'
+    :return: None if the lookup doesn't traverse a to-many relation, otherwise dict(
+        hops=the single-valued relations before the to-many one, e.g. ['user'],
+        field=the to-many field or relation, e.g. User.groups,
+        rest=the rest of the lookup, e.g. 'name__contains', or '' if the lookup ends with the to-many relation
+    )
+    """
+    parts = lookup.split('__')
+    hops = []
+    for i, part in enumerate(parts):
+        metadata = model_metadata(model)
+        kind = R.prop_or(None, part, metadata['relation_kinds'])
+        field = R.prop_or(None, part, metadata['field_by_name'])
+        if kind in (FOREIGN_KEY, ONE_TO_ONE) or (kind == REVERSE and field.one_to_one):
+            hops.append(part)
+            model = field.related_model
+        elif kind in (MANY_TO_MANY, REVERSE):
+            return dict(hops=hops, field=field, rest=R.join('__', parts[i + 1:]))
+        else:
+            return None
+    return None
+
+
+def _to_many_exists(to_many, rests_and_values):
+    """
+        A correlated EXISTS over the rows of a to-many relation, or of its through table, that satisfy all of
+        the lookups relative to the relation
+    :param to_many: The result of _to_many_lookup
+    :param rests_and_values: Pairs of a lookup relative to the to-many relation, e.g. 'name__contains', and a value
+    :return: An Exists expression or None if the lookups can't be answered by the related rows alone
+    """
+    if R.any_satisfy(lambda rest_and_value: 'isnull' in rest_and_value[0].split('__'), rests_and_values):
+        # isnull, e.g. bars__key__isnull=True, matches rows without related rows through Django's left join,
+        # which no related row can show
+        return None
+    field = to_many['field']
+    # Correlates with the model that has the to-many relation. If that's reached by hops from the filtered model,
+    # the outer query still joins the hops to reference it
+    outer_ref = OuterRef(R.join('__', to_many['hops'])) if to_many['hops'] else OuterRef('pk')
+    if isinstance(field, ManyToManyField):
+        related_model = field.remote_field.through
+        source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+    elif field.many_to_many:
+        related_model = field.through
+        source, target = field.field.m2m_reverse_field_name(), field.field.m2m_field_name()
+    else:
+        related_model, source, target = field.related_model, field.field.name, None
+
+    def related_lookup(rest):
+        if target:
+            return R.join('__', [target, rest]) if rest else target
+        # The related rows are the related instances, so only lookups like in or exact need their pk
+        metadata = model_metadata(related_model)
+        head = R.head(rest.split('__'))
+        is_field = head == 'pk' or R.has(head, metadata['forward_fields_map']) or \
+                   R.has(head, metadata['field_by_name'])
+        return rest if rest and is_field else R.join('__', R.filter(R.identity, ['pk', rest]))
+
+    return Exists(related_model.objects.filter(
+        *R.map(
+            lambda rest_and_value: Q(**{related_lookup(rest_and_value[0]): rest_and_value[1]}),
+            rests_and_values
+        ),
+        **{source: outer_ref}
+    ))
+
+
+def _semi_join(model, q_expression):
+    # Confines the joins of any expression to an EXISTS over the model itself, so it can't duplicate rows
+    return Exists(model.objects.filter(q_expression, pk=OuterRef('pk')))
+
+
+class _SemiJoinNeeded(Exception):
+    """
+        Raised when planning a filter that only a semi-join of the model can answer, if semi-joins aren't wanted
+    """
+    pass
+
+
+def _no_semi_join(model, q_expression):
+    raise _SemiJoinNeeded()
+
+
+def _has_to_many_lookup(model, q_expression):
+    # Whether any lookup of q_expression, or of the Q expressions that it combines, traverses a to-many relation.
+    # Children that aren't lookups are assumed to
+    return R.any_satisfy(
+        lambda child: _has_to_many_lookup(model, child) if isinstance(child, Q) else
+        not isinstance(child, tuple) or bool(_to_many_lookup(model, child[0])),
+        q_expression.children
+    )
+
+
+def _to_many_exists_expressions_of_set(model, q_expressions, semi_join=_semi_join):
+    # Expressions, and dicts that group the expressions of one to-many relation, in order of first appearance
+    planned = []
+    groups = {}
+    for q_expression in q_expressions:
+        simple = len(q_expression.children) == 1 and not isinstance(q_expression.children[0], Q)
+        to_many = _to_many_lookup(model, q_expression.children[0][0]) if simple else None
+        if not simple:
+            # Combined expressions like the range of a date part filter only need a semi-join for their to-many joins
+            planned.append(semi_join(model, q_expression) if _has_to_many_lookup(model, q_expression) else q_expression)
+        elif not to_many:
+            planned.append(q_expression)
+        elif q_expression.negated:
+            exists = _to_many_exists(to_many, [[to_many['rest'], q_expression.children[0][1]]])
+            planned.append(~exists if exists is not None else semi_join(model, q_expression))
+        else:
+            key = R.join('__', R.concat(to_many['hops'], [to_many['field'].name]))
+            if key not in groups:
+                groups[key] = dict(to_many=to_many, q_expressions=[], rests_and_values=[])
+                planned.append(groups[key])
+            groups[key]['q_expressions'].append(q_expression)
+            groups[key]['rests_and_values'].append([to_many['rest'], q_expression.children[0][1]])
+
+    def finish(expression):
+        if not isinstance(expression, dict):
+            return expression
+        exists = _to_many_exists(expression['to_many'], expression['rests_and_values'])
+        return exists if exists is not None else \
+            semi_join(model, R.reduce(lambda q1, q2: q1 & q2, Q(), expression['q_expressions']))
+
+    return R.map(finish, planned)
+
+
+def to_many_exists_expressions(model, q_expressions_sets):
+    """
+        Plans the q_expressions_sets of process_filter_kwargs_with_to_manys as a single filter without DISTINCT.
+        Each set is what query_sequentially filters by in one call, where the expressions whose lookups start
+        with the same to-many relation must be satisfied by the same related row. Each group of them becomes one
+        correlated EXISTS over the related rows, or over the through table of many-to-many relations.
+        Negated expressions become NOT EXISTS, which is how Django already excludes across to-many relations.
+        Expressions without to-many relations are kept as is
+    :param model: The Django model being filtered
+    :param q_expressions_sets: List of lists of Q expressions, see invert_q_expressions_sets
+    :return: List of Q and Exists expressions to pass to a single filter
+    """
+    return R.chain(lambda q_expressions: _to_many_exists_expressions_of_set(model, q_expressions), q_expressions_sets)
+
+
+def filter_sets_expression(model, kwargs_sets, process_filter_kwargs=process_filter_kwargs, semi_joins=True):
+    """
+        Combines sets of filter kwargs, any of which an instance may match, into one expression. Each set is
+        planned with to_many_exists_expressions, so its to-many filters are EXISTS subqueries that can't
+        duplicate rows, and the sets are or'd. Filtering by the expression is one query without DISTINCT,
+        rather than an or of a queryset per set
+    :param model: The Django model being filtered
+    :param kwargs_sets: List of filter kwargs, e.g. the objects argument of a paginated type
+    :param process_filter_kwargs: Defaults to process_filter_kwargs, see process_filter_kwargs_with_to_manys
+    :param semi_joins: Default True. If False and a filter can only be planned as a semi-join of the model that
+    keeps Django's joins, like an isnull lookup across a to-many relation, None is returned instead so that the
+    caller can filter by those joins
+    :return: The Q expression. Q() if any set has no filters, or None, see semi_joins
+    """
+    def set_expression(kwargs):
+        expressions = R.chain(
+            lambda q_expressions: _to_many_exists_expressions_of_set(
+                model,
+                q_expressions,
+                semi_join=_semi_join if semi_joins else _no_semi_join
+            ),
+            process_filter_kwargs_with_to_manys(model, process_filter_kwargs=process_filter_kwargs, **kwargs)
+        )
+        # Q(Exists) so the expressions combine as Q expressions
+        return R.reduce(
+            lambda q1, q2: q1 & q2,
+            Q(),
+            R.map(lambda expression: expression if isinstance(expression, Q) else Q(expression), expressions)
+        )
+
+    try:
+        q_expressions = R.map(set_expression, kwargs_sets)
+    except _SemiJoinNeeded:
+        return None
+    # Combining with Q() drops it, so a set that matches everything must be returned as is
+    if not q_expressions or R.any_satisfy(lambda q_expression: not q_expression, q_expressions):
+        return Q()
+    return R.reduce(lambda q1, q2: q1 | q2, R.head(q_expressions), R.tail(q_expressions))
+
+
+def query_with_to_many_exists(manager, manager_method, q_expressions_sets, info=None, fields=None):
+    """
+        Like query_sequentially but queries once with to_many_exists_expressions, which finds the same instances
+        with correlated EXISTS subqueries instead of a chain of filter().distinct() calls
+    :param manager: The django model manager
+    :param manager_method: The django model manager method. Normally 'filter', but could be 'count' or 'get'
+    :param q_expressions_sets: List of lists of q expressions, see invert_q_expressions_sets
+    :param info: Optional resolve info, see query_with_filter_and_order_kwargs
+    :param fields: The field configs of the model's graphene type, used with info
+    :return: The query response
+    """
+    return getattr(_manager_for_selections(manager, info, fields), manager_method)(
+        *to_many_exists_expressions(manager.model, q_expressions_sets)
+    )
+
+
 def apply_type(v, with_filter_fields=True):
     # What filter arguments are allowed for this field type. Get them here
     allowed_arguments = allowed_filter_arguments(R.prop('fields', v), R.prop('graphene_type', v),
@@ -1527,6 +2575,7 @@ def apply_type(v, with_filter_fields=True):
     return t(*args)
 
 
+@profile_schema_build('type_modify_fields')
 def type_modify_fields(data_field_configs, with_filter_fields=True):
     """
         Converts json field configs based on if they have a type_modifier property. The type_modifier property
@@ -0,0 +1,175 @@
+import os
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+###
+# Instrumentation of schema construction. Functions that build the schema are decorated with profile_schema_build,
+# which records their call counts and wall time, the calls that missed their memoize cache, and the time and dynamic
+# input type classes attributable to each Django model or graphene type being built.
+# Most of the schema is built at import time, so profiling must be enabled before rescape_graphene is imported,
+# either by setting the RESCAPE_GRAPHENE_SCHEMA_PROFILE environment variable or by the profile_schema
+# management command, which imports the schema in a fresh process with that variable set.
+# When profiling is disabled the decorators add a single flag check per call.
+###
+
+SCHEMA_PROFILE_ENV = 'RESCAPE_GRAPHENE_SCHEMA_PROFILE'
+
+_schema_profile = dict(
+    enabled=bool(os.environ.get(SCHEMA_PROFILE_ENV)),
+    functions={},
+    models={},
+    # The models currently being built, innermost last
+    model_stack=[]
+)
+
+
+def reset_schema_profile():
+    """
+        Clears everything recorded so far
+    :return:
+    """
+    _schema_profile['functions'] = {}
+    _schema_profile['models'] = {}
+    _schema_profile['model_stack'] = []
+
+
+@contextmanager
+def schema_build_profile():
+    """
+        Enables profiling for the duration of the context and yields a function that returns the report.
+        Only schema construction that happens within the context is recorded, so anything built at import
+        time before the context is entered is missing
+    :return:
+    """
+    enabled = _schema_profile['enabled']
+    reset_schema_profile()
+    _schema_profile['enabled'] = True
+    try:
+        yield schema_profile_report
+    finally:
+        _schema_profile['enabled'] = enabled
+
+
+def _function_record(name):
+    if name not in _schema_profile['functions']:
+        _schema_profile['functions'][name] = dict(calls=0, misses=None, seconds=0.0)
+    return _schema_profile['functions'][name]
+
+
+def _model_record(model):
+    if model not in _schema_profile['models']:
+        _schema_profile['models'][model] = dict(calls=0, seconds=0.0, classes_created=0, classes_reused=0)
+    return _schema_profile['models'][model]
+
+
+def profile_schema_build(name, model_of=None):
+    """
+        Decorator that records the calls and wall time of a schema construction function. Put it above
+        @memoize to count every call, and put profile_schema_build_miss below @memoize to count the calls
+        that miss the memoize cache
+    :param name: The name to report the function as
+    :param model_of: Optional function called with the decorated function's args and kwargs that returns
+    the label of the model or type being built, e.g. 'auth.User' or 'FooDataType', or None
+    :return: The decorator
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _schema_profile['enabled']:
+                return func(*args, **kwargs)
+            model = model_of(args, kwargs) if model_of else None
+            model_stack = _schema_profile['model_stack']
+            # Don't count time twice for a model that is built recursively
+            outermost = model is not None and model not in model_stack
+            if model is not None:
+                model_stack.append(model)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                record = _function_record(name)
+                record['calls'] += 1
+                record['seconds'] += seconds
+                if model is not None:
+                    model_stack.pop()
+                    model_record = _model_record(model)
+                    model_record['calls'] += 1
+                    if outermost:
+                        model_record['seconds'] += seconds
+
+        return wrapper
+
+    return decorator
+
+
+def profile_schema_build_miss(name):
+    """
+        Decorator for the function underneath @memoize that counts calls that weren't memoized
+    :param name: The name given to profile_schema_build
+    :return: The decorator
+    """
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _schema_profile['enabled']:
+                record = _function_record(name)
+                record['misses'] = (record['misses'] or 0) + 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def record_schema_build_class(created):
+    """
+        Records the creation or reuse of a dynamic input type class for the model currently being built
+    :param created: True if a new class was created, False if an existing one was reused
+    :return:
+    """
+    if not _schema_profile['enabled']:
+        return
+    model_stack = _schema_profile['model_stack']
+    model_record = _model_record(model_stack[-1] if model_stack else None)
+    model_record['classes_created' if created else 'classes_reused'] += 1
+
+
+def schema_profile_report():
+    """
+        The profile recorded so far as plain data that can be dumped to JSON
+    :return: dict(functions=dict keyed by function name and valued by dict(calls, misses, hit_rate, seconds),
+    models=dict keyed by model label and valued by dict(calls, seconds, classes_created, classes_reused)).
+    misses and hit_rate are None for functions that aren't memoized. Classes created outside any model
+    are keyed by 'None'
+    """
+    return dict(
+        functions={
+            name: dict(
+                record,
+                seconds=round(record['seconds'], 6),
+                hit_rate=None if record['misses'] is None or not record['calls'] else
+                round(1 - record['misses'] / record['calls'], 4)
+            ) for name, record in _schema_profile['functions'].items()
+        },
+        models={
+            str(model): dict(record, seconds=round(record['seconds'], 6))
+            for model, record in _schema_profile['models'].items()
+        }
+    )
+
+
+def profile_schema_import(schema_path, start):
+    """
+        Imports the schema at schema_path and reports the profile. Profiling must have been enabled before
+        rescape_graphene was imported, see SCHEMA_PROFILE_ENV
+    :param schema_path: Dotted path to the schema, e.g. settings.GRAPHENE['SCHEMA']
+    :param start: time.perf_counter() value from the start of the process, before Django was set up
+    :return: The schema_profile_report with schema=schema_path and seconds=the wall time since start
+    """
+    from django.utils.module_loading import import_string
+    import_string(schema_path)
+    return dict(schema_profile_report(), schema=schema_path, seconds=round(time.perf_counter() - start, 6))
@@ -0,0 +1,163 @@
+from django.db.models import Prefetch, JSONField
+from graphql.language import ast
+from inflection import underscore
+from rescape_python_helpers import ramda as R
+
+from rescape_graphene.django_helpers.model_metadata import model_metadata, FOREIGN_KEY, ONE_TO_ONE, REVERSE
+
+###
+# Helpers that prepare a queryset for the fields that a query selects, so that graphene resolves the selected
+# relations of every instance from the rows of one query per relation rather than one query per instance,
+# and so that the columns of fields that aren't selected aren't loaded
+###
+
+
+def selection_tree(field_asts, fragments=None):
+    """
+        Merges the selections of field_asts, including those of fragments, by the name of the selected field
+    :param field_asts: The graphql field asts, e.g. info.field_asts
+    :param fragments: The fragment definitions of the query keyed by name, e.g. info.fragments
+    :return: dict keyed by the underscored field name valued by the list of field asts that select it.
+    Pass the list to selection_tree to get the selections of that field
+    """
+    tree = {}
+
+    def add_selections(selection_set):
+        for selection in (selection_set.selections if selection_set else []):
+            if isinstance(selection, ast.FragmentSpread):
+                add_selections(R.prop(selection.name.value, fragments or {}).selection_set)
+            elif isinstance(selection, ast.InlineFragment):
+                add_selections(selection.selection_set)
+            elif not selection.name.value.startswith('__'):
+                tree.setdefault(underscore(selection.name.value), []).append(selection)
+
+    for field_ast in field_asts:
+        add_selections(field_ast.selection_set)
+    return tree
+
+
+def selection_query_plan(model, fields, field_asts, fragments=None, prefix='', required=[], variables=None):
+    """
+        Plans the query of model for the fields that field_asts select. Forward and reverse one-to-one relations
+        are selected and to-many relations are prefetched, each with a queryset planned for the selections of the
+        relation. Columns that aren't selected are left out with only(), including those of fields with read=IGNORE
+        or DENY. A field that isn't a model field, like a property or a field with its own resolver, can declare
+        the model fields it reads with depends_on in its field config. If it doesn't, its model isn't projected,
+        since what it reads is unknown. Resolvers that read their own field, like resolver_for_dict_field and
+        resolver_for_feature_collection, keep their column by being selected. Json lists selected with filter
+        arguments in the json fields of the queried model are filtered by annotations,
+        see json_list_filter_annotations
+    :param model: The Django model queried
+    :param fields: The field configs of the model's graphene type, e.g. foo_fields. The 'fields' of each
+    relation's config are used to plan the relation's selections
+    :param field_asts: The graphql field asts that select from the model, e.g. info.field_asts
+    :param fragments: The fragment definitions of the query, e.g. info.fragments
+    :param prefix: The lookup of the model from the queried model, used when recursing
+    :param required: Fields that must be loaded besides those selected, used when recursing
+    :param variables: The variable values of the query, e.g. info.variable_values
+    :return: dict(
+        select_related=list of lookups,
+        prefetch_related=list of Prefetch,
+        only=list of lookups of the fields to load or None to load all of them,
+        annotations=dict of annotation names and expressions
+    )
+    """
+    from rescape_graphene.graphql_helpers.json_field_helpers import json_list_filter_annotations
+    metadata = model_metadata(model)
+    select_related = []
+    prefetch_related = []
+    columns = R.concat([model._meta.pk.name], required)
+    related_only = []
+    annotations = {}
+    projectable = True
+    for name, selections in selection_tree(field_asts, fragments).items():
+        field_config = R.prop_or({}, name, fields or {})
+        kind = R.prop_or(None, name, metadata['relation_kinds'])
+        field = R.prop_or(None, name, metadata['field_by_name'])
+        if R.has('depends_on', field_config):
+            columns.extend(field_config['depends_on'])
+        elif kind and R.any_satisfy(lambda selection: selection.selection_set, selections):
+            related_fields = R.prop_or({}, 'fields', field_config)
+            lookup = f'{prefix}{name}'
+            if kind in (FOREIGN_KEY, ONE_TO_ONE) or (kind == REVERSE and field.one_to_one):
+                select_related.append(lookup)
+                plan = selection_query_plan(
+                    field.related_model, related_fields, selections, fragments, f'{lookup}__', variables=variables
+                )
+                select_related.extend(plan['select_related'])
+                prefetch_related.extend(plan['prefetch_related'])
+                if kind == REVERSE:
+                    # only() can't name reverse relations
+                    projectable = False
+                else:
+                    columns.append(name)
+                    related_only.extend(plan['only'] or [])
+            else:
+                prefetch_related.append(Prefetch(lookup, queryset=apply_selection_query_plan(
+                    field.related_model._default_manager.all(),
+                    selection_query_plan(
+                        field.related_model,
+                        related_fields,
+                        selections,
+                        fragments,
+                        # Prefetching by a reverse foreign key matches the related rows by their foreign key
+                        required=[] if field.many_to_many else [field.field.name],
+                        variables=variables
+                    )
+                )))
+        elif field is not None and field.concrete:
+            columns.append(name)
+            # Annotations can only be read from instances of the queried model, not of selected relations
+            if isinstance(field, JSONField) and not prefix:
+                annotations.update(json_list_filter_annotations(model, field_config, selections, fragments, variables))
+        elif not kind:
+            projectable = False
+    return dict(
+        select_related=select_related,
+        prefetch_related=prefetch_related,
+        only=list(dict.fromkeys(R.concat(R.map(lambda column: f'{prefix}{column}', columns), related_only)))
+        if projectable else None,
+        annotations=annotations
+    )
+
+
+def apply_selection_query_plan(queryset, plan):
+    """
+        Applies a selection_query_plan to queryset
+    :param queryset: The Django queryset
+    :param plan: The result of selection_query_plan
+    :return: The queryset with the plan's select_related, prefetch_related, only and annotations
+    """
+    if plan['select_related']:
+        queryset = queryset.select_related(*plan['select_related'])
+    if plan['prefetch_related']:
+        queryset = queryset.prefetch_related(*plan['prefetch_related'])
+    if plan['only'] is not None:
+        queryset = queryset.only(*plan['only'])
+    if plan['annotations']:
+        queryset = queryset.annotate(**plan['annotations'])
+    return queryset
+
+
+def query_for_selections(queryset, info, fields=None, field_asts=None):
+    """
+        Prepares the queryset that a resolver returns for the fields selected by the query, so that
+        a list of n instances and their selected relations takes a constant number of queries rather than O(n),
+        and so that columns that aren't selected aren't loaded
+    :param queryset: The queryset the resolver returns
+    :param info: The resolve info of the resolver
+    :param fields: The field configs of the graphene type of the queryset's model, e.g. foo_fields
+    :param field_asts: The field asts that select from the model when they aren't info.field_asts, such as
+    the objects of a paginated type
+    :return: The queryset with select_related, prefetch_related, only and annotations for the selections
+    """
+    return apply_selection_query_plan(
+        queryset,
+        selection_query_plan(
+            queryset.model,
+            fields,
+            info.field_asts if field_asts is None else field_asts,
+            info.fragments,
+            variables=info.variable_values
+        )
+    )
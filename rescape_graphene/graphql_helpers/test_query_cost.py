@@ -0,0 +1,60 @@
+import json
+
+from django.test import RequestFactory, override_settings
+from graphql import parse
+from snapshottest import TestCase
+
+from rescape_graphene.graphql_helpers.query_cost import query_cost
+from rescape_graphene.graphql_helpers.views import SafeGraphQLView
+
+
+class TestQueryCost(TestCase):
+    def test_query_cost(self):
+        from sample_webapp.sample_schema import create_default_schema
+        schema = create_default_schema()
+
+        # Each of the 100 assumed foos costs itself, its user and 100 assumed bars
+        assert query_cost(schema, parse('''
+            query { foos { id user { id } ...FooBars } }
+            fragment FooBars on FooType { bars { id } }
+        ''')) == dict(
+            cost=100 * (1 + 1 + 100), depth=2, lists=2, relation_filters=0, json_filters=0, in_values=0
+        )
+
+        cost = query_cost(schema, parse('''
+            query foos($keys: [String]) {
+                foos(user: {id: 1, groups: [{name: "g"}]}, data: {example: 1.1, friend: {id: 1}}, keyIn: $keys) {
+                    geojson { features(type: "Feature") { id } }
+                }
+            }
+        '''), dict(keys=['a', 'b', 'c']))
+        # The user and its groups are related model filters. The friend filter is part of the data containment
+        assert cost == dict(
+            cost=2 * 10 + 5 + 3 * 0.1 + 100 * (1 + 1 + 5 + 100 * 1),
+            depth=3, lists=2, relation_filters=2, json_filters=2, in_values=3
+        )
+
+        # The page size of a paginated type is the length of its objects
+        assert query_cost(schema, parse('{ foosPaginated(page: 1, pageSize: 5) { pages objects { id } } }'))[
+                   'cost'] == 1 + 5 * 1
+
+        with override_settings(RESCAPE_GRAPHENE_QUERY_COST_WEIGHTS=dict(list_size=10)):
+            assert query_cost(schema, parse('{ foos { id } }'))['cost'] == 10
+        assert query_cost(schema, parse('{ __schema { types { name fields { name } } } }'))['cost'] == 0
+
+    def test_safe_graphql_view_query_cost(self):
+        from sample_webapp.sample_schema import create_default_schema
+        view = SafeGraphQLView.as_view(schema=create_default_schema())
+
+        def post(query):
+            return view(RequestFactory().post('/graphql', json.dumps(dict(query=query)), content_type='application/json'))
+
+        with override_settings(RESCAPE_GRAPHENE_MAX_QUERY_COST=1000):
+            response = post('{ foos { id bars { id } } }')
+            content = json.loads(response.content)
+            # Rejected without executing
+            assert response.status_code == 400
+            assert 'data' not in content
+            assert content['errors'][0]['code'] == 'query-cost-exceeded'
+            assert content['extensions']['cost']['cost'] == 10100
+            assert content['extensions']['cost']['action'] == 'reject'
@@ -0,0 +1,91 @@
+from functools import partial
+
+from django.test import override_settings
+from graphene import String, Int, List, InputField, Field, ObjectType
+from snapshottest import TestCase
+
+from rescape_graphene.graphql_helpers.schema_cache import fingerprint, describe_fields, materialize_fields, \
+    input_type_class_for_fields, UnfingerprintableValueError
+
+
+class TestSchemaCache(TestCase):
+    def test_fingerprint(self):
+        config = dict(name=dict(type=String), tags=dict(type=String, type_modifier=lambda *type_and_args: List(*type_and_args)))
+        same_config = dict(name=dict(type=String), tags=dict(type=String, type_modifier=lambda *type_and_args: List(*type_and_args)))
+        assert fingerprint(config, 'create') == fingerprint(same_config, 'create')
+        assert fingerprint(config, 'create') != fingerprint(config, 'update')
+        assert fingerprint(config) != fingerprint(dict(name=dict(type=Int), tags=config['tags']))
+
+        # Partials and other objects are fingerprinted by their contents rather than their class
+        def resolve(prefix, value):
+            return f'{prefix}{value}'
+
+        assert fingerprint(dict(name=dict(type=String, resolver=partial(resolve, 'a')))) == \
+               fingerprint(dict(name=dict(type=String, resolver=partial(resolve, 'a'))))
+        assert fingerprint(dict(name=dict(type=String, resolver=partial(resolve, 'a')))) != \
+               fingerprint(dict(name=dict(type=String, resolver=partial(resolve, 'b'))))
+
+        class Config:
+            def __init__(self, prefix):
+                self.prefix = prefix
+
+        assert fingerprint(dict(name=dict(type=String, config=Config('a')))) != \
+               fingerprint(dict(name=dict(type=String, config=Config('b'))))
+        # Objects whose contents can't be described can't be fingerprinted, so their configs aren't cached
+        with self.assertRaises(UnfingerprintableValueError):
+            fingerprint(dict(name=dict(type=String, config=object())))
+
+    def test_describe_and_materialize_fields(self):
+        inner = input_type_class_for_fields('TestSchemaCacheInnerInputType', dict(key=InputField(String)))
+        fields = dict(
+            name=InputField(String, required=True),
+            tags=InputField(List(String), description='Tags'),
+            inner=InputField(inner),
+            count=Field(Int)
+        )
+        materialized = materialize_fields(describe_fields(fields))
+        assert list(materialized.keys()) == list(fields.keys())
+        # Input types are resolved by name rather than recreated
+        assert materialized['inner'].type is inner
+        assert materialized['tags'].description == 'Tags'
+        assert str(materialized['name'].type) == str(fields['name'].type)
+        assert str(materialized['tags'].type) == str(fields['tags'].type)
+        # Field order is preserved by creation order
+        assert [key for key, _ in sorted(materialized.items(), key=lambda kv: kv[1].creation_counter)] == \
+               list(fields.keys())
+
+    def test_input_type_class_for_fields_deduplicates(self):
+        class TestSchemaCacheUserType(ObjectType):
+            pass
+
+        class TestSchemaCacheBarType(ObjectType):
+            pass
+
+        def input_type(name, fields, graphene_class=TestSchemaCacheUserType, crud='read'):
+            return input_type_class_for_fields(name, fields, graphene_class=graphene_class, crud=crud)
+
+        user_fields = dict(id=InputField(Int), username=InputField(String))
+        # Types aren't shared unless enabled
+        assert input_type('TestSchemaCacheUserTypeofTeamTypeRelatedReadInputType', user_fields) is not \
+               input_type('TestSchemaCacheUserTypeofLeagueTypeRelatedReadInputType', user_fields)
+
+        with override_settings(RESCAPE_GRAPHENE_DEDUPLICATE_INPUT_TYPES=True):
+            first = input_type('TestSchemaCacheUserTypeofGroupTypeRelatedReadInputType', user_fields)
+            second = input_type('TestSchemaCacheUserTypeofRegionTypeRelatedReadInputType', user_fields)
+            assert first is second
+            assert first._meta.name == 'TestSchemaCacheUserTypeRelatedReadInputType'
+
+            # Other graphene types and cruds with identical fields aren't shared
+            bar = input_type('TestSchemaCacheBarTypeofGroupTypeRelatedReadInputType', user_fields,
+                             graphene_class=TestSchemaCacheBarType)
+            update = input_type('TestSchemaCacheUserTypeofGroupTypeRelatedUpdateInputType', user_fields, crud='update')
+            assert bar is not first and update is not first
+            assert bar._meta.name == 'TestSchemaCacheBarTypeRelatedReadInputType'
+            assert update._meta.name == 'TestSchemaCacheUserTypeRelatedUpdateInputType'
+
+            # Once the fields of the user type differ by ancestry, each type takes the least of its ancestry names,
+            # whatever order they were built in
+            different = input_type('TestSchemaCacheUserTypeofProjectTypeRelatedReadInputType', dict(id=InputField(Int)))
+            assert different is not first
+            assert different._meta.name == 'TestSchemaCacheUserTypeofProjectTypeRelatedReadInputType'
+            assert first._meta.name == 'TestSchemaCacheUserTypeofGroupTypeRelatedReadInputType'
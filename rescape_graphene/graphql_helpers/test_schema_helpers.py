@@ -1,4 +1,13 @@
-from rescape_graphene.graphql_helpers.schema_helpers import merge_data_fields_on_update
+import graphene
+from django.core.exceptions import ImproperlyConfigured
+from django.test import override_settings
+from django.db.models import Q
+from rescape_python_helpers import ramda as R
+
+from rescape_graphene.graphql_helpers.schema_helpers import merge_data_fields_on_update, filter_fields_for_field, \
+    allowed_filter_arguments, FILTER_FIELDS, filter_suffixes_for_class, _filter_kwarg_key, input_type_class, READ, \
+    process_filter_kwargs, flatten_query_kwargs, filter_plan, process_filter_kwargs_with_to_manys, \
+    query_sequentially, query_with_to_many_exists, filter_sets_expression
 from snapshottest import TestCase, pytest
 
 
@@ -22,3 +31,205 @@ class TestGrapheneHelpers(TestCase):
             data=dict(jump=['jive'], then=dict(you='wail'), hold=dict(on=1, off=1)),
             also=1,
         )
+
+    def test_filter_fields_for_field(self):
+        class FilteredType(graphene.ObjectType):
+            pass
+
+        assert filter_fields_for_field(FilteredType, dict(type=graphene.String)) is FILTER_FIELDS
+        with override_settings(RESCAPE_GRAPHENE_FILTERS=['in'], RESCAPE_GRAPHENE_TYPE_FILTERS=dict(FilteredType=[])):
+            # A type profile overrides the default, and field filters override both
+            assert list(filter_fields_for_field(None, dict(type=graphene.String))) == ['in', 'in_not']
+            assert filter_fields_for_field(FilteredType, dict(type=graphene.String)) == {}
+            assert list(filter_fields_for_field(
+                FilteredType,
+                dict(type=graphene.String, filters=['startswith'])
+            )) == ['startswith', 'startswith_not']
+
+        with override_settings(RESCAPE_GRAPHENE_FILTERS=['startswith']):
+            arguments = allowed_filter_arguments(dict(name=dict(type=graphene.String)), FilteredType)
+            assert list(arguments) == ['name', 'name_startswith', 'name_startswith_not']
+
+        # Date parts are numbers rather than values of the field's type
+        arguments = allowed_filter_arguments(dict(created_at=dict(type=graphene.DateTime)), FilteredType)
+        assert isinstance(arguments['created_at_year'], graphene.Int)
+        assert isinstance(arguments['created_at_hour_not'], graphene.Int)
+        assert isinstance(arguments['created_at_gt'], graphene.DateTime)
+
+        with self.assertRaisesRegex(ImproperlyConfigured, 'Unknown filter suffix startwith'):
+            filter_fields_for_field(FilteredType, dict(type=graphene.String, filters=['startwith']))
+
+    def test_filter_suffixes_for_class(self):
+        assert 'startswith' in filter_suffixes_for_class(graphene.String)
+        assert 'gt' not in filter_suffixes_for_class(graphene.String)
+        assert 'year_not' in filter_suffixes_for_class(graphene.DateTime)
+        # Only suffixes without allowed_types apply to fields without a type
+        assert filter_suffixes_for_class(None) == ['contains', 'contains_not']
+
+    def test_filter_kwarg_key(self):
+        assert _filter_kwarg_key('name_contains') == 'name__contains'
+        assert _filter_kwarg_key('data__friend_name_startswith_not') == 'data__friend__name__startswith__not'
+        assert _filter_kwarg_key('name') == 'name'
+
+    def test_process_filter_kwargs_plan(self):
+        from sample_webapp.models import Foo
+
+        def uncompiled(**kwargs):
+            return flatten_query_kwargs(Foo, R.map_keys_deep(lambda k, v: _filter_kwarg_key(k), kwargs))
+
+        for kwargs in [
+            dict(name_contains='x', key_in=['a', 'b'], name_not='y'),
+            dict(data=dict(friend=dict(id=2), tags=['a'], name_startswith='f'), data_contains=dict(a=1)),
+            dict(user=dict(id=1, username_contains='a', is_active_not=True)),
+            dict(user=[dict(id=1), dict(username='b')], bars=dict(key='x'))
+        ]:
+            assert process_filter_kwargs(Foo, **kwargs) == uncompiled(**kwargs)
+
+        # Kwargs with the same keys and kinds of values share a plan
+        assert filter_plan(Foo, dict(key_in=['a'], user=dict(id=1))) is \
+               filter_plan(Foo, dict(key_in=['b', 'c'], user=dict(id=2)))
+        assert filter_plan(Foo, dict(key_in=['a'], user=dict(id=1))) is not \
+               filter_plan(Foo, dict(key_in=['a'], user=dict(username='a')))
+
+    def test_process_filter_kwargs_in_column(self):
+        from django.contrib.auth.models import User
+        from django.db.models.expressions import RawSQL
+
+        # Objects with only an id are compared by id rather than by an OR of each object in a subquery
+        assert process_filter_kwargs(User, foo_in=[dict(id=1), dict(id=2)]) == [Q(foo__in=[1, 2])]
+        assert process_filter_kwargs(User, foo_in=[dict(key='a'), dict(key='b')]) == [Q(foo__key__in=['a', 'b'])]
+        with override_settings(RESCAPE_GRAPHENE_IN_UNNEST_THRESHOLD=2):
+            q_expression = R.head(process_filter_kwargs(User, foo_in=[dict(id=1), dict(id=2), dict(id=3)]))
+            assert isinstance(q_expression.children[0][1], RawSQL)
+            assert q_expression.children[0][1].params == ([1, 2, 3],)
+            # String ids of ID arguments are prepared by the field and the array is cast to the column type
+            q_expression = R.head(process_filter_kwargs(User, foo_in=[dict(id='1'), dict(id='2'), dict(id='3')]))
+            assert q_expression.children[0][1].params == ([1, 2, 3],)
+            assert '::integer[]' in q_expression.children[0][1].sql
+
+    def test_process_filter_kwargs_json_containment(self):
+        from sample_webapp.models import Foo
+
+        # Equality filters on json keys become one containment, other lookups stay a Q expression each
+        assert process_filter_kwargs(
+            Foo,
+            data=dict(example=1.1, friend=dict(id=2, name_startswith='A'), tags=['a'])
+        ) == [
+            Q(data__contains=dict(example=1.1, friend=dict(id=2), tags=['a'])),
+            Q(data__friend__name__startswith='A')
+        ]
+        # Array indexes aren't keys in a containment
+        assert process_filter_kwargs(Foo, data={'0': 1}) == [Q(data__0=1)]
+
+    def test_process_filter_kwargs_date_part_ranges(self):
+        from datetime import datetime, timedelta, timezone as dt_timezone
+        from django.utils import timezone
+        from sample_webapp.models import Foo
+
+        assert process_filter_kwargs(Foo, created_at_year=2020, created_at_month=12, created_at_hour=1) == [
+            Q(
+                created_at__gte=datetime(2020, 12, 1, tzinfo=dt_timezone.utc),
+                created_at__lt=datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+            ),
+            Q(created_at__hour=1)
+        ]
+        # Invalid dates and parts without a year are compared as is
+        assert process_filter_kwargs(Foo, created_at_year=2020, created_at_month=13) == [
+            Q(created_at__year=2020), Q(created_at__month=13)
+        ]
+        assert process_filter_kwargs(Foo, created_at_day=1) == [Q(created_at__day=1)]
+
+        # The ranges match the instants whose local date parts match, including across daylight saving time
+        # transitions at midnight and a skipped day
+        for tz_name, local_date in [
+            ['UTC', datetime(2020, 2, 29)],
+            ['Europe/London', datetime(2019, 3, 31)],
+            ['America/Sao_Paulo', datetime(2018, 11, 4)],
+            ['America/Sao_Paulo', datetime(2019, 2, 16)],
+            ['America/Havana', datetime(2019, 11, 3)],
+            ['Pacific/Apia', datetime(2011, 12, 30)],
+        ]:
+            with timezone.override(tz_name):
+                tz = timezone.get_current_timezone()
+                for parts in [['year'], ['year', 'month'], ['year', 'month', 'day']]:
+                    q_expression = R.head(process_filter_kwargs(
+                        Foo,
+                        **{f'created_at_{part}': getattr(local_date, part) for part in parts}
+                    ))
+                    bounds = dict(q_expression.children)
+                    instant = datetime(local_date.year, local_date.month, local_date.day, tzinfo=dt_timezone.utc) - \
+                              timedelta(days=2)
+                    for _ in range(4 * 24 * 4):
+                        local = instant.astimezone(tz)
+                        matches = all(getattr(local, part) == getattr(local_date, part) for part in parts)
+                        assert matches == (bounds['created_at__gte'] <= instant < bounds['created_at__lt']), \
+                            f'{tz_name} {parts} {instant}'
+                        instant += timedelta(minutes=15)
+
+    def test_query_with_to_many_exists(self):
+        from sample_webapp.models import Foo
+        q_expressions_sets = process_filter_kwargs_with_to_manys(
+            Foo,
+            name_contains='x',
+            bars=[dict(key='a', id=1), dict(key='b')],
+            user=dict(groups=dict(name='g'))
+        )
+        # Both bars must be present, so query_sequentially filters twice
+        assert len(q_expressions_sets) == 2
+        assert 'DISTINCT' in str(query_sequentially(Foo.objects, 'filter', q_expressions_sets).query)
+
+        sql = str(query_with_to_many_exists(Foo.objects, 'filter', q_expressions_sets).query)
+        assert 'DISTINCT' not in sql
+        # One EXISTS per bar, with both conditions of the first bar in the same EXISTS, and one for the user's groups
+        assert sql.count('EXISTS') == 3
+        assert 'U0."foo_id" = "sample_webapp_foo"."id"' in sql
+        assert 'U0."user_id" = "sample_webapp_foo"."user_id"' in sql
+
+    def test_query_with_to_many_exists_isnull(self):
+        from sample_webapp.models import Foo
+        # A Foo without bars matches through the left join, so the filter isn't an EXISTS over the bars
+        sql = str(query_with_to_many_exists(
+            Foo.objects, 'filter', process_filter_kwargs_with_to_manys(Foo, bars=dict(key_isnull=True))
+        ).query)
+        assert 'FROM "sample_webapp_foo" U0 LEFT OUTER JOIN "sample_webapp_foo_bars" U1' in sql
+        assert 'U2."key" IS NULL' in sql
+
+    def test_filter_sets_expression(self):
+        from sample_webapp.models import Foo
+
+        q_expression = filter_sets_expression(Foo, [
+            dict(name='Foo', bars=[dict(key='a'), dict(key='b')]),
+            dict(user=dict(groups=dict(name='g')))
+        ])
+        sql = str(Foo.objects.filter(q_expression).query)
+        # One statement with an EXISTS per bar and one for the user's groups, or'd
+        assert sql.count('EXISTS') == 3 and ' OR ' in sql and 'DISTINCT' not in sql
+        # A set without filters matches everything
+        assert filter_sets_expression(Foo, [dict(name='Foo'), {}]) == Q()
+
+    def test_input_type_class_max_depth(self):
+        from rescape_graphene.schema_models.user_schema import UserType, user_fields
+
+        # A field config max_depth of 0 makes the related type an id-only reference
+        reference = input_type_class(
+            dict(graphene_type=UserType, type=UserType, fields=user_fields, max_depth=0),
+            READ,
+            ['TestMaxDepthType']
+        )
+        assert reference._meta.name == 'UserTypeReferenceReadInputType'
+        assert list(reference._meta.fields.keys()) == ['id']
+
+        with override_settings(RESCAPE_GRAPHENE_MAX_INPUT_TYPE_DEPTH=0):
+            # Top-level arguments aren't nested, but their related types are
+            arguments = input_type_class(
+                dict(graphene_type=UserType, type=UserType, fields=user_fields),
+                READ,
+                ['TestMaxDepthType'],
+                fields_only=True
+            )
+            assert 'username' in arguments
+            assert input_type_class(
+                dict(graphene_type=UserType, type=UserType, fields=user_fields),
+                READ,
+                ['TestMaxDepthType']
+            ) is reference
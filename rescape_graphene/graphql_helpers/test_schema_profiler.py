@@ -0,0 +1,30 @@
+from rescape_python_helpers import memoize
+from snapshottest import TestCase
+
+from rescape_graphene.graphql_helpers.schema_profiler import schema_build_profile, profile_schema_build, \
+    profile_schema_build_miss, record_schema_build_class
+
+
+@profile_schema_build('profiled_build', model_of=lambda args, kwargs: args[0])
+@memoize(map_args=lambda args: args)
+@profile_schema_build_miss('profiled_build')
+def profiled_build(model, depth):
+    record_schema_build_class(created=depth == 0)
+    return profiled_build(model, depth - 1) if depth else model
+
+
+class TestSchemaProfiler(TestCase):
+    def test_schema_build_profile(self):
+        with schema_build_profile() as report:
+            profiled_build('foo', 1)
+            profiled_build('foo', 1)
+        profile = report()
+        assert profile['functions']['profiled_build'] == dict(calls=3, misses=2, hit_rate=0.3333,
+                                                              seconds=profile['functions']['profiled_build']['seconds'])
+        assert profile['models']['foo']['calls'] == 3
+        assert profile['models']['foo']['classes_created'] == 1
+        assert profile['models']['foo']['classes_reused'] == 1
+
+        # Nothing is recorded outside of the context
+        profiled_build('bar', 0)
+        assert 'bar' not in report()['models']
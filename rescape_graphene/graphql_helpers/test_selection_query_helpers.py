@@ -0,0 +1,106 @@
+from graphql import parse
+from rescape_python_helpers import ramda as R
+from snapshottest import TestCase
+
+from rescape_graphene.graphql_helpers.json_field_helpers import json_list_annotation_name, argument_value
+from rescape_graphene.graphql_helpers.selection_query_helpers import selection_tree, selection_query_plan, \
+    apply_selection_query_plan
+
+
+def _field_asts_and_fragments(query):
+    document = parse(query)
+    operation = document.definitions[0]
+    fragments = {definition.name.value: definition for definition in document.definitions[1:]}
+    return [operation.selection_set.selections[0]], fragments
+
+
+class TestSelectionQueryHelpers(TestCase):
+    def test_selection_tree(self):
+        field_asts, fragments = _field_asts_and_fragments('''
+            query { foos { id __typename ...FooUser user { id } ... on FooType { geoCollection { type } } } }
+            fragment FooUser on FooType { user { username } }
+        ''')
+        tree = selection_tree(field_asts, fragments)
+        assert list(tree.keys()) == ['id', 'user', 'geo_collection']
+        # The user selections of the fragment and the query are merged
+        assert list(selection_tree(tree['user'], fragments).keys()) == ['username', 'id']
+
+    def test_selection_query_plan(self):
+        from sample_webapp.foo_schema import foo_fields
+        from sample_webapp.models import Foo
+        field_asts, fragments = _field_asts_and_fragments('''
+            query { foos { id key user { id groups { name } } bars { key } data { friend { id } } } }
+        ''')
+        plan = selection_query_plan(Foo, foo_fields, field_asts, fragments)
+        assert plan['select_related'] == ['user']
+        assert [prefetch.prefetch_through for prefetch in plan['prefetch_related']] == ['user__groups', 'bars']
+
+        queryset = apply_selection_query_plan(Foo.objects.all(), plan)
+        assert queryset.query.select_related == dict(user={})
+        assert len(queryset._prefetch_related_lookups) == 2
+        # Only the selected columns are loaded, including those of the selected user
+        assert plan['only'] == ['id', 'key', 'user', 'data', 'user__id']
+        assert queryset.query.deferred_loading == (frozenset(plan['only']), False)
+        # The groups of the user are prefetched with only their selected columns
+        assert plan['prefetch_related'][0].queryset.query.deferred_loading == (frozenset(['id', 'name']), False)
+
+        # Queries without relations need neither joins nor prefetches
+        field_asts, fragments = _field_asts_and_fragments('query { foos { id key geoCollection { type } } }')
+        assert selection_query_plan(Foo, foo_fields, field_asts, fragments) == dict(
+            select_related=[],
+            prefetch_related=[],
+            only=['id', 'key', 'geo_collection'],
+            annotations={}
+        )
+
+    def test_selection_query_plan_depends_on(self):
+        from sample_webapp.models import Foo
+        field_asts, fragments = _field_asts_and_fragments('query { foos { id label } }')
+        # Fields that aren't model fields prevent projection unless they declare what they read
+        assert selection_query_plan(Foo, dict(), field_asts, fragments)['only'] is None
+        assert selection_query_plan(
+            Foo,
+            dict(label=dict(depends_on=['key', 'name'])),
+            field_asts,
+            fragments
+        )['only'] == ['id', 'key', 'name']
+
+    def test_selection_query_plan_json_list_filter(self):
+        from sample_webapp.foo_schema import foo_fields
+        from sample_webapp.models import Foo
+        field_asts, fragments = _field_asts_and_fragments('''
+            query($type: String) { foos { id geojson { features(type: $type) { id } all: features { id } } } }
+        ''')
+        plan = selection_query_plan(Foo, foo_fields, field_asts, fragments, variables=dict(type='Feature'))
+        # Only the filtered features are annotated, by a name for the path and the arguments
+        assert list(plan['annotations'].keys()) == [
+            json_list_annotation_name(('geojson', 'features'), dict(type='Feature'))
+        ]
+        sql, params = apply_selection_query_plan(Foo.objects.all(), plan).query.sql_with_params()
+        assert '@>' in sql and '{"type": "Feature"}' in params
+
+    def test_selection_query_plan_json_list_filter_variable(self):
+        from sample_webapp.foo_schema import foo_fields
+        from sample_webapp.models import Foo
+        field_asts, fragments = _field_asts_and_fragments('''
+            query($geometry: FeatureGeometryDataTypeRelatedReadInputType) {
+                foos { id geojson { features(geometry: $geometry) { id } } }
+            }
+        ''')
+        plan = selection_query_plan(Foo, foo_fields, field_asts, fragments, variables=dict(geometry=dict(type='Polygon')))
+        # The annotation is named for the kwargs that resolver_for_dict_list receives
+        assert list(plan['annotations'].keys()) == [
+            json_list_annotation_name(('geojson', 'features'), dict(geometry=dict(type='Polygon')))
+        ]
+
+    def test_argument_value(self):
+        field_asts, _ = _field_asts_and_fragments('''
+            query($objects: [FooTypeRelatedReadInputType]) {
+                foos(objects: $objects, literal: [{user: {isActive: true, id: 1}}]) { id }
+            }
+        ''')
+        arguments = {argument.name.value: argument.value for argument in R.head(field_asts).arguments}
+        # Input object keys of variables are underscored like those of literals, as graphene does for resolvers
+        assert argument_value(arguments['objects'], dict(objects=[dict(user=dict(isActive=True, id=1))])) == \
+               argument_value(arguments['literal'], {}) == \
+               [dict(user=dict(is_active=True, id=1))]
@@ -4,17 +4,29 @@ import logging
 import traceback
 
 from django.conf import settings
+from django.db import connection, transaction
 from graphene_django.views import GraphQLView
+from graphql import parse
 from graphql.error import GraphQLSyntaxError
 from graphql.error import format_error as format_graphql_error
 from graphql.error.located_error import GraphQLLocatedError
+from graphql.execution import ExecutionResult
 
 from rescape_python_helpers import ramda as R
 from .exceptions import ResponseError
+from .query_cost import query_cost
 from .str_converters import to_kebab_case, dict_key_to_camel_case
 
 log = logging.getLogger('rescape_graphene')
 
+# What SafeGraphQLView does with a request whose query_cost exceeds its maximum.
+# REJECT responds with a query-cost-exceeded error without executing the request
+REJECT = 'reject'
+# DOWNGRADE executes the request with a statement timeout, so it can't hold a database connection for long
+DOWNGRADE = 'downgrade'
+# The request attribute that holds the query cost of the request being executed
+QUERY_COST_ATTRIBUTE = 'rescape_graphene_query_cost'
+
 def encode_code(code):
     if code is None:
         return None
@@ -64,11 +76,74 @@ def format_located_error(error):
 
 
 class SafeGraphQLView(GraphQLView):
-
-    def execute_graphql_request(self, *args, **kwargs):
-        result = super().execute_graphql_request(*args, **kwargs)
-        if result.errors:
-            log.error(json.dumps(R.pick(['operationName', 'variables'], args[1]), indent=4))
+    """
+        GraphQLView that logs errors and formats them for clients, and that estimates the cost of each request
+        with query_cost before executing it. Requests whose cost exceeds max_query_cost are handled according to
+        query_cost_action. The cost, the maximum and the action taken, if any, are returned in the cost key of
+        the response's extensions
+    """
+    # The maximum query cost of a request. Defaults to settings.RESCAPE_GRAPHENE_MAX_QUERY_COST. None for no maximum
+    max_query_cost = None
+    # REJECT or DOWNGRADE. Defaults to settings.RESCAPE_GRAPHENE_QUERY_COST_ACTION or else REJECT
+    query_cost_action = None
+    # The statement timeout in milliseconds of downgraded requests.
+    # Defaults to settings.RESCAPE_GRAPHENE_DOWNGRADED_STATEMENT_TIMEOUT or else 5000
+    downgraded_statement_timeout = None
+
+    def query_cost_limits(self):
+        """
+            The maximum query cost, the action and the downgraded statement timeout of this view
+        :return: dict(maximum, action, statement_timeout)
+        """
+        return dict(
+            maximum=self.max_query_cost if self.max_query_cost is not None else
+            getattr(settings, 'RESCAPE_GRAPHENE_MAX_QUERY_COST', None),
+            action=self.query_cost_action or getattr(settings, 'RESCAPE_GRAPHENE_QUERY_COST_ACTION', REJECT),
+            statement_timeout=self.downgraded_statement_timeout or
+                              getattr(settings, 'RESCAPE_GRAPHENE_DOWNGRADED_STATEMENT_TIMEOUT', 5000)
+        )
+
+    def estimate_query_cost(self, query, variables, operation_name):
+        """
+            The query_cost of the request, or None if the query can't be parsed. Its errors are reported by
+            the execution
+        """
+        try:
+            document_ast = parse(query)
+        except Exception:
+            return None
+        return query_cost(self.schema, document_ast, variables, operation_name)
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, *args, **kwargs):
+        limits = self.query_cost_limits()
+        cost = self.estimate_query_cost(query, variables, operation_name) if query else None
+        over_budget = cost and limits['maximum'] is not None and cost['cost'] > limits['maximum']
+        setattr(
+            request,
+            QUERY_COST_ATTRIBUTE,
+            R.merge(cost, dict(maximum=limits['maximum'], action=limits['action'] if over_budget else None)) if
+            cost else None
+        )
+
+        if over_budget and limits['action'] == REJECT:
+            result = ExecutionResult(
+                errors=[ResponseError(
+                    f"Query cost {cost['cost']} exceeds the maximum of {limits['maximum']}",
+                    code='query_cost_exceeded',
+                    params=dict(cost=cost['cost'], maximum=limits['maximum'])
+                )],
+                invalid=True
+            )
+        elif over_budget:
+            with transaction.atomic(), connection.cursor() as cursor:
+                # Only for this transaction
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [str(limits['statement_timeout'])])
+                result = super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
+        else:
+            result = super().execute_graphql_request(request, data, query, variables, operation_name, *args, **kwargs)
+
+        if result and result.errors:
+            log.error(json.dumps(R.pick(['operationName', 'variables'], data), indent=4))
             for error in result.errors:
                 if hasattr(error, 'source'):
                     log.error(error.source.body)
@@ -77,6 +152,14 @@ class SafeGraphQLView(GraphQLView):
 
         return result
 
+    def json_encode(self, request, d, pretty=False):
+        cost = getattr(request, QUERY_COST_ATTRIBUTE, None)
+        # A batch's list of responses is encoded after each of its responses
+        if cost and isinstance(d, dict):
+            d = R.merge(d, dict(extensions=R.merge(R.prop_or({}, 'extensions', d), dict(cost=cost))))
+            setattr(request, QUERY_COST_ATTRIBUTE, None)
+        return super().json_encode(request, d, pretty)
+
     @staticmethod
     def format_error(error):
         try:
@@ -84,6 +167,8 @@ class SafeGraphQLView(GraphQLView):
                 return format_located_error(error)
             elif isinstance(error, GraphQLSyntaxError):
                 return format_graphql_error(error)
+            elif isinstance(error, ResponseError):
+                return format_response_error(error)
             else:
                 return GraphQLView.format_error(error)
         except Exception as e:
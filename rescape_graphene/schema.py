@@ -1,10 +1,18 @@
+import gc
+
+from django.conf import settings
+from django.utils.module_loading import import_string
 from graphene import Schema
 from rescape_python_helpers import ramda as R
 
+from rescape_graphene.graphql_helpers.schema_cache import flush_schema_build_cache
+from rescape_graphene.graphql_helpers.schema_profiler import profile_schema_build
+
 from rescape_graphene.schema_models.token_schema import RescapeTokenMutation, RescapeTokenQuery
 from rescape_graphene.schema_models.user_schema import UserQuery, UserMutation
 
 
+@profile_schema_build('create_query_mutation_schema')
 def create_query_mutation_schema(class_config):
     """
         Creates a schema from defaults or allows overrides of any of these schemas
@@ -22,12 +30,36 @@ def create_query_mutation_schema(class_config):
 
     obj = create_query_and_mutation_classes(class_config)
     schema = Schema(query=R.prop('query', obj), mutation=R.prop('mutation', obj))
+    # Persist the input type fields computed for this schema if settings.RESCAPE_GRAPHENE_SCHEMA_CACHE is configured
+    flush_schema_build_cache()
     return dict(query=R.prop('query', obj), mutation=R.prop('mutation', obj), schema=schema)
 
 
 def create_schema(class_config):
     return R.prop('schema', create_query_mutation_schema(class_config))
 
+
+def prebuild_schema(schema=None, freeze=True):
+    """
+        Fully builds the schema in the current process. Call this in the master process of a pre-forking server,
+        e.g. in wsgi.py with gunicorn's preload_app = True, so that workers inherit the built schema instead of
+        each building their own. With freeze the built objects are then moved out of garbage collection
+        tracking with gc.freeze(). Otherwise each worker's first collections write to the GC headers of every
+        inherited object, which copies the pages holding them into the worker
+    :param schema: The graphene Schema or a dotted path to it. Defaults to settings.GRAPHENE['SCHEMA']
+    :param freeze: Default True. Call gc.freeze() after building
+    :return: The schema
+    """
+    schema = import_string(schema or settings.GRAPHENE['SCHEMA']) if not isinstance(schema, Schema) else schema
+    # Resolves the lazy field types of every type reachable from the schema, creating any input types
+    # that haven't been created yet
+    schema.get_type_map()
+    flush_schema_build_cache()
+    if freeze:
+        gc.freeze()
+    return schema
+
+
 def create_query_and_mutation_classes(query_and_mutation_class_lookups):
     """
         Creates a Query class and Mutation classs from defaults or allows overrides of any of these schemas
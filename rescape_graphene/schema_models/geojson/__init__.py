@@ -1,9 +1,27 @@
+from importlib import import_module
+
 from .converters import convert_field_to_feature_collection
-from .types import GrapheneFeatureCollection, FeatureCollectionDataType, \
-    feature_geometry_data_type_fields, feature_data_type_fields, FeatureGeometryDataType, FeatureDataType
+
+# The types are imported on first access since importing them builds their fields
+_LAZY_ATTRIBUTES = dict(
+    GrapheneFeatureCollection='.types',
+    FeatureCollectionDataType='.types',
+    feature_geometry_data_type_fields='.types',
+    feature_data_type_fields='.types',
+    FeatureGeometryDataType='.types',
+    FeatureDataType='.types'
+)
 
 __all__ = [
     'converters',
     'GrapheneFeatureCollection', 'FeatureCollectionDataType',
     'feature_geometry_data_type_fields', 'feature_data_type_fields', 'FeatureGeometryDataType', 'FeatureDataType'
-]
\ No newline at end of file
+]
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -4,7 +4,6 @@ from django.contrib.gis.db import models
 import graphene
 from graphene_django.converter import convert_django_field
 
-from rescape_graphene.schema_models.geojson.types import FeatureCollectionDataType
 
 @convert_django_field.register(models.GeometryCollectionField)
 def convert_field_to_feature_collection(field, registry=None):
@@ -15,6 +14,8 @@ def convert_field_to_feature_collection(field, registry=None):
     :param registry:
     :return:
     """
+    # Imported lazily since importing the types builds their fields
+    from rescape_graphene.schema_models.geojson.types import FeatureCollectionDataType
     return graphene.Field(
         FeatureCollectionDataType,
         description=field.help_text,
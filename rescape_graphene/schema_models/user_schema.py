@@ -13,6 +13,8 @@ from ..graphql_helpers.schema_helpers import input_type_fields, REQUIRE, DENY, C
     merge_with_django_properties, input_type_parameters_for_update_or_create, UPDATE, \
     guess_update_or_create, graphql_update_or_create, graphql_query, update_or_create_with_revision, \
     top_level_allowed_filter_arguments, query_with_filter_and_order_kwargs
+# Registers GroupType with graphene-django so that UserType gets its groups field
+from .group_schema import GroupType
 
 
 class UserType(DjangoObjectType, DjangoObjectTypeRevisionedMixin):
@@ -57,7 +59,7 @@ class UserQuery(ObjectType):
         :return:
         """
 
-        return query_with_filter_and_order_kwargs(get_user_model(), **kwargs)
+        return query_with_filter_and_order_kwargs(get_user_model(), _info=info, _fields=user_fields, **kwargs)
 
     def resolve_current_user(self, info):
         """
@@ -7,13 +7,17 @@ from rescape_python_helpers import ramda as R
 from rescape_python_helpers.geospatial.geometry_helpers import ewkt_from_feature_collection
 
 from rescape_graphene import increment_prop_until_unique, enforce_unique_props
+from rescape_graphene.django_helpers.pagination import create_paginated_type_mixin, resolve_paginated_for_type, \
+    pagination_allowed_filter_arguments
+from rescape_graphene.django_helpers.versioning import create_version_container_type, resolve_version_instance, \
+    versioning_allowed_filter_arguments
 from rescape_graphene.graphql_helpers.json_field_helpers import model_resolver_for_dict_field, \
     resolver_for_feature_collection, resolver_for_dict_field
 from rescape_graphene.graphql_helpers.schema_helpers import REQUIRE, \
     merge_with_django_properties, guess_update_or_create, \
     CREATE, UPDATE, input_type_parameters_for_update_or_create, graphql_update_or_create, graphql_query, \
     input_type_fields, DENY, IGNORE, top_level_allowed_filter_arguments, allowed_filter_arguments, \
-    update_or_create_with_revision, process_filter_kwargs, process_filter_kwargs_with_to_manys, query_sequentially, \
+    update_or_create_with_revision, process_filter_kwargs, process_filter_kwargs_with_to_manys, query_with_to_many_exists, \
     type_modify_fields
 from rescape_graphene.schema_models.geojson.types.feature_collection import FeatureCollectionDataType, \
     feature_collection_data_type_fields
@@ -132,6 +136,34 @@ foo_fields = merge_with_django_properties(FooType, dict(
 ))
 
 
+foo_paginated_type_mixin = create_paginated_type_mixin(FooType, foo_fields)
+
+
+class FooPaginatedType(foo_paginated_type_mixin['type']):
+    """
+        A page of Foos
+    """
+    pass
+
+
+foo_versioned_type_mixin = create_version_container_type(FooType, foo_fields)
+
+
+class FooVersionedType(foo_versioned_type_mixin['type']):
+    """
+        A window of the versions of a Foo
+    """
+    pass
+
+
+def foo_resolver(manager_method, **kwargs):
+    """
+        Resolves the Foos matching the filter kwargs, see resolve_paginated_for_type
+    """
+    q_expressions_sets = process_filter_kwargs_with_to_manys(Foo, **kwargs)
+    return query_with_to_many_exists(Foo.objects, manager_method, q_expressions_sets)
+
+
 class FooQuery(ObjectType):
     id = graphene.Int(source='pk')
 
@@ -140,10 +172,34 @@ class FooQuery(ObjectType):
         **top_level_allowed_filter_arguments(foo_fields, FooType)
     )
 
+    foos_paginated = Field(
+        FooPaginatedType,
+        **pagination_allowed_filter_arguments(foo_paginated_type_mixin['fields'], FooPaginatedType)
+    )
+
+    foo_versions = Field(
+        FooVersionedType,
+        **versioning_allowed_filter_arguments(foo_versioned_type_mixin['fields'], FooVersionedType)
+    )
+
     @login_required
     def resolve_foos(self, info, **kwargs):
         q_expressions_sets = process_filter_kwargs_with_to_manys(Foo, **kwargs)
-        return query_sequentially(Foo.objects, 'filter', q_expressions_sets)
+        return query_with_to_many_exists(Foo.objects, 'filter', q_expressions_sets, info=info, fields=foo_fields)
+
+    @login_required
+    def resolve_foos_paginated(self, info, **kwargs):
+        return resolve_paginated_for_type(
+            FooPaginatedType,
+            foo_resolver,
+            info=info,
+            fields=foo_fields,
+            **kwargs
+        )
+
+    @login_required
+    def resolve_foo_versions(self, info, **kwargs):
+        return resolve_version_instance(FooVersionedType, foo_resolver, **kwargs)
 
 
 foo_mutation_config = dict(
@@ -4,15 +4,21 @@ import pytest
 import reversion
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rescape_python_helpers import ramda as R
 from rescape_python_helpers.geospatial.geometry_helpers import ewkt_from_feature_collection
 from reversion.models import Version
 from snapshottest import TestCase
 
+from rescape_graphene.django_helpers.pagination import resolve_paginated_for_type, create_paginated_type_mixin
+from rescape_graphene.django_helpers.versioning import get_versioner, create_version_container_type
 from rescape_graphene.graphql_helpers.schema_validating_helpers import quiz_model_query, quiz_model_mutation_create, \
     quiz_model_mutation_update
 from rescape_graphene.testcases import client_for_testing
-from .foo_schema import graphql_query_foos, graphql_update_or_create_foo
+from .foo_schema import graphql_query_foos, graphql_update_or_create_foo, FooType, foo_fields, FooPaginatedType, \
+    foo_resolver
 from .models import Foo, Bar
 from .sample_schema import create_default_schema
 
@@ -96,6 +102,226 @@ class FooSchemaTestCase(TestCase):
         quiz_model_query(self.client, graphql_query_foos, 'foos', dict(name='Foo', bars=[dict(key='bar')]))
         quiz_model_query(self.client, graphql_query_foos, 'foos', dict(name='Foo', bars=[dict(key='bar'), dict(key='bar_barr')]))
 
+    def test_query_json_list_filter(self):
+        query = 'query($type: String) { foos { key geojson { type features(type: $type) { type geometry { type } } } } }'
+        with CaptureQueriesContext(connection) as context:
+            result = self.client.execute(query, variables=dict(type='Feature'))
+        assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+        # The features are filtered by the query of the foos
+        assert R.any_satisfy(lambda query: '@>' in query['sql'], context.captured_queries)
+        assert R.map(
+            lambda foo: R.map(R.prop('type'), foo['geojson']['features']),
+            result['data']['foos']
+        ) == [['Feature'], ['Feature']]
+
+        result = self.client.execute(query, variables=dict(type='Point'))
+        assert R.map(lambda foo: foo['geojson']['features'], result['data']['foos']) == [[], []]
+
+    def test_query_date_parts(self):
+        from django.utils import timezone
+        query = 'query($year: Int, $month: Int) { foos(createdAtYear: $year, createdAtMonth: $month) { key } }'
+        created_at = timezone.localtime(R.head(self.foos).created_at)
+
+        def execute(year, month):
+            with CaptureQueriesContext(connection) as context:
+                result = self.client.execute(query, variables=dict(year=year, month=month))
+            assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+            foo_sql = R.filter(lambda query: 'sample_webapp_foo"."key' in query['sql'], context.captured_queries)
+            return [sorted(R.map(R.prop('key'), result['data']['foos'])), R.head(foo_sql)['sql']]
+
+        # The year and month are compared as a range of created_at, which can use an index, rather than extracted
+        keys, sql = execute(created_at.year, created_at.month)
+        assert keys == sorted(R.map(lambda foo: foo.key, self.foos))
+        assert '"sample_webapp_foo"."created_at" >=' in sql and '"sample_webapp_foo"."created_at" <' in sql
+        assert 'EXTRACT' not in sql
+        keys, _ = execute(created_at.year - 1, created_at.month)
+        assert keys == []
+
+    def test_query_count(self):
+        query = 'query { foos { id key user { id username } bars { id key } } }'
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as context:
+                result = self.client.execute(query)
+            assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+            # Unselected columns aren't loaded
+            assert not R.any_satisfy(lambda query: 'geojson' in query['sql'], context.captured_queries)
+            return len(context.captured_queries)
+
+        count = count_queries()
+        bars = list(Bar.objects.all())
+        for i in range(3):
+            foo = Foo.objects.create(
+                key=f'moo{i}',
+                name=f'Moo {i}',
+                user=self.user,
+                data=dict(example=2.2),
+                geojson=geojson,
+                geo_collection=ewkt_from_feature_collection(geojson)
+            )
+            foo.bars.set(bars)
+        # The user is selected with each foo and the bars of all foos are prefetched
+        assert count_queries() == count
+
+    def test_paginate_with_cursor(self):
+        from rescape_graphene.django_helpers.pagination import create_paginated_type_mixin, get_paginator
+        from .foo_schema import FooType, foo_fields
+        paginated_type = create_paginated_type_mixin(FooType, foo_fields)['type']
+        for i in range(3):
+            Foo.objects.create(
+                key=f'moo{i}', name='Moo', user=self.user, data=dict(example=2.2), geojson=geojson,
+                geo_collection=ewkt_from_feature_collection(geojson)
+            )
+
+        keys = []
+        cursor = ''
+        while cursor is not None:
+            with CaptureQueriesContext(connection) as context:
+                page = get_paginator(Foo.objects.all(), 2, None, paginated_type, '-name,key', cursor=cursor)
+            # No count
+            assert len(context.captured_queries) == 1
+            keys.extend(R.map(R.prop('key'), page.objects))
+            cursor = page.next_cursor
+        assert keys == R.map(R.prop('key'), Foo.objects.order_by('-name', 'key', 'id'))
+
+    def test_query_paginated_counts(self):
+        query = 'query($pageSize: Int) { foosPaginated(page: 1, pageSize: $pageSize, orderBy: "key", objects: [{}]) ' \
+                '{ %s hasNext objects { key } } }'
+
+        def execute(selections, page_size=1):
+            with CaptureQueriesContext(connection) as context:
+                result = self.client.execute(query % selections, variables=dict(pageSize=page_size))
+            assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+            return [
+                R.item_path(['data', 'foosPaginated'], result),
+                R.any_satisfy(lambda query: 'COUNT(' in query['sql'], context.captured_queries)
+            ]
+
+        # Nothing is counted unless pages is selected
+        page, counted = execute('')
+        assert not counted and page['hasNext'] and R.map(R.prop('key'), page['objects']) == ['boo']
+        page, counted = execute('pages pagesApproximate')
+        assert counted and page['pages'] == 2 and page['pagesApproximate'] is False
+        with override_settings(RESCAPE_GRAPHENE_APPROXIMATE_COUNT_THRESHOLD=0):
+            page, counted = execute('pages pagesApproximate', page_size=1000)
+            # The planner's estimate of a small table isn't exact
+            assert not counted and page['pages'] >= 1 and page['pagesApproximate'] is True
+
+    def test_query_paginated_objects(self):
+        query = 'query($objects: [FooTypeRelatedReadInputType]) { foosPaginated(page: 1, pageSize: 10, ' \
+                'objects: $objects) { objects { key } } }'
+        with CaptureQueriesContext(connection) as context:
+            result = self.client.execute(query, variables=dict(objects=[
+                dict(name='Foo', bars=[dict(key='bar_barr')]),
+                dict(key='boo'),
+                dict(bars=[dict(key='bar')])
+            ]))
+        assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+        # Each foo once, from one query of the page
+        assert sorted(R.map(R.prop('key'), R.item_path(['data', 'foosPaginated', 'objects'], result))) == ['boo', 'foo']
+        assert len(R.filter(lambda query: 'sample_webapp_foo"."key' in query['sql'], context.captured_queries)) == 1
+
+    def test_resolve_paginated_for_type(self):
+        resolved_kwargs = []
+
+        def resolver(manager_method, **kwargs):
+            resolved_kwargs.append(kwargs)
+            return foo_resolver(manager_method, **kwargs)
+
+        def resolve(objects, **kwargs):
+            resolved_kwargs.clear()
+            with CaptureQueriesContext(connection) as context:
+                page = resolve_paginated_for_type(FooPaginatedType, resolver, page_size=10, page=1, objects=objects,
+                                                  **kwargs)
+                keys = sorted(R.map(lambda foo: foo.key, page.objects))
+            assert len(R.filter(lambda query: 'sample_webapp_foo"."key' in query['sql'], context.captured_queries)) == 1
+            return keys
+
+        # By default the resolver is called once and its queryset is filtered by one expression of the objects
+        assert resolve([dict(key='boo'), dict(bars=[dict(key='bar_barr')])]) == ['boo', 'foo']
+        assert resolved_kwargs == [{}]
+        # Filters that need Django's joins, like isnull across a to-many relation, are resolved for each item
+        # of objects, as are all of them if the resolver does more with its kwargs
+        for objects, kwargs, keys in [
+            [[dict(key='foo'), dict(bars=[dict(key_isnull=True)])], {}, ['foo']],
+            [[dict(key='foo'), dict(key='boo')], dict(process_filter_kwargs=None), ['boo', 'foo']]
+        ]:
+            assert resolve(objects, **kwargs) == keys
+            assert resolved_kwargs == R.concat([{}], objects)
+
+    def test_resolve_paginated_for_type_approximate_count(self):
+        def resolve(paginated_type, **kwargs):
+            return resolve_paginated_for_type(paginated_type, foo_resolver, page_size=1000, page=1, **kwargs)
+
+        # Counted unless the paginated type or the call asks for the planner's estimate
+        assert resolve(FooPaginatedType).pages_approximate is False
+        assert resolve(FooPaginatedType, approximate_count_over=0).pages_approximate is True
+        approximate_type = create_paginated_type_mixin(FooType, foo_fields, approximate_count_over=0)['type']
+        assert resolve(approximate_type).pages_approximate is True
+        assert resolve(approximate_type, approximate_count_over=10 ** 9).pages_approximate is False
+
+    def test_get_versioner(self):
+        foo = R.head(self.foos)
+        for i in range(20):
+            foo.name = f'Foo {i}'
+            with reversion.create_revision():
+                reversion.set_user(self.user)
+                foo.save()
+        versions_type = create_version_container_type(FooType, foo_fields)['type']
+
+        with CaptureQueriesContext(connection) as context:
+            versions = get_versioner(Foo.objects.filter(id=foo.id), versions_type).objects
+            names = R.map(lambda version: version._object_version.object.name, versions)
+            usernames = R.map(lambda version: version.revision.user and version.revision.user.username, versions)
+        # The instance, then the versions with their revisions and users
+        assert len(context.captured_queries) <= 3
+        assert names[:2] == ['Foo 19', 'Foo 18'] and R.last(names) == 'Foo'
+        assert usernames[:2] == ['lion', 'lion']
+        assert names == R.map(
+            lambda version: version._object_version.object.name,
+            list(Version.objects.get_for_object(foo))
+        )
+
+    def test_query_versions(self):
+        foo = R.head(self.foos)
+        for i in range(5):
+            foo.name = f'Foo {i}'
+            with reversion.create_revision():
+                reversion.set_user(self.user if i % 2 else self.admin)
+                foo.save()
+        query = 'query($objects: [VersionTypeModelForFooTypeRelatedReadInputType], $limit: Int, $cursor: String, ' \
+                '$before: DateTime, $user: UserTypeRelatedReadInputType) { fooVersions(objects: $objects, ' \
+                'limit: $limit, cursor: $cursor, before: $before, user: $user) { hasNext nextCursor objects { ' \
+                'revision { dateCreated user { username } } instance { name } } } }'
+
+        def execute(**variables):
+            result = self.client.execute(query, variables=R.merge(
+                dict(objects=[dict(instance=dict(id=foo.id))]),
+                variables
+            ))
+            assert not R.prop_or(None, 'errors', result), R.prop('errors', result)
+            versions = R.item_path(['data', 'fooVersions'], result)
+            return [versions, R.map(lambda version: version['instance']['name'], versions['objects'])]
+
+        # Newest first, a window at a time
+        versions, names = execute(limit=2)
+        assert names == ['Foo 4', 'Foo 3'] and versions['hasNext']
+        versions, names = execute(limit=2, cursor=versions['nextCursor'])
+        assert names == ['Foo 2', 'Foo 1'] and versions['hasNext']
+        versions, names = execute(limit=2, cursor=versions['nextCursor'])
+        assert names == ['Foo 0', 'Foo'] and not versions['hasNext'] and not versions['nextCursor']
+
+        versions, names = execute(user=dict(username='lion'))
+        assert names == ['Foo 3', 'Foo 1']
+        all_versions, _ = execute()
+        versions, names = execute(before=R.item_path(['objects', 1, 'revision', 'dateCreated'], all_versions))
+        assert names == ['Foo 2', 'Foo 1', 'Foo 0', 'Foo']
+
+        # A limit that isn't positive is an error of the query rather than of the server
+        for limit in [0, -1]:
+            result = self.client.execute(query, variables=dict(objects=[dict(instance=dict(id=foo.id))], limit=limit))
+            assert 'limit must be a positive number' in R.head(result['errors'])['message']
+
     def test_create(self):
         (result, new_result) = quiz_model_mutation_create(
             self.client, graphql_update_or_create_foo, 'createFoo.foo',
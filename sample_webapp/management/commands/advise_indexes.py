@@ -0,0 +1,5 @@
+from rescape_graphene.django_helpers.management import IndexAdvisorCommand
+
+
+class Command(IndexAdvisorCommand):
+    class_config = 'sample_webapp.sample_schema.default_class_config'
@@ -0,0 +1,5 @@
+from rescape_graphene.django_helpers.management import ProfileSchemaCommand
+
+
+class Command(ProfileSchemaCommand):
+    pass
@@ -0,0 +1,20 @@
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sample_webapp', '0005_auto_20200730_1254'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='foo',
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=['data'],
+                name='foo_data_path_ops',
+                opclasses=['jsonb_path_ops']
+            ),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.gis.db import models
 from django.contrib.gis.db.models import GeometryCollectionField, Model
 from django.contrib.postgres.fields import JSONField
+from django.contrib.postgres.indexes import GinIndex
 from django.db.models import CharField, DateTimeField, ForeignKey, ManyToManyField
 
 import reversion
@@ -42,6 +43,10 @@ class Foo(Model):
 
     class Meta:
         app_label = "sample_webapp"
+        indexes = [
+            # Serves the data__contains filters that process_filter_kwargs makes of data filters
+            GinIndex(fields=['data'], name='foo_data_path_ops', opclasses=['jsonb_path_ops'])
+        ]
 
     def __str__(self):
         return self.name